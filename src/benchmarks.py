@@ -0,0 +1,209 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import statistics
+import tempfile
+import time
+import numpy as np
+import pandas as pd
+from synthetic_gtfs import generate_network
+from data_processing import FEEDS, read_routes, read_stops, find_transfers, update_processed_data
+from data_reading import build_graph
+from network_index import build_network_index
+from find_stops import StopIndex, find_nearest_stops
+from find_routes import find_routes, find_best_routes, iter_best_routes, show_best_routes
+
+BENCHMARKS_PATH = 'data/benchmarks/'
+BENCHMARKS_VERSION = 1
+SCALES = [0.1, 0.3]
+
+def measure(function, repeat=3):
+    """
+    Time a function.
+
+    Args:
+    Function: called without arguments
+    Integer: number of runs
+
+    Returns:
+    Dictionary: minimum and median time in seconds and number of runs
+    """
+    times = []
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start_time)
+    return {'min': min(times), 'median': statistics.median(times), 'runs': repeat}
+
+def get_queries(stop_index, n_queries, seed=0):
+    """
+    Get random origins and destinations near the stops of the network.
+
+    Args:
+    StopIndex: spatial index of the stops
+    Integer: number of queries
+    Integer: seed of the random numbers
+
+    Returns:
+    List: tuples with the latitude and longitude of the origin and of the destination of each query
+    """
+    rng = np.random.default_rng(seed)
+    stops = rng.integers(0, len(stop_index.stop_ids), (n_queries, 2))
+    # within a few hundred meters of a stop
+    offsets = rng.normal(0, 0.002, (n_queries, 2, 2))
+    return [((stop_index.stop_lat[o] + offsets[i, 0, 0], stop_index.stop_lon[o] + offsets[i, 0, 1]),
+             (stop_index.stop_lat[d] + offsets[i, 1, 0], stop_index.stop_lon[d] + offsets[i, 1, 1]))
+            for i, (o, d) in enumerate(stops.tolist())]
+
+def run_scale(scale, ontology_path, repeat=3, n_queries=20, seed=0):
+    """
+    Run the benchmarks on a synthetic network of one scale.
+
+    The data sources are generated and processed in a temporary folder, and then every stage
+    of the pipeline and of the queries is timed on them.
+
+    Args:
+    Float: size of the synthetic data sources relative to the real ones
+    String: path to the ontology file
+    Integer: number of runs of each benchmark
+    Integer: number of queries of the query benchmarks
+    Integer: seed of the random numbers
+
+    Returns:
+    Tuple: times of each benchmark, as returned by measure, and sizes of the network
+    """
+    results = {}
+    with tempfile.TemporaryDirectory() as path:
+        raw_path = path + '/raw/'
+        processed_path = path + '/processed/'
+        os.makedirs(processed_path)
+        sizes = generate_network(raw_path, scale, seed)
+        results['process_feeds'] = measure(lambda: update_processed_data(
+            FEEDS, 1, raw_path, processed_path, processed_path + 'feeds/', None, cache_path=None), 1)
+        routes = read_routes(raw_path + 'M6/')
+        results['read_stops'] = measure(lambda: read_stops(raw_path + 'M6/', routes), repeat)
+        stops = pd.read_csv(processed_path + 'stops.csv', dtype={'stop_id': str, 'stop_name': str, 'route_id': str})
+        results['find_transfers'] = measure(lambda: find_transfers(stops), repeat)
+        results['build_graph'] = measure(lambda: build_graph(ontology_path, processed_path), repeat)
+
+        g = build_graph(ontology_path, processed_path)
+        network = build_network_index(g, processed_path + 'route_transfers.csv', processed_path + 'route_stops.csv')
+        stop_index = StopIndex(stops['stop_id'].values, stops['stop_lat'].values, stops['stop_lon'].values)
+        queries = get_queries(stop_index, n_queries, seed)
+        results['find_nearest_stops'] = measure(lambda: [find_nearest_stops(*point, stop_index=stop_index)
+                                                         for query in queries for point in query], repeat)
+        query_stops = [[find_nearest_stops(*point, stop_index=stop_index) for point in query] for query in queries]
+        results['find_routes'] = measure(lambda: [find_routes(network, *stops) for stops in query_stops], repeat)
+        query_paths = [find_routes(network, *stops) for stops in query_stops]
+
+        def best_routes():
+            # find_best_routes shows the paths on screen
+            with contextlib.redirect_stdout(io.StringIO()):
+                for paths in query_paths:
+                    find_best_routes(network, paths)
+
+        results['find_best_routes'] = measure(best_routes, repeat)
+
+        def pruned_best_routes():
+            with contextlib.redirect_stdout(io.StringIO()):
+                for stops in query_stops:
+                    show_best_routes(network, list(iter_best_routes(network, *stops)))
+
+        results['iter_best_routes'] = measure(pruned_best_routes, repeat)
+        sizes['network'] = {'stops': len(network.stops), 'routes': len(network.routes), 'transfers': len(network.transfers),
+                            'candidate_paths': sum(len(paths) for paths in query_paths)}
+    return results, sizes
+
+def run_benchmarks(scales=SCALES, ontology_path='data/ontology/gtfs.ttl', repeat=3, n_queries=20, seed=0):
+    """
+    Run the benchmarks on synthetic networks of several scales.
+
+    Args:
+    List: sizes of the synthetic data sources relative to the real ones
+    String: path to the ontology file
+    Integer: number of runs of each benchmark
+    Integer: number of queries of the query benchmarks
+    Integer: seed of the random numbers
+
+    Returns:
+    Dictionary: the times of each benchmark and the sizes of the network for each scale, and the machine they ran on
+    """
+    report = {
+        'version': BENCHMARKS_VERSION,
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'cpus': os.cpu_count(),
+        'seed': seed,
+        'scales': {},
+    }
+    for scale in scales:
+        results, sizes = run_scale(scale, ontology_path, repeat, n_queries, seed)
+        report['scales'][str(scale)] = {'results': results, 'sizes': sizes}
+    return report
+
+def compare_reports(report, baseline, tolerance=0.25):
+    """
+    Compare the times of the benchmarks with those of a baseline.
+
+    Args:
+    Dictionary: benchmarks, as returned by run_benchmarks
+    Dictionary: baseline benchmarks, as returned by run_benchmarks
+    Float: relative increase of the time that is considered a regression
+
+    Returns:
+    List: for every benchmark of both, a dictionary with its scale, name, baseline and current minimum times,
+    their ratio and whether it's a regression
+    """
+    comparison = []
+    for scale, current in report['scales'].items():
+        if scale not in baseline['scales']:
+            continue
+        for name, result in current['results'].items():
+            reference = baseline['scales'][scale]['results'].get(name)
+            if reference is None:
+                continue
+            # the minimum is the least affected by other processes
+            ratio = result['min'] / reference['min'] if reference['min'] > 0 else float('inf')
+            comparison.append({'scale': scale, 'name': name, 'baseline': reference['min'], 'current': result['min'],
+                               'ratio': ratio, 'regression': ratio > 1 + tolerance})
+    return comparison
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Time the pipeline and the queries on synthetic networks.')
+    parser.add_argument('--scales', type=float, nargs='+', default=SCALES, help='sizes relative to the real network')
+    parser.add_argument('--repeat', type=int, default=3, help='number of runs of each benchmark')
+    parser.add_argument('--queries', type=int, default=20, help='number of queries of the query benchmarks')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--ontology', default='data/ontology/gtfs.ttl')
+    parser.add_argument('--output', default=BENCHMARKS_PATH + 'latest.json', help='file where the results are saved')
+    parser.add_argument('--baseline', default=BENCHMARKS_PATH + 'baseline.json', help='file with the results to compare with')
+    parser.add_argument('--save-baseline', action='store_true', help='save the results as the new baseline')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='relative slowdown reported as a regression')
+    args = parser.parse_args()
+
+    report = run_benchmarks(args.scales, args.ontology, args.repeat, args.queries, args.seed)
+    os.makedirs(os.path.dirname(args.output) or '.', exist_ok=True)
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    regressions = 0
+    if os.path.exists(args.baseline) and not args.save_baseline:
+        with open(args.baseline, 'r') as f:
+            baseline = json.load(f)
+        for row in compare_reports(report, baseline, args.tolerance):
+            regressions += row['regression']
+            print('{:>6} {:<20} {:10.4f} s {:10.4f} s {:6.2f}x{}'.format(row['scale'], row['name'], row['baseline'], row['current'],
+                                                                     row['ratio'], '  REGRESSION' if row['regression'] else ''))
+    else:
+        for scale, scale_report in report['scales'].items():
+            for name, result in scale_report['results'].items():
+                print('{:>6} {:<20} {:10.4f} s'.format(scale, name, result['min']))
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(args.baseline) or '.', exist_ok=True)
+        with open(args.baseline, 'w') as f:
+            json.dump(report, f, indent=2)
+    if regressions:
+        raise SystemExit('{} benchmarks are slower than the baseline'.format(regressions))
@@ -1,27 +1,85 @@
+import argparse
+import hashlib
+import json
+import os
+import shutil
+from concurrent.futures import ProcessPoolExecutor
 import pandas as pd
 import numpy as np
 import re
+from graph_snapshot import SOURCE_FILES, update_snapshot
+from table_cache import cached_table, file_stamp
 
-def read_routes(input_path):
+RAW_PATH = 'data/raw/crtm/'
+PROCESSED_PATH = 'data/processed/'
+# per-feed outputs, merged into the processed data
+FEEDS_PATH = 'data/processed/feeds/'
+# parsed GTFS files, so that processing a data source again doesn't parse its CSV files
+GTFS_CACHE_PATH = 'data/cache/gtfs/'
+# GTFS data sources, in the order their rows are merged
+FEEDS = ['M4', 'M10', 'M5', 'M6', 'M89']
+GTFS_FILES = ['routes.txt', 'stops.txt', 'trips.txt', 'stop_times.txt']
+# columns of stops.txt used by read_accesses and read_stops
+STOP_COLUMNS = ['stop_id', 'stop_name', 'stop_lat', 'stop_lon', 'location_type', 'parent_station']
+# bump to reprocess every feed when the processing changes
+FEED_VERSION = 2
+# bump to find the close stops of every pair of feeds again when find_close_stops changes
+TRANSFERS_VERSION = 1
+# stamp of the processed data, answers found with other processed data are stale
+DATA_VERSION_FILE = 'version.json'
+
+def get_feed(input_path):
+    """
+    Get the name of a GTFS data source from its path.
+
+    Args:
+    String: path to the GTFS data source.
+
+    Returns:
+    String: name of the folder of the data source, like 'M4'
+    """
+    return os.path.basename(os.path.normpath(input_path))
+
+def read_gtfs_table(input_path, name, columns, dtype=None, cache_path=None):
+    """
+    Read the columns of a file of one GTFS data source, from the parse cache if it's there.
+
+    Args:
+    String: path to the GTFS data source.
+    String: name of the file
+    List: names of the columns to read, the others aren't parsed
+    Dictionary: names of the dtypes of some columns
+    String: path to the parse cache of the data source, or None not to use it
+
+    Returns:
+    Pandas dataframe with the columns of the file that are in the list.
+    """
+    filename = input_path + name
+    key = {'file': file_stamp(filename), 'columns': columns, 'dtype': dtype}
+    return cached_table(key, None if cache_path is None else cache_path + name + '/',
+                        lambda: pd.read_csv(filename, usecols=lambda column: column in columns, dtype=dtype))
+
+def read_routes(input_path, cache_path=None):
     """
     Get the Routes from one GTFS data source.
 
     Args:
     String: path to the GTFS data source.
+    String: path to the parse cache of the data source, or None not to use it
 
     Returns:
     Pandas dataframe with columns: 'route_id', 'route_short_name', 'route_long_name' and 'route_type'.
     """
-    routes = pd.read_csv(input_path + 'routes.txt')
     columns = ['route_id', 'route_short_name', 'route_long_name', 'route_type']
+    routes = read_gtfs_table(input_path, 'routes.txt', columns, cache_path=cache_path)
     routes = pd.DataFrame(routes, columns=columns)
     # drop night bus lines
-    if input_path in ['data/raw/crtm/M6/', 'data/raw/crtm/M89/']:
+    if get_feed(input_path) in ['M6', 'M89']:
         routes.drop(routes[routes['route_short_name'].str.startswith('N')].index, inplace=True)
     routes['route_type'] = 'mode_' + routes['route_type'].astype(str)
     return routes
 
-def read_accesses(input_path):
+def read_accesses(input_path, cache_path=None):
     """
     Get the accesses to stops from one GTFS data source.
 
@@ -30,11 +88,12 @@ def read_accesses(input_path):
 
     Args:
     String: path to the GTFS data source.
+    String: path to the parse cache of the data source, or None not to use it
 
     Returns:
     Pandas dataframe with columns: 'access_id', 'access_lat', 'access_lon' and 'parent_station'.
     """
-    accesses = pd.read_csv(input_path + 'stops.txt', dtype = {'stop_id': str})
+    accesses = read_gtfs_table(input_path, 'stops.txt', STOP_COLUMNS, {'stop_id': 'str'}, cache_path)
     accesses = accesses[accesses.location_type == 2]
     columns = ['stop_id', 'stop_lat', 'stop_lon', 'parent_station']
     accesses = pd.DataFrame(accesses, columns=columns)
@@ -56,50 +115,123 @@ def update_trips_and_stop_times(input_path):
     Returns:
     Void
     """
-    stops_by_itinerary = pd.read_csv(input_path + 'M5_ParadasPorItinerario.csv', dtype = {'CODIGOITINERARIO': str})
+    columns = ['CODIGOGESTIONLINEA', 'CODIGOITINERARIO', 'IDFESTACION', 'NUMEROORDEN']
+    stops_by_itinerary = pd.read_csv(input_path + 'M5_ParadasPorItinerario.csv', usecols=columns, dtype = {'CODIGOITINERARIO': str})
     stops_by_itinerary['CODIGOGESTIONLINEA'] = '5__' + stops_by_itinerary['CODIGOGESTIONLINEA'] + '___'
     stops_by_itinerary['CODIGOGESTIONLINEA'] = np.where(stops_by_itinerary['CODIGOGESTIONLINEA'] == '5__C4A___', '5__C4_A__', stops_by_itinerary['CODIGOGESTIONLINEA'])
     stops_by_itinerary['CODIGOGESTIONLINEA'] = np.where(stops_by_itinerary['CODIGOGESTIONLINEA'] == '5__C4B___', '5__C4_B__', stops_by_itinerary['CODIGOGESTIONLINEA'])
     stops_by_itinerary['IDFESTACION'] = 'par_' + stops_by_itinerary['IDFESTACION']
-    stops_by_itinerary.rename(columns={'CODIGOGESTIONLINEA': 'route_id', 'CODIGOITINERARIO': 'trip_id', 'IDFESTACION': 'stop_id'}, inplace=True)
+    stops_by_itinerary.rename(columns={'CODIGOGESTIONLINEA': 'route_id', 'CODIGOITINERARIO': 'trip_id', 'IDFESTACION': 'stop_id',
+                                       'NUMEROORDEN': 'stop_sequence'}, inplace=True)
     columns = ['route_id', 'trip_id']
     trips = pd.DataFrame(stops_by_itinerary, columns=columns).drop_duplicates()
+    # every itinerary of a line is kept as a direction of the route
+    trips['direction_id'] = trips.groupby('route_id').cumcount()
     trips.to_csv(input_path + 'trips.txt', index=False) 
-    columns = ['trip_id', 'stop_id']
+    columns = ['trip_id', 'stop_id', 'stop_sequence']
     stop_times = pd.DataFrame(stops_by_itinerary, columns=columns).drop_duplicates()
     stop_times.to_csv(input_path + 'stop_times.txt', index=False) 
     
-def read_stops(input_path, routes):
+def read_stop_times(input_path, trip_ids, cache_path=None, chunksize=500000):
+    """
+    Get the stops visited by some trips of one GTFS data source, in order.
+
+    stop_times.txt is by far the largest file of the bus data sources, so it's read by chunks of rows,
+    parsing only the columns trip_id, stop_id and stop_sequence and keeping only the rows of the given trips.
+
+    Args:
+    String: path to the GTFS data source.
+    Iterable: trip_id of the trips
+    String: path to the parse cache of the data source, or None not to use it
+    Integer: number of rows read at once
+
+    Returns:
+    Pandas dataframe with columns: 'trip_id', 'stop_id' and 'stop_sequence', without duplicates
+    and sorted by trip and stop_sequence.
+    """
+    filename = input_path + 'stop_times.txt'
+    trip_ids = sorted(set(trip_ids))
+    columns = ['trip_id', 'stop_id', 'stop_sequence']
+
+    def build():
+        chunks = [pd.DataFrame({'trip_id': pd.Series(dtype=str), 'stop_id': pd.Series(dtype=str),
+                                'stop_sequence': pd.Series(dtype=np.int64)})]
+        with pd.read_csv(filename, usecols=columns, dtype={'trip_id': str, 'stop_id': str}, chunksize=chunksize) as reader:
+            for chunk in reader:
+                chunks.append(chunk[chunk['trip_id'].isin(trip_ids)][columns].drop_duplicates())
+        stop_times = pd.concat(chunks, ignore_index=True).drop_duplicates()
+        stop_times['stop_sequence'] = stop_times['stop_sequence'].astype(np.int64)
+        return stop_times.sort_values(['trip_id', 'stop_sequence'], kind='stable')
+
+    key = {'file': file_stamp(filename), 'columns': columns, 'trips': hashlib.sha256('\n'.join(trip_ids).encode()).hexdigest()}
+    return cached_table(key, None if cache_path is None else cache_path + 'stop_times.txt/', build)
+
+def read_trips(input_path, routes, cache_path=None):
+    """
+    Get the trips that represent the routes of one GTFS data source, one for each direction of every route.
+
+    Args:
+    String: path to the GTFS data source.
+    Pandas dataframe: routes
+    String: path to the parse cache of the data source, or None not to use it
+
+    Returns:
+    Pandas dataframe with columns: 'route_id', 'trip_id' and 'direction_id'.
+    """
+    columns = ['route_id', 'trip_id', 'direction_id']
+    trips = read_gtfs_table(input_path, 'trips.txt', columns, {'trip_id': 'str'}, cache_path)
+    trips = pd.DataFrame(trips, columns=columns)
+    # without direction_id, the first trip of every route represents it
+    trips['direction_id'] = trips['direction_id'].fillna(0).astype(np.int64)
+    # leave out the routes that were dropped
+    return trips[trips['route_id'].isin(routes['route_id'])].drop_duplicates(subset=['route_id', 'direction_id'])
+
+def read_route_stops(input_path, routes, cache_path=None):
+    """
+    Get the stops of every direction of the routes of one GTFS data source, in the order they are visited.
+
+    Args:
+    String: path to the GTFS data source.
+    Pandas dataframe: routes
+    String: path to the parse cache of the data source, or None not to use it
+
+    Returns:
+    Pandas dataframe with columns: 'route_id', 'direction_id', 'stop_sequence' and 'stop_id',
+    sorted by route, direction and stop_sequence.
+    """
+    trips = read_trips(input_path, routes, cache_path)
+    # stop_times, only those of the trips
+    stop_times = read_stop_times(input_path, trips['trip_id'], cache_path)
+    route_stops = trips.merge(stop_times).sort_values(['route_id', 'direction_id', 'stop_sequence'], kind='stable')
+    columns = ['route_id', 'direction_id', 'stop_sequence', 'stop_id']
+    return pd.DataFrame(route_stops, columns=columns).reset_index(drop=True)
+
+def read_stops(input_path, routes, cache_path=None, route_stops=None):
     """
     Get the stops from one GTFS data source.
 
     To link each stop with its route, it's needed to merge data from four sources:
-    stops, stop_times, trips and routes.
+    stops, stop_times, trips and routes. A stop belongs to a route if any direction of the route visits it.
 
     Args:
     String: path to the GTFS data source.
     Pandas dataframe: routes
+    String: path to the parse cache of the data source, or None not to use it
+    Pandas dataframe: stops of the routes as returned by read_route_stops, read if None
 
     Returns:
     Pandas dataframe with columns: 'stop_id' and 'stop_name', 'stop_lat', 'stop_lon', 'parent_station' and 'route_id'.
     """
-    # stop_times
-    stop_times = pd.read_csv(input_path + 'stop_times.txt', dtype = {'stop_id': str})
-    columns = ['trip_id', 'stop_id']
-    stop_times = pd.DataFrame(stop_times, columns=columns).drop_duplicates()
-    # trips
-    trips = pd.read_csv(input_path + 'trips.txt')
-    columns = ['route_id', 'trip_id']
-    trips = pd.DataFrame(trips, columns=columns).drop_duplicates(subset=['route_id'])
-    trips = trips.merge(routes)
-    trips = trips.merge(stop_times)
+    if route_stops is None:
+        route_stops = read_route_stops(input_path, routes, cache_path)
+    trips = pd.DataFrame(route_stops, columns=['route_id', 'stop_id']).drop_duplicates().merge(routes)
     # stops
-    stops = pd.read_csv(input_path + 'stops.txt', dtype = {'stop_id': str})
+    stops = read_gtfs_table(input_path, 'stops.txt', STOP_COLUMNS, {'stop_id': 'str'}, cache_path)
     stops = stops[stops.location_type == 0]
     columns = ['stop_id', 'stop_name', 'stop_lat', 'stop_lon', 'parent_station']
     stops = pd.DataFrame(stops, columns=columns)
     # For subway and light subway, if there is no parent_station, create it based on stop_id.
-    if input_path in ['data/raw/crtm/M4/', 'data/raw/crtm/M10/']:
+    if get_feed(input_path) in ['M4', 'M10']:
         stops['parent_station'] = np.where(stops['parent_station'].isnull(), stops['stop_id'].str.replace('par', 'est'), stops['parent_station'])
     stops = stops.merge(trips)
     columns = ['stop_id', 'stop_name', 'stop_lat', 'stop_lon', 'parent_station', 'route_id']
@@ -129,96 +261,567 @@ def calculate_distance(lat1, lon1, lat2, lon2):
     array = np.where(array <= 1, array, 1)                           
     return 6371.01 * np.arccos(array)
 
-def find_transfers(stops):
+def find_route_distances(route_stops, stops):
+    """
+    find the distance along every direction of every route from its first stop to each of its stops.
+
+    The distance between consecutive stops is the straight-line distance between them, so the distance
+    between any two stops of a direction is the difference of their distances from the first stop.
+    Stops with several locations, like the accesses of a subway station, are placed at their mean location.
+
+    Args:
+    Pandas dataframe: stops of the routes as returned by read_route_stops
+    Pandas dataframe: stops, with their final geographic coordinates
+
+    Returns:
+    Pandas dataframe with columns: 'route_id', 'direction_id', 'stop_sequence', 'stop_id' and 'distance',
+    without the stops that have no location.
+    """
+    coordinates = stops.groupby('stop_id', sort=False)[['stop_lat', 'stop_lon']].mean().dropna()
+    route_stops = route_stops.merge(coordinates, left_on='stop_id', right_index=True)
+    route_stops = route_stops.sort_values(['route_id', 'direction_id', 'stop_sequence'], kind='stable').reset_index(drop=True)
+    lat = route_stops['stop_lat'].values
+    lon = route_stops['stop_lon'].values
+    # the first stop of every direction starts a new sum
+    first = np.ones(len(route_stops), dtype=bool)
+    first[1:] = ((route_stops['route_id'].values[1:] != route_stops['route_id'].values[:-1]) |
+                 (route_stops['direction_id'].values[1:] != route_stops['direction_id'].values[:-1]))
+    legs = np.zeros(len(route_stops))
+    legs[1:] = calculate_distance(lat[:-1], lon[:-1], lat[1:], lon[1:])
+    legs[first] = 0
+    distances = np.cumsum(legs)
+    starts = np.flatnonzero(first)
+    distances -= np.repeat(distances[starts], np.diff(np.append(starts, len(route_stops))))
+    route_stops['distance'] = np.round(distances, 6)
+    columns = ['route_id', 'direction_id', 'stop_sequence', 'stop_id', 'distance']
+    return route_stops[columns]
+
+def find_close_stops(lat_from, lon_from, lat_to, lon_to, radius=0.25, block_size=1024):
+    """
+    find the pairs of stops of two sets that are close to each other, thus one can walk from one to the other.
+
+    The first stops are swept in order of latitude, by blocks of block_size stops. Each block is only
+    compared with the second stops whose latitude is close enough, because the distance between two
+    points is never lower than the distance between their latitudes. Memory use is proportional
+    to the number of stops and transfers instead of to the product of the numbers of stops.
+
+    Args:
+    Numpy array: latitude of the first stops
+    Numpy array: longitude of the first stops
+    Numpy array: latitude of the second stops
+    Numpy array: longitude of the second stops
+    Float: maximum walking distance in kilometers between two stops
+    Integer: number of stops compared at once with their neighbours
+
+    Returns:
+    Tuple: arrays with the row of the first stop and the row of the second stop of every pair
+    """
+    order_from = np.argsort(lat_from, kind='stable')
+    order_to = np.argsort(lat_to, kind='stable')
+    sorted_lat_from = lat_from[order_from]
+    sorted_lat_to = lat_to[order_to]
+    # latitude difference equivalent to the walking distance, with a margin for rounding
+    max_lat_difference = 1.01 * radius / (6371.01 * np.pi / 180)
+    pairs_from = [np.empty(0, dtype=np.int64)]
+    pairs_to = [np.empty(0, dtype=np.int64)]
+    for start in range(0, len(order_from), block_size):
+        block = order_from[start:start + block_size]
+        low = np.searchsorted(sorted_lat_to, sorted_lat_from[start] - max_lat_difference, side='left')
+        high = np.searchsorted(sorted_lat_to, sorted_lat_from[min(start + block_size, len(order_from)) - 1] + max_lat_difference,
+                               side='right')
+        candidates = order_to[low:high]
+        distances = calculate_distance(lat_from[block][:, None], lon_from[block][:, None],
+                                       lat_to[candidates][None, :], lon_to[candidates][None, :])
+        # filter distances below the walking distance
+        # and discard reflexive transfers
+        rows, columns = np.nonzero((distances < radius) & (distances > 0))
+        pairs_from.append(block[rows])
+        pairs_to.append(candidates[columns])
+    return np.concatenate(pairs_from), np.concatenate(pairs_to)
+
+def find_transfers(stops, radius=0.25, block_size=1024):
     """
     find the stops that are close to each other, thus one can walk from one to the other.
 
     Args:
     Pandas dataframe: stops
+    Float: maximum walking distance in kilometers between two stops
+    Integer: number of stops compared at once with their neighbours
 
     Returns:
     Pandas dataframe with columns: 'transfer_id', 'transfer_from' and 'transfer_to'.
     """
-    geo_coords = pd.DataFrame(stops, columns=['stop_id', 'stop_lat', 'stop_lon'])
-    geo_coords = geo_coords.set_index('stop_id')
-    geo_coords.index.name = None
-    # calculate the distance between each pair of stops
-    lat1 = geo_coords['stop_lat'].values[:, None]  
-    lon1 = geo_coords['stop_lon'].values[:, None]  
-    lat2 = geo_coords['stop_lat'].values[None, :]  
-    lon2 = geo_coords['stop_lon'].values[None, :]  
-    distances_array = calculate_distance(lat1, lon1, lat2, lon2)
-    distances = pd.DataFrame(distances_array, index=geo_coords.index, columns=geo_coords.index)
-    transfers = (
-        # filter distances below 0.25 kilometers
-        # and discard reflexive transfers
-        distances[distances < 0.25][distances > 0]
-        .stack()
-        .reset_index()
-        .rename(columns={0: 'distance', 'level_0': 'transfer_from', 'level_1': 'transfer_to'})
-       )
+    lat = stops['stop_lat'].values.astype(np.float64)
+    lon = stops['stop_lon'].values.astype(np.float64)
+    transfers_from, transfers_to = find_close_stops(lat, lon, lat, lon, radius, block_size)
+    return make_transfers(stops['stop_id'].values, transfers_from, transfers_to)
+
+def make_transfers(stop_ids, transfers_from, transfers_to):
+    """
+    Get the transfers between pairs of rows of the stops.
+
+    Args:
+    Numpy array: stop_id of every row of the stops
+    Numpy array: row of the stop where each transfer starts
+    Numpy array: row of the stop where each transfer ends
+
+    Returns:
+    Pandas dataframe with columns: 'transfer_id', 'transfer_from' and 'transfer_to'.
+    """
+    # list the pairs in the same order as the rows of the stops
+    pairs = np.lexsort((transfers_to, transfers_from))
+    transfers = pd.DataFrame({
+        'transfer_from': stop_ids[transfers_from[pairs]],
+        'transfer_to': stop_ids[transfers_to[pairs]],
+    })
     # generate a transfer_id
     transfers['transfer_id'] = transfers['transfer_from'].astype(str) + '_to_' + transfers['transfer_to'].astype(str)
     transfers = transfers[['transfer_id', 'transfer_from', 'transfer_to']]
     transfers.drop_duplicates(subset=['transfer_id'], inplace=True)
     return transfers
 
-# Process subway data source
-routes = read_routes('data/raw/crtm/M4/')
-routes.to_csv('data/processed/routes.csv', index=False)
-accesses = read_accesses('data/raw/crtm/M4/')
-accesses.to_csv('data/processed/accesses.csv', index=False)
-stops = read_stops('data/raw/crtm/M4/', routes)
-# replace geographic coordinates of stops for those of the accesses to the cooresponding parent_station
-stops = stops.merge(accesses, on='parent_station', how='left')
-stops['stop_lat'] = stops['access_lat']
-stops['stop_lon'] = stops['access_lon']
-columns = ['stop_id', 'stop_name', 'stop_lat', 'stop_lon', 'route_id']
-stops = pd.DataFrame(stops, columns=columns)
-stops.to_csv('data/processed/stops.csv', index=False)
-
-# Process light subway data source
-routes = read_routes('data/raw/crtm/M10/')
-routes.to_csv('data/processed/routes.csv', index=False, header=False, mode='a')
-accesses = read_accesses('data/raw/crtm/M10/')
-accesses.to_csv('data/processed/accesses.csv', index=False)
-stops = read_stops('data/raw/crtm/M10/', routes)
-# replace geographic coordinates of stops for those of the accesses to the cooresponding parent_station
-# if there isn't any access, then leave geographic coordinates as they are
-stops = stops.merge(accesses, on='parent_station', how='left')
-stops['stop_lat'] = np.where(np.isnan(stops['access_lat']), stops['stop_lat'], stops['access_lat'])
-stops['stop_lon'] = np.where(np.isnan(stops['access_lon']), stops['stop_lon'], stops['access_lon'])
-columns = ['stop_id', 'stop_name', 'stop_lat', 'stop_lon', 'route_id']
-stops = pd.DataFrame(stops, columns=columns)
-stops.to_csv('data/processed/stops.csv', index=False, header=False, mode='a')
-
-# Process rail data source
-routes = read_routes('data/raw/crtm/M5/')
-routes.to_csv('data/processed/routes.csv', index=False, header=False, mode='a')
-update_trips_and_stop_times('data/raw/crtm/M5/')
-stops = read_stops('data/raw/crtm/M5/', routes)
-columns = ['stop_id', 'stop_name', 'stop_lat', 'stop_lon', 'route_id']
-stops = pd.DataFrame(stops, columns=columns)
-stops.to_csv('data/processed/stops.csv', index=False, header=False, mode='a')
-
-
-# Process city bus data source
-routes = read_routes('data/raw/crtm/M6/')
-routes.to_csv('data/processed/routes.csv', index=False, header=False, mode='a')
-stops = read_stops('data/raw/crtm/M6/', routes)
-columns = ['stop_id', 'stop_name', 'stop_lat', 'stop_lon', 'route_id']
-stops = pd.DataFrame(stops, columns=columns)
-stops.to_csv('data/processed/stops.csv', index=False, header=False, mode='a')
-
-# Process intercity bus data source
-routes = read_routes('data/raw/crtm/M89/')
-routes.to_csv('data/processed/routes.csv', index=False, header=False, mode='a')
-stops = read_stops('data/raw/crtm/M89/', routes)
-columns = ['stop_id', 'stop_name', 'stop_lat', 'stop_lon', 'route_id']
-stops = pd.DataFrame(stops, columns=columns)
-stops.to_csv('data/processed/stops.csv', index=False, header=False, mode='a')
-
-# Find and save transfers
-stops = pd.read_csv('data/processed/stops.csv', dtype = {'stop_id': str, 'stop_name': str, 'route_id': str})
-transfers = find_transfers(stops)
-transfers.to_csv('data/processed/transfers.csv', index=False)
+def update_transfers(stops, feeds=FEEDS, feeds_path=FEEDS_PATH, radius=0.25, block_size=1024):
+    """
+    find the transfers between the stops, only computing the distances between the stops of the data sources that changed.
+
+    The stops are the concatenation of the stops of every data source, so the close pairs of stops are found
+    for every ordered pair of data sources and saved with the fingerprints of both. A pair of data sources
+    whose fingerprints didn't change keeps its close stops, and the transfers are the same as those of find_transfers.
+
+    Args:
+    Pandas dataframe: stops, merged by merge_feeds
+    List: names of the data sources, in the order they were merged
+    String: path to the folder with the per-feed outputs
+    Float: maximum walking distance in kilometers between two stops
+    Integer: number of stops compared at once with their neighbours
+
+    Returns:
+    Pandas dataframe with columns: 'transfer_id', 'transfer_from' and 'transfer_to'.
+    """
+    feeds = [feed for feed in feeds if os.path.exists(feeds_path + feed + '/stops.csv')]
+    sizes = [len(pd.read_csv(feeds_path + feed + '/stops.csv', usecols=['stop_id'])) for feed in feeds]
+    if sum(sizes) != len(stops):
+        # the stops weren't merged from these data sources
+        return find_transfers(stops, radius, block_size)
+    offsets = dict(zip(feeds, np.cumsum([0] + sizes[:-1]).tolist()))
+    sizes = dict(zip(feeds, sizes))
+    fingerprints = {feed: read_feed_fingerprint(feed, feeds_path) for feed in feeds}
+    lat = stops['stop_lat'].values.astype(np.float64)
+    lon = stops['stop_lon'].values.astype(np.float64)
+    transfers_path = feeds_path + 'transfers/'
+    os.makedirs(transfers_path, exist_ok=True)
+    try:
+        with open(transfers_path + 'meta.json', 'r') as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        meta = {}
+    if meta.get('version') != TRANSFERS_VERSION or meta.get('radius') != radius:
+        meta = {'version': TRANSFERS_VERSION, 'radius': radius, 'blocks': {}}
+    transfers_from = []
+    transfers_to = []
+    for feed_from in feeds:
+        for feed_to in feeds:
+            name = feed_from + '_' + feed_to
+            key = [fingerprints[feed_from], fingerprints[feed_to]]
+            rows_from = slice(offsets[feed_from], offsets[feed_from] + sizes[feed_from])
+            rows_to = slice(offsets[feed_to], offsets[feed_to] + sizes[feed_to])
+            pairs = None
+            if meta['blocks'].get(name) == key and None not in key:
+                try:
+                    pairs = np.load(transfers_path + name + '.npy', allow_pickle=False)
+                except (OSError, ValueError):
+                    pairs = None
+            if pairs is None:
+                pairs = np.array(find_close_stops(lat[rows_from], lon[rows_from], lat[rows_to], lon[rows_to], radius, block_size))
+                # the metadata is written last, so an interrupted run doesn't list blocks that were overwritten
+                if os.path.exists(transfers_path + 'meta.json'):
+                    os.remove(transfers_path + 'meta.json')
+                np.save(transfers_path + name + '.npy', pairs, allow_pickle=False)
+                meta['blocks'][name] = key
+            transfers_from.append(pairs[0] + offsets[feed_from])
+            transfers_to.append(pairs[1] + offsets[feed_to])
+    with open(transfers_path + 'meta.json', 'w') as f:
+        json.dump(meta, f)
+    return make_transfers(stops['stop_id'].values, np.concatenate(transfers_from), np.concatenate(transfers_to))
+
+def find_route_transfers(stops, transfers):
+    """
+    find, for every pair of different routes, the transfers from a stop of the first route to a stop of the second one.
+
+    Args:
+    Pandas dataframe: stops
+    Pandas dataframe: transfers
+
+    Returns:
+    Pandas dataframe with columns: 'route_from', 'route_to', 'transfer_from' and 'transfer_to', sorted by all of them.
+    """
+    stop_routes = pd.DataFrame(stops, columns=['stop_id', 'route_id']).drop_duplicates()
+    route_transfers = (
+        pd.DataFrame(transfers, columns=['transfer_from', 'transfer_to'])
+        .merge(stop_routes.rename(columns={'stop_id': 'transfer_from', 'route_id': 'route_from'}))
+        .merge(stop_routes.rename(columns={'stop_id': 'transfer_to', 'route_id': 'route_to'}))
+       )
+    # staying on the same route isn't a transfer between routes
+    route_transfers = route_transfers[route_transfers['route_from'] != route_transfers['route_to']]
+    columns = ['route_from', 'route_to', 'transfer_from', 'transfer_to']
+    return route_transfers[columns].sort_values(columns).reset_index(drop=True)
+
+def connected_components(n, nodes_from, nodes_to):
+    """
+    Label the connected components of an undirected graph.
+
+    Args:
+    Integer: number of nodes
+    Numpy array: node where each edge starts
+    Numpy array: node where each edge ends
+
+    Returns:
+    Numpy array: for every node, the lowest node of its component
+    """
+    labels = np.arange(n)
+    while True:
+        # every node takes the lowest label of its neighbours, and then the label of its label
+        lowest = np.minimum(labels[nodes_from], labels[nodes_to])
+        new_labels = labels.copy()
+        np.minimum.at(new_labels, nodes_from, lowest)
+        np.minimum.at(new_labels, nodes_to, lowest)
+        new_labels = new_labels[new_labels]
+        if (new_labels == labels).all():
+            return labels
+        labels = new_labels
+
+def find_stations(stops, radius=0.15, block_size=1024):
+    """
+    find the stations, clustering the stops that are platforms of the same place.
+
+    Stops with the same name that are closer than radius to each other, directly or through other stops
+    with that name, are platforms of the same station, like the platforms of the lines of a subway station
+    or the stops at both sides of a street. A stop with several rows, like the accesses of a subway station,
+    is placed at their mean location, and a station at the mean location of its stops.
+
+    Args:
+    Pandas dataframe: stops
+    Float: maximum distance in kilometers between two platforms of a station
+    Integer: number of stops compared at once with their neighbours
+
+    Returns:
+    Tuple: Pandas dataframes with columns 'station_id', 'station_name', 'station_lat' and 'station_lon',
+    and with columns 'stop_id' and 'station_id'. The station_id is the stop_id of its first stop with prefix 'sta_'.
+    """
+    platforms = stops.groupby('stop_id', sort=False).agg(stop_name=('stop_name', 'first'), stop_lat=('stop_lat', 'mean'),
+                                                         stop_lon=('stop_lon', 'mean')).reset_index()
+    lat = platforms['stop_lat'].values.astype(np.float64)
+    lon = platforms['stop_lon'].values.astype(np.float64)
+    close_from, close_to = find_close_stops(lat, lon, lat, lon, radius, block_size)
+    names = platforms['stop_name'].fillna('').str.strip().str.upper().values
+    same_name = names[close_from] == names[close_to]
+    # find_close_stops leaves out the stops at the same location, like platforms with the same accesses
+    same_place = pd.Series(np.arange(len(platforms))).groupby([names, lat, lon]).transform('min').values
+    labels = connected_components(len(platforms), np.concatenate([close_from[same_name], np.arange(len(platforms))]),
+                                  np.concatenate([close_to[same_name], same_place]))
+    platforms['station_id'] = 'sta_' + platforms['stop_id'].values[labels]
+    stations = platforms.groupby('station_id', sort=False).agg(station_name=('stop_name', 'first'), station_lat=('stop_lat', 'mean'),
+                                                               station_lon=('stop_lon', 'mean')).reset_index()
+    stations[['station_lat', 'station_lon']] = stations[['station_lat', 'station_lon']].round(6)
+    return stations, platforms[['stop_id', 'station_id']]
+
+def find_station_transfers(stations, stop_stations, transfers):
+    """
+    find the transfers between stations, from the transfers between their platforms.
+
+    Transfers between platforms of the same station aren't listed, as changing routes inside a station
+    is always possible, and the transfers between the same stations are listed once.
+
+    Args:
+    Pandas dataframe: stations, as returned by find_stations
+    Pandas dataframe: station of every stop, as returned by find_stations
+    Pandas dataframe: transfers
+
+    Returns:
+    Pandas dataframe with columns: 'station_from', 'station_to' and 'distance', the distance in kilometers
+    between the locations of the stations.
+    """
+    station_of = stop_stations.set_index('stop_id')['station_id']
+    station_transfers = pd.DataFrame({
+        'station_from': station_of.reindex(transfers['transfer_from']).values,
+        'station_to': station_of.reindex(transfers['transfer_to']).values,
+    }).dropna()
+    station_transfers = station_transfers[station_transfers['station_from'] != station_transfers['station_to']]
+    station_transfers = station_transfers.drop_duplicates().sort_values(['station_from', 'station_to']).reset_index(drop=True)
+    coordinates = stations.set_index('station_id')[['station_lat', 'station_lon']]
+    coordinates_from = coordinates.loc[station_transfers['station_from']].values
+    coordinates_to = coordinates.loc[station_transfers['station_to']].values
+    station_transfers['distance'] = np.round(calculate_distance(coordinates_from[:, 0], coordinates_from[:, 1],
+                                                                coordinates_to[:, 0], coordinates_to[:, 1]), 6)
+    return station_transfers
+
+def get_feed_files(feed):
+    """
+    Get the raw files a GTFS data source is processed from.
+
+    The trips.txt and stop_times.txt files of the Railway data source are written by
+    update_trips_and_stop_times, so its source is M5_ParadasPorItinerario.csv instead.
+
+    Args:
+    String: name of the data source
+
+    Returns:
+    List: names of the files
+    """
+    if feed == 'M5':
+        return ['routes.txt', 'stops.txt', 'M5_ParadasPorItinerario.csv']
+    return GTFS_FILES
+
+def feed_fingerprint(feed, raw_path=RAW_PATH):
+    """
+    Get a fingerprint of the raw files of a GTFS data source.
+
+    Args:
+    String: name of the data source
+    String: path to the folder with the raw data sources
+
+    Returns:
+    String: SHA-256 digest of the files and the version of the processing
+    """
+    sha = hashlib.sha256('{}:{}'.format(feed, FEED_VERSION).encode())
+    for name in get_feed_files(feed):
+        sha.update(name.encode())
+        with open(raw_path + feed + '/' + name, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                sha.update(chunk)
+    return sha.hexdigest()
+
+def read_feed_fingerprint(feed, feeds_path=FEEDS_PATH):
+    """
+    Get the fingerprint of the raw files the outputs of a data source were processed from.
+
+    Args:
+    String: name of the data source
+    String: path to the folder with the per-feed outputs
+
+    Returns:
+    String: the fingerprint, or None if the data source hasn't been processed
+    """
+    try:
+        with open(feeds_path + feed + '/meta.json', 'r') as f:
+            return json.load(f)['fingerprint']
+    except (OSError, ValueError, KeyError):
+        return None
+
+def process_feed(feed, raw_path=RAW_PATH, feeds_path=FEEDS_PATH, cache_path=GTFS_CACHE_PATH):
+    """
+    Process one GTFS data source and save its routes, stops, accesses and stops of every direction
+    of its routes in its own folder.
+
+    Args:
+    String: name of the data source
+    String: path to the folder with the raw data sources
+    String: path to the folder with the per-feed outputs
+    String: path to the parse cache of the GTFS files, or None not to use it
+
+    Returns:
+    String: fingerprint of the raw files of the data source
+    """
+    input_path = raw_path + feed + '/'
+    output_path = feeds_path + feed + '/'
+    if cache_path is not None:
+        cache_path = cache_path + feed + '/'
+    fingerprint = feed_fingerprint(feed, raw_path)
+    # the metadata is written last, so an interrupted run leaves the feed to be processed again
+    if os.path.exists(output_path):
+        shutil.rmtree(output_path)
+    os.makedirs(output_path)
+    routes = read_routes(input_path, cache_path)
+    routes.to_csv(output_path + 'routes.csv', index=False)
+    if feed == 'M5':
+        update_trips_and_stop_times(input_path)
+    route_stops = read_route_stops(input_path, routes, cache_path)
+    stops = read_stops(input_path, routes, cache_path, route_stops)
+    if feed in ['M4', 'M10']:
+        accesses = read_accesses(input_path, cache_path)
+        accesses.to_csv(output_path + 'accesses.csv', index=False)
+        # replace geographic coordinates of stops for those of the accesses to the cooresponding parent_station
+        stops = stops.merge(accesses, on='parent_station', how='left')
+        if feed == 'M4':
+            stops['stop_lat'] = stops['access_lat']
+            stops['stop_lon'] = stops['access_lon']
+        else:
+            # if there isn't any access, then leave geographic coordinates as they are
+            stops['stop_lat'] = np.where(np.isnan(stops['access_lat']), stops['stop_lat'], stops['access_lat'])
+            stops['stop_lon'] = np.where(np.isnan(stops['access_lon']), stops['stop_lon'], stops['access_lon'])
+    columns = ['stop_id', 'stop_name', 'stop_lat', 'stop_lon', 'route_id']
+    stops = pd.DataFrame(stops, columns=columns)
+    stops.to_csv(output_path + 'stops.csv', index=False)
+    find_route_distances(route_stops, stops).to_csv(output_path + 'route_stops.csv', index=False)
+    with open(output_path + 'meta.json', 'w') as f:
+        json.dump({'feed': feed, 'fingerprint': fingerprint}, f)
+    return fingerprint
+
+def merge_feeds(feeds=FEEDS, feeds_path=FEEDS_PATH, processed_path=PROCESSED_PATH):
+    """
+    Concatenate the routes, stops, accesses and stops of the routes of the data sources into the processed data.
+
+    The header of each file is written once, followed by the rows of every data source in order.
+
+    Args:
+    List: names of the data sources
+    String: path to the folder with the per-feed outputs
+    String: path to the folder with the processed data
+
+    Returns:
+    Void
+    """
+    for name in ['routes.csv', 'stops.csv', 'accesses.csv', 'route_stops.csv']:
+        filenames = [feeds_path + feed + '/' + name for feed in feeds if os.path.exists(feeds_path + feed + '/' + name)]
+        with open(processed_path + name, 'w', newline='') as output:
+            for i, filename in enumerate(filenames):
+                with open(filename, 'r', newline='') as f:
+                    header = f.readline()
+                    if i == 0:
+                        output.write(header)
+                    shutil.copyfileobj(f, output)
+
+def data_version(processed_path=PROCESSED_PATH):
+    """
+    Get the version of the processed data the graph and its index are built from.
+
+    Args:
+    String: path to the folder with the processed data
+
+    Returns:
+    String: SHA-256 digest of the processed CSV files
+    """
+    sha = hashlib.sha256()
+    for name in SOURCE_FILES:
+        if os.path.exists(processed_path + name):
+            sha.update(name.encode())
+            with open(processed_path + name, 'rb') as f:
+                for chunk in iter(lambda: f.read(1 << 20), b''):
+                    sha.update(chunk)
+    return sha.hexdigest()
+
+def write_data_version(processed_path=PROCESSED_PATH):
+    """
+    Stamp the processed data with its version.
+
+    Args:
+    String: path to the folder with the processed data
+
+    Returns:
+    String: the version, as returned by data_version
+    """
+    version = data_version(processed_path)
+    with open(processed_path + DATA_VERSION_FILE, 'w') as f:
+        json.dump({'version': version}, f)
+    return version
+
+def read_data_version(processed_path=PROCESSED_PATH):
+    """
+    Get the version the processed data was stamped with.
+
+    Args:
+    String: path to the folder with the processed data
+
+    Returns:
+    String: the version, computed from the files if they aren't stamped
+    """
+    try:
+        with open(processed_path + DATA_VERSION_FILE, 'r') as f:
+            return json.load(f)['version']
+    except (OSError, ValueError, KeyError):
+        return data_version(processed_path)
+
+def update_processed_data(force_feeds=(), workers=None, raw_path=RAW_PATH, processed_path=PROCESSED_PATH,
+                          feeds_path=FEEDS_PATH, ontology_path='data/ontology/gtfs.ttl', snapshot_path='data/snapshot/',
+                          cache_path=GTFS_CACHE_PATH):
+    """
+    Process the data sources whose raw files changed and update the data built from them.
+
+    Each data source is processed on its own, in a pool of processes, and only if the fingerprint
+    of its raw files differs from the one of its outputs. Then the outputs of every data source are merged
+    and the transfers, the stations and the snapshot of the graph are built again, unless nothing changed since the last merge,
+    and the processed data is stamped with a new version.
+    The distances between stops are only computed again for the data sources that changed.
+
+    Args:
+    List: names of the data sources to process even if they didn't change
+    Integer: number of processes, the number of CPUs if None
+    String: path to the folder with the raw data sources
+    String: path to the folder with the processed data
+    String: path to the folder with the per-feed outputs
+    String: path to the ontology file, or None to leave the snapshot as it is
+    String: path to the folder of the snapshot
+    String: path to the parse cache of the GTFS files, or None not to use it
+
+    Returns:
+    List: names of the data sources that were processed
+    """
+    fingerprints = {feed: feed_fingerprint(feed, raw_path) for feed in FEEDS}
+    stale = [feed for feed in FEEDS
+             if feed in force_feeds or read_feed_fingerprint(feed, feeds_path) != fingerprints[feed]]
+    if stale:
+        with ProcessPoolExecutor(max_workers=min(workers or os.cpu_count(), len(stale))) as pool:
+            fingerprints_stale = pool.map(process_feed, stale, [raw_path] * len(stale), [feeds_path] * len(stale),
+                                          [cache_path] * len(stale))
+            for feed, fingerprint in zip(stale, fingerprints_stale):
+                print('Processed {}'.format(feed))
+                fingerprints[feed] = fingerprint
+    # the fingerprints of the data sources of the last merge
+    try:
+        with open(feeds_path + 'merged.json', 'r') as f:
+            merged = json.load(f)
+    except (OSError, ValueError):
+        merged = None
+    outputs = ['routes.csv', 'stops.csv', 'route_stops.csv', 'transfers.csv', 'route_transfers.csv',
+               'stations.csv', 'stop_stations.csv', 'station_transfers.csv']
+    if not stale and merged == fingerprints and all(os.path.exists(processed_path + name) for name in outputs):
+        if not os.path.exists(processed_path + DATA_VERSION_FILE):
+            write_data_version(processed_path)
+        return stale
+    for name in [feeds_path + 'merged.json', processed_path + DATA_VERSION_FILE]:
+        if os.path.exists(name):
+            os.remove(name)
+    merge_feeds(FEEDS, feeds_path, processed_path)
+
+    # Find and save transfers, only between the stops of the data sources that changed
+    stops = pd.read_csv(processed_path + 'stops.csv', dtype = {'stop_id': str, 'stop_name': str, 'route_id': str})
+    transfers = update_transfers(stops, FEEDS, feeds_path)
+    transfers.to_csv(processed_path + 'transfers.csv', index=False)
+
+    # Find and save the transfers between each pair of routes
+    route_transfers = find_route_transfers(stops, transfers)
+    route_transfers.to_csv(processed_path + 'route_transfers.csv', index=False)
+
+    # Cluster the stops into stations and find the transfers between stations, used to route at station level
+    stations, stop_stations = find_stations(stops)
+    stations.to_csv(processed_path + 'stations.csv', index=False)
+    stop_stations.to_csv(processed_path + 'stop_stations.csv', index=False)
+    find_station_transfers(stations, stop_stations, transfers).to_csv(processed_path + 'station_transfers.csv', index=False)
+
+    # Save the snapshot of the populated graph loaded by main.py
+    if ontology_path is not None:
+        update_snapshot(ontology_path, processed_path, snapshot_path)
+    # stamp the processed data, invalidating the cached answers of the queries
+    write_data_version(processed_path)
+    with open(feeds_path + 'merged.json', 'w') as f:
+        json.dump(fingerprints, f)
+    return stale
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Process the GTFS data sources whose raw files changed.')
+    parser.add_argument('--feeds', nargs='+', choices=FEEDS, default=[], metavar='FEED',
+                        help='data sources to process even if their raw files didn\'t change: ' + ', '.join(FEEDS))
+    parser.add_argument('--force', action='store_true', help='process every data source')
+    parser.add_argument('--workers', type=int, help='number of processes, the number of CPUs by default')
+    parser.add_argument('--no-snapshot', action='store_true', help='don\'t save the snapshot of the populated graph')
+    parser.add_argument('--gtfs-cache', default=GTFS_CACHE_PATH, metavar='PATH',
+                        help='folder of the parse cache of the GTFS files, empty to disable it')
+    parser.add_argument('--raw', default=RAW_PATH)
+    parser.add_argument('--processed', default=PROCESSED_PATH)
+    parser.add_argument('--ontology', default='data/ontology/gtfs.ttl')
+    parser.add_argument('--snapshot', default='data/snapshot/')
+    args = parser.parse_args()
+
+    feeds_path = args.processed + 'feeds/'
+    update_processed_data(FEEDS if args.force else args.feeds, args.workers, args.raw, args.processed, feeds_path,
+                          None if args.no_snapshot else args.ontology, args.snapshot, args.gtfs_cache or None)
@@ -1,9 +1,134 @@
+import argparse
 import csv
+from itertools import chain, islice
 from rdflib import Graph, URIRef, Literal
 from rdflib.namespace import Namespace, NamespaceManager, RDF, RDFS, XSD
 
 EX = Namespace('http://example.com/gtfs#')
 
+ROUTE = URIRef(EX.Route)
+STOP = URIRef(EX.Stop)
+TRANSFER = URIRef(EX.Transfer)
+# number of triples added to the graph at once
+BATCH_SIZE = 10000
+
+def route_triples(filename):
+    """
+    Read filename with routes and generate their triples.
+
+    Args:
+    String: path to the filename with the routes
+
+    Returns:
+    Generator: triples of the routes
+    """
+    modes = {}
+    with open(filename, 'r') as csvfile:
+        reader = csv.reader(csvfile)
+        columns = next(reader)
+        route_id, short_name, long_name, route_type = [columns.index(column) for column in
+                                                       ['route_id', 'route_short_name', 'route_long_name', 'route_type']]
+        for row in reader:
+            route = URIRef(EX[row[route_id]])
+            mode = modes.get(row[route_type])
+            if mode is None:
+                mode = modes[row[route_type]] = URIRef(EX[row[route_type]])
+            yield (route, RDF.type, ROUTE)
+            yield (route, RDFS.label, Literal(row[short_name]))
+            yield (route, RDFS.comment, Literal(row[long_name]))
+            yield (route, EX.has_mode, mode)
+
+def stop_triples(filename):
+    """
+    Read filename with stops and generate their triples.
+
+    The file has a row for every route of a stop, so the terms of the routes are reused
+    and the triples repeated by consecutive rows of the same stop are generated once.
+
+    Args:
+    String: path to the filename with the stops
+
+    Returns:
+    Generator: triples of the stops
+    """
+    routes = {}
+    with open(filename, 'r') as csvfile:
+        reader = csv.reader(csvfile)
+        columns = next(reader)
+        stop_id, stop_name, stop_lat, stop_lon, route_id = [columns.index(column) for column in
+                                                             ['stop_id', 'stop_name', 'stop_lat', 'stop_lon', 'route_id']]
+        previous_id = None
+        for row in reader:
+            if row[stop_id] != previous_id:
+                previous_id = row[stop_id]
+                stop = URIRef(EX[previous_id])
+                # values of the stop already generated, compared before building their terms
+                names, route_ids, lats, lons = set(), set(), set(), set()
+                yield (stop, RDF.type, STOP)
+            if row[stop_name] not in names:
+                names.add(row[stop_name])
+                yield (stop, RDFS.label, Literal(row[stop_name]))
+            if row[route_id] not in route_ids:
+                route_ids.add(row[route_id])
+                route = routes.get(row[route_id])
+                if route is None:
+                    route = routes[row[route_id]] = URIRef(EX[row[route_id]])
+                yield (stop, EX.has_route, route)
+            if row[stop_lat] not in lats:
+                lats.add(row[stop_lat])
+                yield (stop, EX.has_latitude, Literal(row[stop_lat], datatype=XSD.decimal))
+            if row[stop_lon] not in lons:
+                lons.add(row[stop_lon])
+                yield (stop, EX.has_longitude, Literal(row[stop_lon], datatype=XSD.decimal))
+
+def transfer_triples(filename):
+    """
+    Read filename with transfers and generate their triples.
+
+    Args:
+    String: path to the filename with the transfers
+
+    Returns:
+    Generator: triples of the transfers
+    """
+    stops = {}
+    with open(filename, 'r') as csvfile:
+        reader = csv.reader(csvfile)
+        columns = next(reader)
+        transfer_id, transfer_from, transfer_to = [columns.index(column) for column in
+                                                   ['transfer_id', 'transfer_from', 'transfer_to']]
+        for row in reader:
+            transfer = URIRef(EX[row[transfer_id]])
+            # every stop is the start and the end of many transfers
+            stop_from = stops.get(row[transfer_from])
+            if stop_from is None:
+                stop_from = stops[row[transfer_from]] = URIRef(EX[row[transfer_from]])
+            stop_to = stops.get(row[transfer_to])
+            if stop_to is None:
+                stop_to = stops[row[transfer_to]] = URIRef(EX[row[transfer_to]])
+            yield (transfer, RDF.type, TRANSFER)
+            yield (transfer, EX.has_transfer_from, stop_from)
+            yield (transfer, EX.has_transfer_to, stop_to)
+
+def add_triples(g, triples, batch_size=BATCH_SIZE):
+    """
+    Add triples to the RDF graph in batches.
+
+    Args:
+    RDF Graph: graph to which the triples have to be added
+    Iterable: triples
+    Integer: number of triples added at once
+
+    Returns:
+    RDF graph: input RDF graph with the triples added
+    """
+    triples = iter(triples)
+    while True:
+        batch = list(islice(triples, batch_size))
+        if not batch:
+            return g
+        g.addN((s, p, o, g) for s, p, o in batch)
+
 def add_routes(g, filename):
     """
     Read filename with routes and add them to the RDF graph.
@@ -15,15 +140,7 @@ def add_routes(g, filename):
     Returns:
     RDF graph: input RDF graph with routes added
     """
-    with open(filename, 'r') as csvfile:
-        reader = csv.DictReader(csvfile)
-        for row in reader:
-            route = URIRef(EX[row['route_id']])
-            g.add((route, RDF.type, URIRef(EX.Route)))        
-            g.add((route, RDFS.label, Literal(row['route_short_name'])))
-            g.add((route, RDFS.comment, Literal(row['route_long_name'])))
-            g.add((route, EX.has_mode, URIRef(EX[row['route_type']])))        
-    return g
+    return add_triples(g, route_triples(filename))
 
 def add_stops(g, filename):
     """
@@ -36,16 +153,7 @@ def add_stops(g, filename):
     Returns:
     RDF graph: input RDF graph with stops added
     """
-    with open(filename, 'r') as csvfile:
-        reader = csv.DictReader(csvfile)
-        for row in reader:
-            stop = URIRef(EX[row['stop_id']])
-            g.add((stop, RDF.type, URIRef(EX.Stop)))        
-            g.add((stop, RDFS.label, Literal(row['stop_name'])))
-            g.add((stop, EX.has_route, URIRef(EX[row['route_id']])))
-            g.add((stop, EX.has_latitude, Literal(row['stop_lat'], datatype=XSD.decimal)))
-            g.add((stop, EX.has_longitude, Literal(row['stop_lon'], datatype=XSD.decimal)))
-    return g
+    return add_triples(g, stop_triples(filename))
 
 def add_transfers(g, filename):
     """
@@ -58,12 +166,110 @@ def add_transfers(g, filename):
     Returns:
     RDF graph: input RDF graph with transfers added
     """
-    with open(filename, 'r') as csvfile:
-        reader = csv.DictReader(csvfile)
-        for row in reader:
-            transfer = URIRef(EX[row['transfer_id']])
-            g.add((transfer, RDF.type, URIRef(EX.Transfer)))
-            g.add((transfer, EX.has_transfer_from, URIRef(EX[row['transfer_from']])))
-            g.add((transfer, EX.has_transfer_to, URIRef(EX[row['transfer_to']])))
+    return add_triples(g, transfer_triples(filename))
+
+def build_graph(ontology_path, processed_path):
+    """
+    Load the ontology and populate it with the routes, stops and transfers of the processed data.
+
+    Args:
+    String: path to the ontology file
+    String: path to the folder with the processed data
+
+    Returns:
+    RDF graph: the ontology populated with all the instances
+    """
+    g = Graph()
+    g.parse(ontology_path)
+    g = add_routes(g, processed_path + 'routes.csv')
+    g = add_stops(g, processed_path + 'stops.csv')
+    g = add_transfers(g, processed_path + 'transfers.csv')
     return g
 
+def network_triples(processed_path):
+    """
+    Generate the triples of the routes, stops and transfers of the processed data.
+
+    Args:
+    String: path to the folder with the processed data
+
+    Returns:
+    Generator: triples of all the instances
+    """
+    return chain(route_triples(processed_path + 'routes.csv'),
+                 stop_triples(processed_path + 'stops.csv'),
+                 transfer_triples(processed_path + 'transfers.csv'))
+
+def term_text(term):
+    """
+    Get the N-Triples text of a term, which is also valid Turtle.
+
+    Args:
+    URIRef or Literal: a term of the graph
+
+    Returns:
+    String: the term as written in N-Triples
+    """
+    if isinstance(term, URIRef):
+        return '<{}>'.format(term)
+    value = str(term).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n').replace('\r', '\\r')
+    if term.language is not None:
+        return '"{}"@{}'.format(value, term.language)
+    if term.datatype is not None:
+        return '"{}"^^<{}>'.format(value, term.datatype)
+    return '"{}"'.format(value)
+
+def export_network(ontology_path, processed_path, output_filename, format='turtle'):
+    """
+    Write the ontology populated with the routes, stops and transfers of the processed data,
+    generating the triples of the instances as they are written instead of building the graph.
+
+    Only the ontology is parsed and serialized as a graph. The instances are written after it,
+    in N-Triples or as Turtle with a statement for each instance.
+
+    Args:
+    String: path to the ontology file
+    String: path to the folder with the processed data
+    String: path to the output file
+    String: 'turtle' or 'nt'
+
+    Returns:
+    Integer: number of triples of the instances written
+    """
+    ontology = Graph()
+    ontology.parse(ontology_path)
+    # the terms of the predicates, classes, modes and routes are written many times, literals aren't kept
+    texts = {RDF.type: 'a'} if format == 'turtle' else {}
+    count = 0
+    with open(output_filename, 'w', encoding='utf-8') as f:
+        f.write(ontology.serialize(format=format))
+        subject = None
+        for s, p, o in network_triples(processed_path):
+            if p not in texts:
+                texts[p] = term_text(p)
+            if isinstance(o, Literal):
+                o_text = term_text(o)
+            else:
+                if o not in texts:
+                    texts[o] = term_text(o)
+                o_text = texts[o]
+            if format == 'nt':
+                f.write('{} {} {} .\n'.format(term_text(s), texts[p], o_text))
+            elif s == subject:
+                f.write(' ;\n    {} {}'.format(texts[p], o_text))
+            else:
+                f.write('{}{} {} {}'.format(' .\n\n' if subject is not None else '\n', term_text(s), texts[p], o_text))
+                subject = s
+            count += 1
+        if format == 'turtle' and subject is not None:
+            f.write(' .\n')
+    return count
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Write the ontology populated with the processed data.')
+    parser.add_argument('output', help='output file, N-Triples if it ends with .nt and Turtle otherwise')
+    parser.add_argument('--ontology', default='data/ontology/gtfs.ttl')
+    parser.add_argument('--processed', default='data/processed/')
+    args = parser.parse_args()
+
+    export_network(args.ontology, args.processed, args.output, 'nt' if args.output.endswith('.nt') else 'turtle')
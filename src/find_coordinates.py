@@ -1,24 +1,275 @@
+import csv
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
 from geopy.geocoders import Nominatim
 from geopy.point import Point
+from instrumentation import timed, count
 
 geolocator = Nominatim(user_agent='info_transport')
 
-def get_coordinates(query):
+def normalize_query(query):
+    """
+    Get the text that identifies a geocoding query, regardless of case and spacing.
+
+    Args:
+    Dictionary with keys: street (String) and city (String), or String: postal address
+
+    Returns:
+    String: normalized query
+    """
+    if isinstance(query, dict):
+        parts = ['{}={}'.format(key, query[key]) for key in sorted(query)]
+    else:
+        parts = [query]
+    return '|'.join(' '.join(str(part).casefold().split()) for part in parts)
+
+class Geocoder(ABC):
+    """
+    Interface of the geocoding services used by get_coordinates.
+
+    The name identifies the service in the geocoding cache, so services that may give
+    different answers to the same query don't share their cached results. If it's None, the name
+    of the class is used.
+    """
+
+    name = None
+
+    @abstractmethod
+    def geocode(self, query):
+        """
+        Get the location of a postal address.
+
+        Args:
+        Dictionary with keys: street (String) and city (String), or String: postal address
+
+        Returns:
+        Tuple: latitude (Float), longitude (Float) and address (String), or None if not found
+        """
+
+class NominatimGeocoder(Geocoder):
+    """
+    Nominatim geocoding service, restricted to the Community of Madrid.
+    """
+
+    name = 'nominatim'
+
+    def __init__(self, geolocator=geolocator):
+        self.geolocator = geolocator
+
+    def geocode(self, query):
+        location = self.geolocator.geocode(query, viewbox=[Point(40.55, -4), Point(40.25, -3.3)], bounded=True)
+        if not location:
+            return None
+        return (location.latitude, location.longitude, location.address)
+
+class GazetteerGeocoder(Geocoder):
+    """
+    Offline geocoder that looks up the addresses of a local CSV file.
+
+    The file has columns 'street', 'city', 'lat', 'lon' and, optionally, 'address'.
+    Rows with an empty city also answer queries given as a single string.
+    """
+
+    def __init__(self, filename):
+        self.locations = {}
+        # the answers change with the contents of the file
+        with open(filename, 'rb') as f:
+            self.name = 'gazetteer:' + hashlib.sha256(f.read()).hexdigest()[:16]
+        with open(filename, 'r', newline='') as csvfile:
+            reader = csv.DictReader(csvfile)
+            for row in reader:
+                query = {'street': row['street'], 'city': row['city']} if row.get('city') else row['street']
+                address = row.get('address') or normalize_query(query)
+                self.locations[normalize_query(query)] = (float(row['lat']), float(row['lon']), address)
+
+    def geocode(self, query):
+        return self.locations.get(normalize_query(query))
+
+class GeocodingCache:
+    """
+    Persistent cache of geocoding results in a SQLite file.
+
+    Entries expire ttl seconds after being stored and, when there are more than max_entries,
+    the least recently used ones are evicted. Addresses that weren't found are cached for miss_ttl seconds,
+    so a miss is retried soon. The keys are given by geocode, with the name of the geocoder.
+    """
+
+    def __init__(self, filename, max_entries=10000, ttl=30 * 24 * 3600, miss_ttl=3600):
+        if os.path.dirname(filename):
+            os.makedirs(os.path.dirname(filename), exist_ok=True)
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.miss_ttl = miss_ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(filename, check_same_thread=False)
+        self.connection.execute('CREATE TABLE IF NOT EXISTS geocoding '
+                                '(query TEXT PRIMARY KEY, lat REAL, lon REAL, address TEXT, created REAL, used REAL)')
+        self.connection.commit()
+
+    def get(self, query):
+        """
+        Get the cached location of a query.
+
+        Args:
+        String: key of the query
+
+        Returns:
+        Tuple: whether the query is cached and its location, as returned by Geocoder.geocode
+        """
+        now = time.time()
+        with self.lock:
+            row = self.connection.execute('SELECT lat, lon, address, created FROM geocoding WHERE query = ?',
+                                          (query,)).fetchone()
+            if row is None or now - row[3] > (self.miss_ttl if row[0] is None else self.ttl):
+                self.misses += 1
+                return False, None
+            self.hits += 1
+            self.connection.execute('UPDATE geocoding SET used = ? WHERE query = ?', (now, query))
+            self.connection.commit()
+        lat, lon, address, _ = row
+        return True, None if lat is None else (lat, lon, address)
+
+    def put(self, query, location):
+        """
+        Store the location of a query, evicting expired and least recently used entries.
+
+        Args:
+        String: key of the query
+        Tuple: location as returned by Geocoder.geocode, or None if not found
+
+        Returns:
+        Void
+        """
+        now = time.time()
+        lat, lon, address = location if location else (None, None, None)
+        with self.lock:
+            self.connection.execute('INSERT OR REPLACE INTO geocoding VALUES (?, ?, ?, ?, ?, ?)',
+                                    (query, lat, lon, address, now, now))
+            evicted = self.connection.execute('DELETE FROM geocoding WHERE created < ? OR (lat IS NULL AND created < ?)',
+                                              (now - self.ttl, now - self.miss_ttl)).rowcount
+            evicted += self.connection.execute('DELETE FROM geocoding WHERE query IN '
+                                               '(SELECT query FROM geocoding ORDER BY used DESC LIMIT -1 OFFSET ?)',
+                                               (self.max_entries,)).rowcount
+            self.evictions += evicted
+            self.connection.commit()
+
+    def stats(self):
+        """
+        Get the statistics of the cache since it was opened.
+
+        Returns:
+        Dictionary: number of entries, hits, misses, evictions and hit rate
+        """
+        with self.lock:
+            entries = self.connection.execute('SELECT COUNT(*) FROM geocoding').fetchone()[0]
+        lookups = self.hits + self.misses
+        return {'entries': entries, 'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                'hit_rate': self.hits / lookups if lookups else 0.0}
+
+    def close(self):
+        self.connection.close()
+
+default_geocoder = NominatimGeocoder()
+default_cache = None
+# default value of the cache arguments, to tell the default cache from no cache
+_DEFAULT_CACHE = object()
+
+def configure_geocoding(geocoder=None, cache_filename='data/cache/geocoding.sqlite3', max_entries=10000, ttl=30 * 24 * 3600,
+                        miss_ttl=3600):
+    """
+    Set the geocoder and the cache used by default by get_coordinates and get_coordinates_batch.
+
+    Args:
+    Geocoder: geocoding service, Nominatim if None
+    String: path to the cache file, or None to disable the cache
+    Integer: maximum number of cached queries
+    Integer: seconds before a cached query expires
+    Integer: seconds before a cached query whose address wasn't found expires
+
+    Returns:
+    GeocodingCache: the cache, or None if disabled
+    """
+    global default_geocoder, default_cache
+    default_geocoder = geocoder if geocoder is not None else NominatimGeocoder()
+    if default_cache is not None:
+        default_cache.close()
+    default_cache = GeocodingCache(cache_filename, max_entries, ttl, miss_ttl) if cache_filename else None
+    return default_cache
+
+@timed('geocoding')
+def geocode(query, geocoder=None, cache=_DEFAULT_CACHE):
+    """
+    Get the location of a postal address from the cache or, if it isn't cached, from the geocoder.
+
+    Args:
+    Dictionary with keys: street (String) and city (String), or String: postal address
+    Geocoder: geocoding service, the default one if None
+    GeocodingCache: cache of locations, the default one if not given, or None to not use a cache
+
+    Returns:
+    Tuple: latitude (Float), longitude (Float) and address (String), or None if not found
+    """
+    geocoder = geocoder if geocoder is not None else default_geocoder
+    cache = default_cache if cache is _DEFAULT_CACHE else cache
+    if cache is None:
+        return geocoder.geocode(query)
+    key = '{}|{}'.format(geocoder.name or type(geocoder).__name__, normalize_query(query))
+    cached, location = cache.get(key)
+    count('geocoding_cache_hits' if cached else 'geocoding_cache_misses')
+    if not cached:
+        location = geocoder.geocode(query)
+        cache.put(key, location)
+    return location
+
+def get_coordinates(query, verbose=True, geocoder=None, cache=_DEFAULT_CACHE):
     """
     Get the geographic coordinates of a postal address of Madrid from the Nominatim geocoding service.
 
     Args:
     Dictionary with keys: street (String) and city (String)
+    Boolean: whether to print the retrieved address
+    Geocoder: geocoding service, the default one (Nominatim) if None
+    GeocodingCache: cache of locations, the default one if not given, or None to not use a cache
 
     Side effects:
-    Prints retrieved address to confirm that it's the one that is looked for
-    
+    If verbose, prints retrieved address to confirm that it's the one that is looked for
+
     Returns:
     Tuple: latitude (Float) and longitude (Float) coordinates
     """
-    location = geolocator.geocode(query, viewbox=[Point(40.55, -4), Point(40.25, -3.3)], bounded=True)
-    if location:
-        print(location.address)
-    return (location.latitude, location.longitude)
+    location = geocode(query, geocoder, cache)
+    if location is None:
+        raise ValueError('address not found: {}'.format(query))
+    lat, lon, address = location
+    if verbose:
+        print(address)
+    return (lat, lon)
 
+def get_coordinates_batch(queries, geocoder=None, cache=_DEFAULT_CACHE):
+    """
+    Get the geographic coordinates of many postal addresses, geocoding each different address once.
 
+    Args:
+    List: queries as accepted by get_coordinates
+    Geocoder: geocoding service, the default one (Nominatim) if None
+    GeocodingCache: cache of locations, the default one if not given, or None to not use a cache
+
+    Returns:
+    List: for each query, a tuple with its latitude and longitude, or None if not found
+    """
+    locations = {}
+    coordinates = []
+    for query in queries:
+        key = normalize_query(query)
+        if key not in locations:
+            locations[key] = geocode(query, geocoder, cache)
+        location = locations[key]
+        coordinates.append(None if location is None else location[:2])
+    return coordinates
@@ -1,10 +1,17 @@
+import numpy as np
 from rdflib import URIRef
-from rdflib.namespace import Namespace, RDFS
+from rdflib.namespace import Namespace
 from data_processing import calculate_distance
+from network_index import gather_rows
+from instrumentation import timed, count
 
 EX = Namespace('http://example.com/gtfs#')
 
-def find_routes(g, origin_stops, destination_stops):
+PATH_FIELDS = ['origin', 'origin_route', 'mid_stop_1', 'mid_stop_2', 'destination_route', 'destination']
+PATH_FORMAT = '{origin} >> {origin_route_mode}#{origin_route} ({mid_stop_1} >> {mid_stop_2}) >> {destination_route_mode}#{destination_route} >> {destination}'
+
+@timed('find_routes')
+def find_routes(network, origin_stops, destination_stops):
     """
     Find every possible path between two nodes in the graph, doing at most one transfer.
 
@@ -14,7 +21,7 @@ def find_routes(g, origin_stops, destination_stops):
     so that one is directly connected to the origin and the other is directly connected to the destination.
     
     Args:
-    RDF Graph: graph that represents the transport network
+    NetworkIndex: index of the graph that represents the transport network
     List: list of stops near the origin
     List: list of stops near the destination
     
@@ -22,76 +29,341 @@ def find_routes(g, origin_stops, destination_stops):
     List: list of all possible paths. Each path is a tuple with fields:
     origin, origin_route, mid_stop_1, mid_stop_2, destination_route and destination
     """
+    stops = network.stops
+    routes = network.routes
+    # without the table of transfers between routes, the transfers from the stops
+    # of each origin route are gathered once per route
+    route_transfers = {}
     paths = []
     for origin in origin_stops:
-        origin = URIRef('http://example.com/gtfs#' + origin)
+        origin = network.stop_index.get(URIRef(EX[origin]))
+        if origin is None:
+            continue
         for destination in destination_stops:
-            destination = URIRef('http://example.com/gtfs#' + destination)
-            for origin_route in g.objects(URIRef(origin), URIRef(EX.has_route)):
-                for destination_route in g.objects(URIRef(destination), URIRef(EX.has_route)):
+            destination = network.stop_index.get(URIRef(EX[destination]))
+            if destination is None:
+                continue
+            for origin_route in network.routes_of(origin).tolist():
+                for destination_route in network.routes_of(destination).tolist():
                     if origin_route == destination_route:
-                        paths.append((origin, origin_route, origin, origin, destination_route, destination))
+                        paths.append((stops[origin], routes[origin_route], stops[origin], stops[origin],
+                                      routes[destination_route], stops[destination]))
                     else:
-                        for mid_stop_1 in g.subjects(URIRef(EX.has_route), origin_route):
-                            for transfer in g.subjects(URIRef(EX.has_transfer_from), mid_stop_1):
-                                mid_stop_2 = g.value(transfer, URIRef(EX.has_transfer_to))
-                                for route in g.objects(mid_stop_2, URIRef(EX.has_route)):
-                                    if route == destination_route:
-                                        paths.append((origin, origin_route, mid_stop_1, mid_stop_2, destination_route, destination))           
+                        connections = network.transfers_between(origin_route, destination_route)
+                        if connections is None:
+                            if origin_route not in route_transfers:
+                                route_transfers[origin_route] = network.transfers_of(network.stops_of(origin_route))
+                            mid_stops_1, mid_stops_2 = route_transfers[origin_route]
+                            # keep the transfers that end at a stop of the destination route
+                            connected = network.has_route(mid_stops_2, destination_route)
+                            connections = (mid_stops_1[connected], mid_stops_2[connected])
+                        for mid_stop_1, mid_stop_2 in zip(connections[0].tolist(), connections[1].tolist()):
+                            paths.append((stops[origin], routes[origin_route], stops[mid_stop_1], stops[mid_stop_2],
+                                          routes[destination_route], stops[destination]))
+    count('candidate_paths', len(paths))
     return paths
 
-def get_stop_coordinates(g, stop):
+def get_stop_numbers(network, stops):
+    """
+    Get the numbers in the network index of a list of stops, skipping unknown and repeated ones.
+
+    Args:
+    NetworkIndex: index of the graph that represents the transport network
+    List: stop_id of the stops
+
+    Returns:
+    Numpy array: stop numbers, in the order of the list
+    """
+    numbers = {}
+    for stop in stops:
+        number = network.stop_index.get(URIRef(EX[stop]))
+        if number is not None:
+            numbers.setdefault(number, len(numbers))
+    return np.array(list(numbers), dtype=np.int64)
+
+def get_route_pairs(network, origin_routes, destination_routes):
+    """
+    Get the transfers between every route of the origins and every other route of the destinations,
+    in the order find_routes visits them.
+
+    Args:
+    NetworkIndex: index of the graph that represents the transport network
+    Numpy array: sorted numbers of the routes of the origin stops
+    Numpy array: sorted numbers of the routes of the destination stops
+
+    Returns:
+    Tuple: arrays with the origin and destination routes of every pair with transfers and, for every transfer,
+    its pair, its position among the transfers of the pair, the stop where it starts and the stop where it ends
+    """
+    route_from, route_to = [routes.ravel() for routes in np.meshgrid(origin_routes, destination_routes, indexing='ij')]
+    different = route_from != route_to
+    route_from, route_to = route_from[different], route_to[different]
+    if network.route_pair_codes is not None:
+        codes = route_from * len(network.routes) + route_to
+        positions = np.minimum(np.searchsorted(network.route_pair_codes, codes), max(len(network.route_pair_codes) - 1, 0))
+        found = network.route_pair_codes[positions] == codes if len(network.route_pair_codes) else np.zeros(len(codes), bool)
+        route_from, route_to, positions = route_from[found], route_to[found], positions[found]
+        starts = network.route_pair_ptr[positions]
+        counts = network.route_pair_ptr[positions + 1] - starts
+        pair = np.repeat(np.arange(len(counts)), counts)
+        k = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        transfers = starts[pair] + k
+        return route_from, route_to, pair, k, network.route_pair_from[transfers], network.route_pair_to[transfers]
+    # without the table of transfers between routes, as in find_routes
+    pairs, pair, k, transfer_from, transfer_to = [], [], [], [], []
+    for origin_route in origin_routes.tolist():
+        mid_stops_1, mid_stops_2 = network.transfers_of(network.stops_of(origin_route))
+        for destination_route in destination_routes.tolist():
+            if destination_route == origin_route:
+                continue
+            connected = network.has_route(mid_stops_2, destination_route)
+            if connected.any():
+                pair.append(np.full(connected.sum(), len(pairs)))
+                k.append(np.arange(connected.sum()))
+                transfer_from.append(mid_stops_1[connected])
+                transfer_to.append(mid_stops_2[connected])
+                pairs.append((origin_route, destination_route))
+    if not pairs:
+        empty = np.zeros(0, dtype=np.int64)
+        return empty, empty, empty, empty, empty, empty
+    route_from, route_to = np.array(pairs, dtype=np.int64).T
+    return route_from, route_to, *[np.concatenate(column) for column in [pair, k, transfer_from, transfer_to]]
+
+def get_shortest_rides(network, stops, board):
+    """
+    Get the shortest ride between some stops and every stop of their routes, in a single pass.
+
+    Args:
+    NetworkIndex: index of the graph that represents the transport network
+    Numpy array: stop numbers
+    Boolean: whether the rides board at the given stops, preferring to stay at them as find_path_distance does,
+    or alight at them
+
+    Returns:
+    Tuple: sorted codes (route number * number of stops + stop number) of the stops of the routes,
+    and the shortest ride between any of the given stops and each of them
+    """
+    pair_stops, pair_routes = gather_rows(network.stop_routes_ptr, network.stop_routes, stops)
+    counts = network.route_stops_ptr[pair_routes + 1] - network.route_stops_ptr[pair_routes]
+    pair = np.repeat(np.arange(len(pair_routes)), counts)
+    route_stops = gather_rows(network.route_stops_ptr, network.route_stops, pair_routes)[1]
+    given, routes = pair_stops[pair], pair_routes[pair]
+    if board:
+        distances = np.where(given == route_stops, -0.6, 0.0) + network.ride_distances(routes, given, route_stops)
+    else:
+        distances = network.ride_distances(routes, route_stops, given)
+    codes, inverse = np.unique(routes.astype(np.int64) * len(network.stops) + route_stops, return_inverse=True)
+    shortest = np.full(len(codes), np.inf)
+    np.minimum.at(shortest, inverse, distances)
+    return codes, shortest
+
+def iter_best_routes(network, origin_stops, destination_stops, cutoff=2):
+    """
+    Generate, shortest first, the paths that select_best_routes would select from those of find_routes.
+
+    The paths of every pair of origin and destination routes aren't listed. A path rides from an origin
+    to a transfer, walks it and rides to a destination, so the shortest path of a pair of routes is found
+    from the shortest ride from any origin to each stop of the first route and from each stop of the second route
+    to any destination, computed once for every route. The pairs of routes are then visited best-first: a pair
+    is skipped if its pair of modes already has a shorter path, and the search ends when the next pair is longer
+    than the shortest path plus the cutoff. Only the pairs that are visited are expanded to find the origin,
+    transfer and destination of their path, the first one in the order of find_routes in case of ties.
+
+    Args:
+    NetworkIndex: index of the graph that represents the transport network
+    List: list of stops near the origin
+    List: list of stops near the destination
+    Float: kilometers over the shortest path beyond which paths aren't considered
+
+    Returns:
+    Generator: paths in the format returned by the function find_routes, at most one for every pair of modes
+    of the origin and destination routes, shortest first
+    """
+    origins = get_stop_numbers(network, origin_stops)
+    destinations = get_stop_numbers(network, destination_stops)
+    if len(origins) == 0 or len(destinations) == 0:
+        return
+    n_stops = len(network.stops)
+    origin_routes = np.unique(gather_rows(network.stop_routes_ptr, network.stop_routes, origins)[1]).astype(np.int64)
+    destination_routes = np.unique(gather_rows(network.stop_routes_ptr, network.stop_routes, destinations)[1]).astype(np.int64)
+    if len(origin_routes) == 0 or len(destination_routes) == 0:
+        return
+
+    # shortest distance from any origin to every stop of the routes of the origins, transferring at the origin preferred,
+    # and from every stop of the routes of the destinations to any destination, by route and stop
+    start_codes, start_distances = get_shortest_rides(network, origins, True)
+    end_codes, end_distances = get_shortest_rides(network, destinations, False)
+
+    def lookup(codes, distances, routes, stops, ride):
+        # the stops of a transfer should be stops of its routes, otherwise ride to them
+        positions = np.minimum(np.searchsorted(codes, routes * n_stops + stops), len(codes) - 1)
+        found = codes[positions] == routes * n_stops + stops
+        values = distances[positions]
+        missing = np.flatnonzero(~found)
+        for i in missing.tolist():
+            values[i] = ride(routes[i], stops[i])
+        return values
+
+    def start_ride(route, stop):
+        route_origins = origins[network.has_route(origins, route)]
+        return (np.where(route_origins == stop, -0.6, 0.0) + network.ride_distances(route, route_origins, stop)).min()
+
+    def end_ride(route, stop):
+        return network.ride_distances(route, stop, destinations[network.has_route(destinations, route)]).min()
+
+    # shortest path of every pair of different routes, added in the order of find_path_distance
+    route_from, route_to, pair, k, mid_stops_1, mid_stops_2 = get_route_pairs(network, origin_routes, destination_routes)
+    walks = calculate_distance(network.stop_lat[mid_stops_1], network.stop_lon[mid_stops_1],
+                               network.stop_lat[mid_stops_2], network.stop_lon[mid_stops_2])
+    path_distances = lookup(start_codes, start_distances, route_from[pair], mid_stops_1, start_ride) + walks
+    path_distances = path_distances + lookup(end_codes, end_distances, route_to[pair], mid_stops_2, end_ride)
+    pair_distances = np.full(len(route_from), np.inf)
+    np.minimum.at(pair_distances, pair, path_distances)
+    # and of every route of both the origins and the destinations, without transfers
+    direct_routes = np.intersect1d(origin_routes, destination_routes)
+    direct_distances = {}
+    for route in direct_routes.tolist():
+        route_origins = np.flatnonzero(network.has_route(origins, route))
+        route_destinations = np.flatnonzero(network.has_route(destinations, route))
+        stops = origins[route_origins]
+        distances_to = network.ride_distances(route, stops[:, None], destinations[route_destinations][None, :])
+        stays = calculate_distance(network.stop_lat[stops], network.stop_lon[stops], network.stop_lat[stops], network.stop_lon[stops])
+        direct_distances[route] = (route_origins, route_destinations,
+                                   ((-0.6 + network.ride_distances(route, stops, stops)) + stays)[:, None] + distances_to)
+
+    def expand(i):
+        # origin, destination and transfer of the shortest path of a pair of routes, and their positions
+        if i >= len(route_from):
+            route = direct_routes[i - len(route_from)]
+            route_origins, route_destinations, distances = direct_distances[route]
+            o, d = np.unravel_index(np.argmax(distances == distances.min()), distances.shape)
+            origin, destination = origins[route_origins[o]], destinations[route_destinations[d]]
+            return ((route_origins[o], route_destinations[d], route, route, 0),
+                    (origin, route, origin, origin, route, destination))
+        best = None
+        route_origins = np.flatnonzero(network.has_route(origins, route_from[i]))
+        route_destinations = np.flatnonzero(network.has_route(destinations, route_to[i]))
+        for transfer in np.flatnonzero((pair == i) & (path_distances == pair_distances[i])).tolist():
+            stops = origins[route_origins]
+            rides_from = np.where(stops == mid_stops_1[transfer], -0.6, 0.0) + \
+                network.ride_distances(route_from[i], stops, mid_stops_1[transfer])
+            rides_to = network.ride_distances(route_to[i], mid_stops_2[transfer], destinations[route_destinations])
+            o, d = np.unravel_index(np.argmax(((rides_from + walks[transfer])[:, None] + rides_to[None, :]) == pair_distances[i]),
+                                    (len(stops), len(route_destinations)))
+            key = (route_origins[o], route_destinations[d], route_from[i], route_to[i], k[transfer])
+            if best is None or key < best[0]:
+                best = (key, (origins[route_origins[o]], route_from[i], mid_stops_1[transfer], mid_stops_2[transfer],
+                              route_to[i], destinations[route_destinations[d]]))
+        return best
+
+    bounds = np.concatenate([pair_distances, [direct_distances[route][2].min() for route in direct_routes.tolist()]])
+    pair_routes = np.concatenate([np.stack([route_from, route_to], axis=1), np.stack([direct_routes, direct_routes], axis=1)])
+    labels = {}
+
+    def mode_pair(i):
+        for route in pair_routes[i].tolist():
+            if route not in labels:
+                labels[route] = get_route_mode_label(network, network.routes[route])
+        return tuple(labels[route] for route in pair_routes[i].tolist())
+
+    order = np.argsort(bounds, kind='stable')
+    settled = set()
+    shortest = None
+    position = 0
+    while position < len(order) and np.isfinite(bounds[order[position]]):
+        bound = bounds[order[position]]
+        if shortest is not None and bound > shortest + cutoff:
+            break
+        # the pairs of routes as short as this one, the path of each pair of modes being the first one found
+        end = position
+        while end < len(order) and bounds[order[end]] == bound:
+            end += 1
+        found = {}
+        for i in order[position:end].tolist():
+            modes = mode_pair(i)
+            if modes in settled:
+                continue
+            key, path = expand(i)
+            if modes not in found or key < found[modes][0]:
+                found[modes] = (key, path)
+        count('branches_pruned', end - position - len(found))
+        for modes, (key, path) in sorted(found.items(), key=lambda item: item[1][0]):
+            settled.add(modes)
+            if shortest is None:
+                shortest = bound
+            count('candidate_paths')
+            stops, routes = network.stops, network.routes
+            yield (stops[path[0]], routes[path[1]], stops[path[2]], stops[path[3]], routes[path[4]], stops[path[5]])
+        position = end
+    count('branches_pruned', len(order) - position)
+
+def get_stop_coordinates(network, stop):
     """
     Get the geographic coordinates of a stop.
     
     Args:
-    RDF Graph: graph that represents the transport network
+    NetworkIndex: index of the graph that represents the transport network
     URIRef: a Stop instance of the graph
     
     Returns:
     Tuple: couple of floats representing latitude and longitude
     """
-    lat = g.value(stop, URIRef(EX.has_latitude))
-    lon = g.value(stop, URIRef(EX.has_longitude))
-    return (float(lat), float(lon))
+    i = network.stop_index[stop]
+    return (float(network.stop_lat[i]), float(network.stop_lon[i]))
                                                    
-def get_route_mode(g, route):
+def get_route_mode(network, route):
     """
     Get the transport mode (subway, light subway, rail, city bus, intercity bus) of a route.
     
     Args:
-    RDF Graph: graph that represents the transport network
+    NetworkIndex: index of the graph that represents the transport network
     URIRef: a Route instance of the graph
     
     Returns:
     URIRef: a Mode instance of the graph
     """
-    mode = g.value(route, URIRef(EX.has_mode))
+    mode = network.modes.get(route)
     return mode
 
-def get_label(g, instance):
+def get_label(network, instance):
     """
     Get the label of an instance of the graph.
     
     Args:
-    RDF Graph: graph that represents the transport network
+    NetworkIndex: index of the graph that represents the transport network
     URIRef: an instance of the graph
     
     Returns:
     String: the label of the instance
     """
-    label = g.value(instance, URIRef(RDFS.label))
+    label = network.labels.get(instance)
     return label
 
-def find_path_distance(g, path):
+def get_path_stops(path):
+    """
+    Get the stops of a path in the order they are visited.
+
+    Args:
+    Tuple: a path, which is a tuple with fields origin, origin_route, mid_stop_1, mid_stop_2,
+    destination_route and destination. Paths with more transfers repeat the fields
+    mid_stop_1, mid_stop_2 and route before the destination route.
+
+    Returns:
+    List: origin, the two stops of every transfer and destination
+    """
+    return [path[0]] + [stop for i, stop in enumerate(path[2:-1]) if i % 3 != 2] + [path[-1]]
+
+def find_path_distance(network, path):
     """
     Calculate the distance between the origin and the destination.
 
     the distance is calculated by adding the distances between each pair of the stops
     that make up the route and are directly connected. Paths without transfers are preferable.
+    The distance of riding a route is measured along it if the network index has the stops of its directions,
+    and is infinite if no direction goes from the boarding stop to the alighting one.
     
     Args:
-    RDF Graph: graph that represents the transport network
+    NetworkIndex: index of the graph that represents the transport network
     Tuple: a path, which is a tuple with fields origin, origin_route, mid_stop_1, mid_stop_2,
     destination_route and destination
     
@@ -99,86 +371,251 @@ def find_path_distance(g, path):
     Float: distance of the path
     """
     distance = 0
-    origin, origin_route, mid_stop_1, mid_stop_2, destination_route, destination = path
+    stops = get_path_stops(path)
     # paths without transfers are preferable
-    if origin == mid_stop_1:
+    if len(stops) == 4 and stops[0] == stops[1]:
         distance = -0.6
-    origin_lat, origin_lon = get_stop_coordinates(g, origin)
-    mid_stop_1_lat, mid_stop_1_lon = get_stop_coordinates(g, mid_stop_1)
-    mid_stop_2_lat, mid_stop_2_lon = get_stop_coordinates(g, mid_stop_2)
-    destination_lat, destination_lon = get_stop_coordinates(g, destination)
-    distance += calculate_distance(origin_lat, origin_lon, mid_stop_1_lat, mid_stop_1_lon)
-    distance += calculate_distance(mid_stop_1_lat, mid_stop_1_lon, mid_stop_2_lat, mid_stop_2_lon)
-    distance += calculate_distance(mid_stop_2_lat, mid_stop_2_lon, destination_lat, destination_lon)
+    # routes are ridden from the stops at even positions to the next ones, and transfers walked from the others
+    numbers = np.array([network.stop_index[stop] for stop in stops])
+    routes = np.array([network.route_index[route] for route in path[1::3]])
+    rides = network.ride_distances(routes, numbers[0::2], numbers[1::2])
+    coordinates = [get_stop_coordinates(network, stop) for stop in stops]
+    for i, ((lat1, lon1), (lat2, lon2)) in enumerate(zip(coordinates[:-1], coordinates[1:])):
+        distance += rides[i // 2] if i % 2 == 0 else calculate_distance(lat1, lon1, lat2, lon2)
     return distance
 
-def find_best_routes(g, paths):
+def get_path_numbers(network, paths):
     """
-    Show on screen the shortest paths to go from source to destination.
+    Get the stop and route numbers in the network index of paths with the same number of transfers.
+
+    Args:
+    NetworkIndex: index of the graph that represents the transport network
+    List: paths of the same length, as returned by the function find_routes
+
+    Returns:
+    Tuple: arrays with a row per path and the numbers of its stops, in the order of get_path_stops,
+    and of its routes
+    """
+    length = len(paths[0]) if paths else 6
+    stops = np.array([[network.stop_index[path[i]] for i in range(length) if i % 3 != 1] for path in paths],
+                     dtype=np.int32).reshape(len(paths), -1)
+    routes = np.array([[network.route_index[path[i]] for i in range(1, length, 3)] for path in paths],
+                      dtype=np.int32).reshape(len(paths), -1)
+    return stops, routes
+
+def find_path_distances(network, paths):
+    """
+    Calculate the distance of many paths at once, as the function find_path_distance does for one path.
+
+    Paths are grouped by their number of transfers and the distances of every group are computed
+    in a single pass over arrays with the numbers and coordinates of their stops.
+
+    Args:
+    NetworkIndex: index of the graph that represents the transport network
+    List: the list of paths, as returned by the function find_routes
+
+    Returns:
+    Numpy array: distance of every path
+    """
+    distances = np.zeros(len(paths))
+    lengths = np.array([len(path) for path in paths], dtype=np.int32)
+    for length in np.unique(lengths).tolist():
+        positions = np.flatnonzero(lengths == length)
+        stops, routes = get_path_numbers(network, [paths[i] for i in positions])
+        lat = network.stop_lat[stops]
+        lon = network.stop_lon[stops]
+        rides = network.ride_distances(routes, stops[:, 0::2], stops[:, 1::2])
+        walks = calculate_distance(lat[:, 1:-1:2], lon[:, 1:-1:2], lat[:, 2::2], lon[:, 2::2])
+        group_distances = np.zeros(len(positions))
+        # paths without transfers are preferable
+        if length == 6:
+            group_distances[stops[:, 0] == stops[:, 1]] = -0.6
+        # add the legs in order, so the distances are exactly those of find_path_distance
+        for leg in range(stops.shape[1] - 1):
+            group_distances += rides[:, leg // 2] if leg % 2 == 0 else walks[:, leg // 2]
+        distances[positions] = group_distances
+    return distances
+
+def get_local_name(instance):
+    """
+    Get the identifier of an instance of the graph without the namespace.
+
+    Args:
+    URIRef: an instance of the graph
+
+    Returns:
+    String: the identifier used in the processed data
+    """
+    return str(instance)[len(EX):]
+
+def get_route_mode_label(network, route):
+    """
+    Get the label of the transport mode of a route, differenciating between city and intercity bus.
+
+    Args:
+    NetworkIndex: index of the graph that represents the transport network
+    URIRef: a Route instance of the graph
+
+    Returns:
+    String: the label of the mode
+    """
+    route_mode = str(get_label(network, get_route_mode(network, route)))
+    # Differenciate between city and intercity bus
+    if (route.startswith('http://example.com/gtfs#8')):
+        route_mode += ' intercity'
+    return route_mode
+
+def describe_path(network, path, distance):
+    """
+    Get the identifiers and labels of the stops, routes and modes of a path.
+
+    Args:
+    NetworkIndex: index of the graph that represents the transport network
+    Tuple: a path, which is a tuple with fields origin, origin_route, mid_stop_1, mid_stop_2,
+    destination_route and destination
+    Float: distance of the path
+
+    Returns:
+    Dictionary: identifier ('..._id' keys) and label of every field of the path,
+    the modes of the origin and destination routes and the distance.
+    If the path has more than one transfer, the fields are those of the first transfer and
+    the key 'connections' has, for every other transfer, the route taken before it and its two stops.
+    """
+    fields = dict(zip(PATH_FIELDS, path[:4] + path[-2:]))
+    description = {}
+    for field in PATH_FIELDS:
+        description[field + '_id'] = get_local_name(fields[field])
+        description[field] = str(get_label(network, fields[field]))
+    for field in ['origin_route', 'destination_route']:
+        description[field + '_mode'] = get_route_mode_label(network, fields[field])
+    connections = []
+    for i in range(4, len(path) - 2, 3):
+        route, mid_stop_1, mid_stop_2 = path[i:i + 3]
+        connections.append({
+            'route_id': get_local_name(route),
+            'route': str(get_label(network, route)),
+            'route_mode': get_route_mode_label(network, route),
+            'mid_stop_1_id': get_local_name(mid_stop_1),
+            'mid_stop_1': str(get_label(network, mid_stop_1)),
+            'mid_stop_2_id': get_local_name(mid_stop_2),
+            'mid_stop_2': str(get_label(network, mid_stop_2)),
+        })
+    if connections:
+        description['connections'] = connections
+    description['distance'] = float(distance)
+    return description
+
+def format_path(description):
+    """
+    Get the text that shows a path on screen.
+
+    Args:
+    Dictionary: a path as returned by the function describe_path
+
+    Returns:
+    String: the stops and routes of the path
+    """
+    if 'connections' not in description:
+        return PATH_FORMAT.format(**description)
+    text = '{origin} >> {origin_route_mode}#{origin_route} ({mid_stop_1} >> {mid_stop_2})'.format(**description)
+    for connection in description['connections']:
+        text += ' >> {route_mode}#{route} ({mid_stop_1} >> {mid_stop_2})'.format(**connection)
+    return text + ' >> {destination_route_mode}#{destination_route} >> {destination}'.format(**description)
+
+def select_best_paths(network, paths, cutoff=2, per_mode_pair=1):
+    """
+    Select the positions of the shortest paths among the given ones, as select_best_routes does.
+
+    Args:
+    NetworkIndex: index of the graph that represents the transport network
+    List: the list of all possible paths.
+    Float: kilometers over the shortest path beyond which paths aren't considered
+    Integer: number of paths kept for every pair of modes of the origin and destination routes
+
+    Returns:
+    Tuple: positions of the selected paths, shortest first, and the distance of every path
+    """
+    if not paths:
+        return np.zeros(0, dtype=np.int64), np.zeros(0)
+    distances = find_path_distances(network, paths)
+    possible = np.isfinite(distances)
+    if not possible.any():
+        return np.zeros(0, dtype=np.int64), distances
+    # don't consider the paths whose distance is greater than shortest_path_distance + 2 km
+    candidates = np.flatnonzero(possible & (distances <= distances[possible].min() + cutoff))
+    origin_routes = np.array([network.route_index[paths[i][1]] for i in candidates], dtype=np.int32)
+    destination_routes = np.array([network.route_index[paths[i][-2]] for i in candidates], dtype=np.int32)
+    # number of the pair of modes of the origin and destination routes of every candidate
+    route_numbers, route_positions = np.unique(np.concatenate([origin_routes, destination_routes]), return_inverse=True)
+    mode_labels = [get_route_mode_label(network, network.routes[route]) for route in route_numbers.tolist()]
+    modes, route_modes = np.unique(mode_labels, return_inverse=True)
+    route_modes = route_modes.reshape(-1)[route_positions.reshape(-1)]
+    mode_pairs = route_modes[:len(candidates)] * len(modes) + route_modes[len(candidates):]
+    # for every pair of modes, keep only the shortest paths, the first ones found in case of ties
+    order = np.lexsort((candidates, distances[candidates]))
+    if per_mode_pair == 1:
+        _, first = np.unique(mode_pairs[order], return_index=True)
+        return candidates[order[np.sort(first)]], distances
+    by_pair = np.argsort(mode_pairs[order], kind='stable')
+    pair_starts = np.searchsorted(mode_pairs[order][by_pair], mode_pairs[order][by_pair])
+    ranks = np.empty(len(order), dtype=np.int64)
+    ranks[by_pair] = np.arange(len(order)) - pair_starts
+    return candidates[order[ranks < per_mode_pair]], distances
+
+@timed('best_routes')
+def select_best_routes(network, paths):
+    """
+    Select the shortest paths to go from source to destination.
 
     Orders the list of all possible paths returned by the function find_routes according to the distance
-    calculated by the function find_path_distance. 
+    calculated by the function find_path_distance, computed for all of them at once by find_path_distances.
     If the distance of a path is greater than the distance of the shortest path plus 2 kilometer,
-    don't consider the path. If two paths use the same mode for the origin and destination routes,
+    don't consider the path. Paths that ride a route in the wrong direction, whose distance is infinite,
+    aren't considered either. If two paths use the same mode for the origin and destination routes,
     only the shortest one is considered.
     
     Args:
-    RDF Graph: graph that represents the transport network
+    NetworkIndex: index of the graph that represents the transport network
     List: the list of all possible paths.
     
     Returns:
-    Void
+    List: the selected paths, shortest first, as described by the function describe_path
     """
-    route_modes = set()
-    paths = sorted(paths, key=lambda path: find_path_distance(g, path))    
-    shortest_path_distance = find_path_distance(g, paths[0])
-    origin, origin_route, mid_stop_1, mid_stop_2, destination_route, destination = paths[0]
-    origin = get_label(g, origin)
-    origin_route_mode = get_route_mode(g, origin_route)
-    origin_route_mode = get_label(g, origin_route_mode)
-    # Differenciate between city and intercity bus
-    if (origin_route.startswith('http://example.com/gtfs#8')):
-        origin_route_mode += ' intercity'
-    origin_route = get_label(g, origin_route)
-    mid_stop_1 = get_label(g, mid_stop_1)
-    mid_stop_2 = get_label(g, mid_stop_2)
-    destination = get_label(g, destination)
-    destination_route_mode = get_route_mode(g, destination_route)
-    destination_route_mode = get_label(g, destination_route_mode)
-    # Differenciate between city and intercity bus
-    if (destination_route.startswith('http://example.com/gtfs#8')):
-        destination_route_mode += ' intercity'
-    destination_route = get_label(g, destination_route)
-    route_modes.add('{}#{}'.format(origin_route_mode, destination_route_mode))
-    print('{} >> {}#{} ({} >> {}) >> {}#{} >> {}'.format(origin, origin_route_mode, origin_route, mid_stop_1, mid_stop_2,
-                                                         destination_route_mode, destination_route, destination))
-    for path in paths[1:]:
-        path_distance = find_path_distance(g, path)
-        # don't consider the path if its distance is greater than shortest_path_distance + 2 km
-        if (path_distance > shortest_path_distance + 2):
-            continue
-        origin, origin_route, mid_stop_1, mid_stop_2, destination_route, destination = path
-        origin = get_label(g, origin)
-        origin_route_mode = get_route_mode(g, origin_route)
-        origin_route_mode = get_label(g, origin_route_mode)
-        # Differenciate between city and intercity bus
-        if (origin_route.startswith('http://example.com/gtfs#8')):
-            origin_route_mode += ' intercity'
-        origin_route = get_label(g, origin_route)
-        mid_stop_1 = get_label(g, mid_stop_1)
-        mid_stop_2 = get_label(g, mid_stop_2)
-        destination = get_label(g, destination)
-        destination_route_mode = get_route_mode(g, destination_route)
-        destination_route_mode = get_label(g, destination_route_mode)
-        # Differenciate between city and intercity bus
-        if (destination_route.startswith('http://example.com/gtfs#8')):
-            destination_route_mode += ' intercity'
-        destination_route = get_label(g, destination_route)
-        # if origin_route_mode and destination_route_mode have been already seen together, we discard this path
-        route_mode = '{}#{}'.format(origin_route_mode, destination_route_mode)
-        if (route_mode in route_modes):
-            continue
-        route_modes.add(route_mode)
-        print('{} >> {}#{} ({} >> {}) >> {}#{} >> {}'.format(origin, origin_route_mode, origin_route, mid_stop_1, mid_stop_2,
-                                                         destination_route_mode, destination_route, destination))
-        
+    selected, distances = select_best_paths(network, paths)
+    count('paths_pruned', len(paths) - len(selected))
+    return [describe_path(network, paths[i], distances[i]) for i in selected.tolist()]
+
+def find_best_routes(network, paths):
+    """
+    Show on screen the shortest paths to go from source to destination.
+
+    The paths are selected by the function select_best_routes.
+    
+    Args:
+    NetworkIndex: index of the graph that represents the transport network
+    List: the list of all possible paths.
+    
+    Returns:
+    List: the selected paths, as returned by the function select_best_routes
+    """
+    best_paths = select_best_routes(network, paths)
+    for path in best_paths:
+        print(format_path(path))
+    return best_paths
+
+def show_best_routes(network, paths):
+    """
+    Show on screen paths that are already the best ones, like those of iter_best_routes, without selecting them again.
+
+    Args:
+    NetworkIndex: index of the graph that represents the transport network
+    List: the best paths, shortest first, in the format returned by the function find_routes
+
+    Returns:
+    List: the paths, as described by the function describe_path
+    """
+    distances = find_path_distances(network, paths)
+    best_paths = [describe_path(network, path, distance) for path, distance in zip(paths, distances.tolist())]
+    for path in best_paths:
+        print(format_path(path))
+    return best_paths
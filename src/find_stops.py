@@ -1,23 +1,235 @@
+import os
 import pandas as pd
 import numpy as np
 from data_processing import calculate_distance
+from instrumentation import timed, count
 
-def find_nearest_stops(lat, lon):
+# kilometers per degree of latitude, for the same earth radius as calculate_distance
+KM_PER_DEGREE = 6371.01 * np.pi / 180
+
+class StopIndex:
+    """
+    Grid of the stops over latitude and longitude, to find the stops near a location
+    without computing the distance to every stop.
+
+    Cells are at least cell_size kilometers wide and high, and the stops are sorted by cell,
+    so the stops of consecutive cells of a grid row are a single slice of the arrays.
+    """
+
+    def __init__(self, stop_ids, stop_lat, stop_lon, cell_size=0.25):
+        self.cell_lat = cell_size / KM_PER_DEGREE
+        # the widest cell in degrees is the one nearest to the pole
+        self.cell_lon = cell_size / (KM_PER_DEGREE * np.cos(np.deg2rad(np.abs(stop_lat).max())))
+        self.min_lat = stop_lat.min()
+        self.min_lon = stop_lon.min()
+        self.n_rows = int((stop_lat.max() - self.min_lat) // self.cell_lat) + 1
+        self.n_cols = int((stop_lon.max() - self.min_lon) // self.cell_lon) + 1
+        cells = self._cells(stop_lat, stop_lon)
+        order = np.argsort(cells, kind='stable')
+        self.cells = cells[order]
+        self.stop_ids = np.asarray(stop_ids, dtype=object)[order]
+        self.stop_lat = np.asarray(stop_lat, dtype=np.float64)[order]
+        self.stop_lon = np.asarray(stop_lon, dtype=np.float64)[order]
+        # the same stop_id may have several locations
+        self.stop_codes, self.unique_stop_ids = pd.factorize(self.stop_ids)
+
+    def _cells(self, lat, lon):
+        rows = ((lat - self.min_lat) // self.cell_lat).astype(np.int64)
+        cols = ((lon - self.min_lon) // self.cell_lon).astype(np.int64)
+        return rows * self.n_cols + cols
+
+    def within(self, lat, lon, radius):
+        """
+        Get the stops that are less than a distance from a location.
+
+        Args:
+        Float: latitude coordinate of a location
+        Float: longitude coordinate of a location
+        Float: distance in kilometers
+
+        Returns:
+        Tuple: positions of the stops in the index and their distances, sorted by distance
+        """
+        # bounding box of the circle, with a small margin for the spherical distance
+        radius_lat = 1.01 * radius / KM_PER_DEGREE
+        radius_lon = 1.01 * radius / (KM_PER_DEGREE * np.cos(np.deg2rad(min(abs(lat) + radius_lat, 89.0))))
+        row_0 = max(int((lat - radius_lat - self.min_lat) // self.cell_lat), 0)
+        row_1 = min(int((lat + radius_lat - self.min_lat) // self.cell_lat), self.n_rows - 1)
+        col_0 = max(int((lon - radius_lon - self.min_lon) // self.cell_lon), 0)
+        col_1 = min(int((lon + radius_lon - self.min_lon) // self.cell_lon), self.n_cols - 1)
+        if row_0 > row_1 or col_0 > col_1:
+            return np.empty(0, dtype=np.int64), np.empty(0)
+        rows = np.arange(row_0, row_1 + 1) * self.n_cols
+        starts = np.searchsorted(self.cells, rows + col_0, side='left')
+        ends = np.searchsorted(self.cells, rows + col_1, side='right')
+        candidates = np.concatenate([np.arange(start, end) for start, end in zip(starts, ends)])
+        distances = calculate_distance(lat, lon, self.stop_lat[candidates], self.stop_lon[candidates])
+        inside = distances < radius
+        candidates = candidates[inside]
+        distances = distances[inside]
+        order = np.argsort(distances, kind='stable')
+        return candidates[order], distances[order]
+
+    def nearest(self, lat, lon, radius):
+        """
+        Get the stop_id of the stops that are less than a distance from a location.
+
+        Args:
+        Float: latitude coordinate of a location
+        Float: longitude coordinate of a location
+        Float: distance in kilometers
+
+        Returns:
+        List: stop_id of nearby stops, sorted by distance
+        """
+        positions, _ = self.within(lat, lon, radius)
+        return pd.unique(self.stop_ids[positions]).tolist()
+
+    def nearest_many(self, lat, lon, radius):
+        """
+        Get the stop_id of the stops that are less than a distance from each of many locations.
+
+        The cells around every location are looked up at once and the distances to all the candidate stops
+        are computed in a single pass, giving the same stops in the same order as nearest.
+
+        Args:
+        Numpy array: latitude coordinates of the locations
+        Numpy array: longitude coordinates of the locations
+        Float: distance in kilometers
+
+        Returns:
+        List: for each location, the list with the stop_id of the nearby stops, sorted by distance
+        """
+        lat = np.asarray(lat, dtype=np.float64)
+        lon = np.asarray(lon, dtype=np.float64)
+        radius_lat = 1.01 * radius / KM_PER_DEGREE
+        radius_lon = 1.01 * radius / (KM_PER_DEGREE * np.cos(np.deg2rad(np.minimum(np.abs(lat) + radius_lat, 89.0))))
+        row_0 = np.maximum((lat - radius_lat - self.min_lat) // self.cell_lat, 0).astype(np.int64)
+        row_1 = np.minimum((lat + radius_lat - self.min_lat) // self.cell_lat, self.n_rows - 1).astype(np.int64)
+        col_0 = np.maximum((lon - radius_lon - self.min_lon) // self.cell_lon, 0).astype(np.int64)
+        col_1 = np.minimum((lon + radius_lon - self.min_lon) // self.cell_lon, self.n_cols - 1).astype(np.int64)
+        n_rows = np.where(col_0 <= col_1, np.maximum(row_1 - row_0 + 1, 0), 0)
+        # one slice of the stops for every grid row of every location
+        points = np.repeat(np.arange(len(lat)), n_rows)
+        rows = row_0[points] + np.arange(n_rows.sum()) - np.repeat(np.cumsum(n_rows) - n_rows, n_rows)
+        starts = np.searchsorted(self.cells, rows * self.n_cols + col_0[points], side='left')
+        ends = np.searchsorted(self.cells, rows * self.n_cols + col_1[points], side='right')
+        counts = ends - starts
+        candidates = np.repeat(starts - np.cumsum(counts) + counts, counts) + np.arange(counts.sum())
+        points = np.repeat(points, counts)
+        distances = calculate_distance(lat[points], lon[points], self.stop_lat[candidates], self.stop_lon[candidates])
+        inside = distances < radius
+        candidates, points, distances = candidates[inside], points[inside], distances[inside]
+        order = np.lexsort((distances, points))
+        candidates, points = candidates[order], points[order]
+        # first location of every stop_id near each location
+        codes = points.astype(np.int64) * len(self.unique_stop_ids) + self.stop_codes[candidates]
+        _, first = np.unique(codes, return_index=True)
+        first = np.sort(first)
+        stop_ids = self.unique_stop_ids[self.stop_codes[candidates[first]]].tolist()
+        bounds = np.searchsorted(points[first], np.arange(len(lat) + 1))
+        return [stop_ids[bounds[i]:bounds[i + 1]] for i in range(len(lat))]
+
+    def k_nearest(self, lat, lon, k, radius=None):
+        """
+        Get the stop_id of the k stops nearest to a location.
+
+        The search radius grows from the size of a cell until k different stops are found.
+
+        Args:
+        Float: latitude coordinate of a location
+        Float: longitude coordinate of a location
+        Integer: number of stops
+        Float: maximum distance in kilometers, or None for no limit
+
+        Returns:
+        List: stop_id of the nearest stops, sorted by distance
+        """
+        # no stop is further than the diagonal of the grid plus the distance to the grid
+        max_radius = calculate_distance(lat, lon, self.min_lat, self.min_lon) + \
+            KM_PER_DEGREE * (self.n_rows * self.cell_lat + self.n_cols * self.cell_lon)
+        if radius is not None:
+            max_radius = min(max_radius, radius)
+        search_radius = min(self.cell_lat * KM_PER_DEGREE, max_radius)
+        while True:
+            stops = self.nearest(lat, lon, search_radius)
+            if len(stops) >= k or search_radius >= max_radius:
+                return stops[:k]
+            search_radius = min(2 * search_radius, max_radius)
+
+_stop_indexes = {}
+
+def load_stop_index(filename='data/processed/stops.csv', cell_size=0.25):
+    """
+    Get the spatial index of the stops of a file.
+
+    The index is built the first time it is asked for and kept until the file changes.
+
+    Args:
+    String: path to the file with the stops
+    Float: size in kilometers of the cells of the grid
+
+    Returns:
+    StopIndex: spatial index of the stops
+    """
+    key = (filename, cell_size, os.path.getmtime(filename))
+    if key not in _stop_indexes:
+        stops = pd.read_csv(filename, usecols=['stop_id', 'stop_lat', 'stop_lon'], dtype={'stop_id': str})
+        _stop_indexes.clear()
+        _stop_indexes[key] = StopIndex(stops['stop_id'].values, stops['stop_lat'].values, stops['stop_lon'].values, cell_size)
+    return _stop_indexes[key]
+
+@timed('nearest_stops')
+def find_nearest_stops(lat, lon, radius=0.5, stop_index=None):
     """
     Get stops that are near a given location.
 
     Args:
     Float: latitude coordinate of a location
     Float: longitude coordinate of a location
-    
+    Float: maximum distance in kilometers
+    StopIndex: spatial index of the stops, by default the one of the processed stops
+
     Returns:
     List: stop_id of nearby stops
     """
-    stops = pd.read_csv('data/processed/stops.csv')
-    stops = pd.DataFrame(stops, columns=['stop_id', 'stop_lat', 'stop_lon'])
-    # calculate distance between the input location and each stop
-    stops['distance'] = calculate_distance(lat, lon, stops['stop_lat'], stops['stop_lon'])
-    # filter stops that are less than 0.5 kilometres and sorter them according to distance
-    stops_nearest = stops[stops.distance < 0.5].sort_values(by='distance', ascending=True)
-    stops_nearest = pd.unique(stops_nearest['stop_id']).tolist()
-    return stops_nearest
+    if stop_index is None:
+        stop_index = load_stop_index()
+    stops = stop_index.nearest(lat, lon, radius)
+    count('nearest_stops', len(stops))
+    return stops
+
+def find_k_nearest_stops(lat, lon, k, radius=None, stop_index=None):
+    """
+    Get the k stops that are nearest to a given location.
+
+    Args:
+    Float: latitude coordinate of a location
+    Float: longitude coordinate of a location
+    Integer: number of stops
+    Float: maximum distance in kilometers, or None for no limit
+    StopIndex: spatial index of the stops, by default the one of the processed stops
+
+    Returns:
+    List: stop_id of the nearest stops, sorted by distance
+    """
+    if stop_index is None:
+        stop_index = load_stop_index()
+    return stop_index.k_nearest(lat, lon, k, radius)
+
+def find_nearest_stops_batch(points, radius=0.5, stop_index=None):
+    """
+    Get the stops that are near each of many locations.
+
+    Args:
+    List: tuples with the latitude and longitude of each location
+    Float: maximum distance in kilometers
+    StopIndex: spatial index of the stops, by default the one of the processed stops
+
+    Returns:
+    List: for each location, the list with the stop_id of the nearby stops
+    """
+    if stop_index is None:
+        stop_index = load_stop_index()
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    return stop_index.nearest_many(points[:, 0], points[:, 1], radius)
@@ -0,0 +1,290 @@
+import hashlib
+import json
+import os
+import numpy as np
+from rdflib import Graph, URIRef, BNode, Literal
+from rdflib.store import Store
+from data_reading import build_graph
+from instrumentation import count
+
+ONTOLOGY_PATH = 'data/ontology/gtfs.ttl'
+PROCESSED_PATH = 'data/processed/'
+SNAPSHOT_PATH = 'data/snapshot/'
+SOURCE_FILES = ['routes.csv', 'stops.csv', 'transfers.csv', 'route_transfers.csv', 'route_stops.csv',
+                'stations.csv', 'stop_stations.csv', 'station_transfers.csv']
+# files only used by the index, which may be missing
+OPTIONAL_SOURCE_FILES = ['route_transfers.csv', 'route_stops.csv', 'stations.csv', 'stop_stations.csv', 'station_transfers.csv']
+SNAPSHOT_VERSION = 1
+
+# kinds of RDF terms stored in the snapshot
+URI, BLANK, LITERAL = 0, 1, 2
+
+def source_fingerprint(ontology_path=ONTOLOGY_PATH, processed_path=PROCESSED_PATH):
+    """
+    Get a fingerprint of the files the graph and its index are built from.
+
+    Args:
+    String: path to the ontology file
+    String: path to the folder with the processed data
+
+    Returns:
+    String: SHA-256 digest of the ontology and the processed CSV files
+    """
+    sha = hashlib.sha256()
+    for filename in [ontology_path] + [processed_path + name for name in SOURCE_FILES]:
+        sha.update(os.path.basename(filename).encode())
+        if not os.path.exists(filename) and os.path.basename(filename) in OPTIONAL_SOURCE_FILES:
+            continue
+        with open(filename, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                sha.update(chunk)
+    return sha.hexdigest()
+
+def save_snapshot(g, fingerprint, snapshot_path=SNAPSHOT_PATH):
+    """
+    Save an RDF graph to disk as integer-coded triples that can be memory-mapped.
+
+    Every term of the graph gets an integer id. The triples are stored three times,
+    sorted by subject, by predicate and by object, with an offset array for each order,
+    so that any triple pattern is answered by slicing the arrays.
+
+    Args:
+    RDF Graph: graph to save
+    String: fingerprint of the files the graph was built from
+    String: path to the folder of the snapshot
+
+    Returns:
+    Void
+    """
+    os.makedirs(snapshot_path, exist_ok=True)
+    # the metadata is written last, so an interrupted save leaves an invalid snapshot
+    if os.path.exists(snapshot_path + 'meta.json'):
+        os.remove(snapshot_path + 'meta.json')
+    term_ids = {}
+    values, kinds, datatypes, langs = [], [], [], []
+    languages = []
+
+    def term_id(term):
+        i = term_ids.get(term)
+        if i is None:
+            datatype = -1
+            lang = -1
+            if isinstance(term, Literal):
+                kind = LITERAL
+                if term.datatype is not None:
+                    datatype = term_id(term.datatype)
+                if term.language is not None:
+                    if term.language not in languages:
+                        languages.append(term.language)
+                    lang = languages.index(term.language)
+            elif isinstance(term, BNode):
+                kind = BLANK
+            else:
+                kind = URI
+            i = len(values)
+            term_ids[term] = i
+            values.append(str(term))
+            kinds.append(kind)
+            datatypes.append(datatype)
+            langs.append(lang)
+        return i
+
+    triples = np.array([(term_id(s), term_id(p), term_id(o)) for s, p, o in g], dtype=np.int32).reshape(-1, 3)
+    n_terms = len(values)
+    for name, order in [('spo', (0, 1, 2)), ('pos', (1, 2, 0)), ('osp', (2, 0, 1))]:
+        # np.lexsort sorts by the last key first
+        rows = triples[np.lexsort([triples[:, column] for column in reversed(order)])]
+        ptr = np.searchsorted(rows[:, order[0]], np.arange(n_terms + 1)).astype(np.int64)
+        # one contiguous array per subject, predicate and object column
+        np.save(snapshot_path + name + '.npy', np.ascontiguousarray(rows.T))
+        np.save(snapshot_path + name + '_ptr.npy', ptr)
+    np.save(snapshot_path + 'kinds.npy', np.array(kinds, dtype=np.int8))
+    np.save(snapshot_path + 'datatypes.npy', np.array(datatypes, dtype=np.int32))
+    np.save(snapshot_path + 'langs.npy', np.array(langs, dtype=np.int16))
+    with open(snapshot_path + 'terms.bin', 'wb') as f:
+        f.write('\0'.join(values).encode('utf-8'))
+    meta = {
+        'version': SNAPSHOT_VERSION,
+        'fingerprint': fingerprint,
+        'terms': n_terms,
+        'triples': len(triples),
+        'languages': languages,
+        'namespaces': [[prefix, str(namespace)] for prefix, namespace in g.namespaces()],
+    }
+    with open(snapshot_path + 'meta.json', 'w') as f:
+        json.dump(meta, f)
+
+class SnapshotStore(Store):
+    """
+    Read-only rdflib store over the memory-mapped arrays written by save_snapshot.
+
+    RDF terms are only built the first time a triple that contains them is returned.
+    """
+
+    def __init__(self, snapshot_path=SNAPSHOT_PATH):
+        super().__init__()
+        with open(snapshot_path + 'meta.json') as f:
+            self.meta = json.load(f)
+        with open(snapshot_path + 'terms.bin', 'rb') as f:
+            self._values = f.read().decode('utf-8').split('\0')
+        # np.asarray drops the np.memmap subclass, whose slicing is much slower, but keeps the mapping
+        self._kinds = np.asarray(np.load(snapshot_path + 'kinds.npy', mmap_mode='r'))
+        self._datatypes = np.asarray(np.load(snapshot_path + 'datatypes.npy', mmap_mode='r'))
+        self._langs = np.asarray(np.load(snapshot_path + 'langs.npy', mmap_mode='r'))
+        self._columns = {}
+        self._ptr = {}
+        for name in ['spo', 'pos', 'osp']:
+            self._columns[name] = np.asarray(np.load(snapshot_path + name + '.npy', mmap_mode='r'))
+            self._ptr[name] = np.asarray(np.load(snapshot_path + name + '_ptr.npy', mmap_mode='r'))
+        self._terms = [None] * len(self._values)
+        self._ids = None
+        self._literal_ids = None
+        self._namespaces = {prefix: URIRef(namespace) for prefix, namespace in self.meta['namespaces']}
+
+    def _term(self, i):
+        term = self._terms[i]
+        if term is None:
+            kind = self._kinds[i]
+            value = self._values[i]
+            if kind == URI:
+                term = URIRef(value)
+            elif kind == BLANK:
+                term = BNode(value)
+            else:
+                datatype = self._datatypes[i]
+                lang = self._langs[i]
+                term = Literal(value,
+                               lang=self.meta['languages'][lang] if lang >= 0 else None,
+                               datatype=self._term(datatype) if datatype >= 0 else None)
+            self._terms[i] = term
+        return term
+
+    def _term_id(self, term):
+        if isinstance(term, Literal):
+            if self._literal_ids is None:
+                self._literal_ids = {self._term(i): i for i in np.flatnonzero(self._kinds == LITERAL).tolist()}
+            return self._literal_ids.get(term)
+        if self._ids is None:
+            self._ids = {URI: {}, BLANK: {}}
+            for i, kind in enumerate(self._kinds.tolist()):
+                if kind != LITERAL:
+                    self._ids[kind][self._values[i]] = i
+        return self._ids[BLANK if isinstance(term, BNode) else URI].get(str(term))
+
+    def triples(self, triple_pattern, context=None):
+        ids = []
+        for term in triple_pattern:
+            if term is None:
+                ids.append(None)
+            else:
+                i = self._term_id(term)
+                if i is None:
+                    return
+                ids.append(i)
+        s, p, o = ids
+        # pick the order whose first column is bound
+        if s is not None:
+            name, first = 'spo', s
+        elif p is not None:
+            name, first = 'pos', p
+        elif o is not None:
+            name, first = 'osp', o
+        else:
+            name, first = 'spo', None
+        columns = self._columns[name]
+        if first is None:
+            low, high = 0, columns.shape[1]
+        else:
+            low, high = int(self._ptr[name][first]), int(self._ptr[name][first + 1])
+        if name == 'pos' and o is not None:
+            # rows of a predicate are sorted by object
+            low, high = low + np.searchsorted(columns[2, low:high], [o, o + 1])
+        count('triples_visited', high - low)
+        term = self._term
+        for si, pi, oi in zip(*columns[:, low:high].tolist()):
+            if (p is None or pi == p) and (o is None or oi == o):
+                yield (term(si), term(pi), term(oi)), iter(())
+
+    def __len__(self, context=None):
+        return self.meta['triples']
+
+    def add(self, triple, context, quoted=False):
+        raise TypeError('graph snapshots are read-only')
+
+    def remove(self, triple, context=None):
+        raise TypeError('graph snapshots are read-only')
+
+    def bind(self, prefix, namespace, override=True):
+        if override or prefix not in self._namespaces:
+            self._namespaces[prefix] = namespace
+
+    def namespace(self, prefix):
+        return self._namespaces.get(prefix)
+
+    def prefix(self, namespace):
+        for prefix, bound_namespace in self._namespaces.items():
+            if bound_namespace == namespace:
+                return prefix
+        return None
+
+    def namespaces(self):
+        for prefix, namespace in self._namespaces.items():
+            yield prefix, namespace
+
+def load_snapshot(fingerprint, snapshot_path=SNAPSHOT_PATH):
+    """
+    Open the graph snapshot if it was built from the current data.
+
+    Args:
+    String: fingerprint of the files the graph is built from
+    String: path to the folder of the snapshot
+
+    Returns:
+    RDF graph: read-only graph backed by the snapshot, or None if the snapshot is missing or out of date
+    """
+    try:
+        with open(snapshot_path + 'meta.json') as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if meta.get('version') != SNAPSHOT_VERSION or meta.get('fingerprint') != fingerprint:
+        return None
+    return Graph(store=SnapshotStore(snapshot_path))
+
+def update_snapshot(ontology_path=ONTOLOGY_PATH, processed_path=PROCESSED_PATH, snapshot_path=SNAPSHOT_PATH):
+    """
+    Build the populated graph from the processed data and save its snapshot.
+
+    Args:
+    String: path to the ontology file
+    String: path to the folder with the processed data
+    String: path to the folder of the snapshot
+
+    Returns:
+    RDF graph: the populated graph
+    """
+    g = build_graph(ontology_path, processed_path)
+    save_snapshot(g, source_fingerprint(ontology_path, processed_path), snapshot_path)
+    return g
+
+def load_graph(ontology_path=ONTOLOGY_PATH, processed_path=PROCESSED_PATH, snapshot_path=SNAPSHOT_PATH):
+    """
+    Get the populated graph of the transport network.
+
+    The snapshot is used when it matches the current ontology and processed data,
+    otherwise the graph is built from them and the snapshot is written again.
+
+    Args:
+    String: path to the ontology file
+    String: path to the folder with the processed data
+    String: path to the folder of the snapshot
+
+    Returns:
+    RDF graph: read-only graph backed by the snapshot
+    """
+    fingerprint = source_fingerprint(ontology_path, processed_path)
+    g = load_snapshot(fingerprint, snapshot_path)
+    if g is None:
+        update_snapshot(ontology_path, processed_path, snapshot_path)
+        g = load_snapshot(fingerprint, snapshot_path)
+    return g
@@ -0,0 +1,263 @@
+import cProfile
+import functools
+import io
+import json
+import pstats
+import threading
+import time
+
+# metrics of the request being answered by each thread, if it is instrumented
+_local = threading.local()
+# cProfile can't profile two requests at the same time
+_profile_lock = threading.Lock()
+
+class _NullStage:
+    """
+    Stage that does nothing, used when the request isn't instrumented.
+    """
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+_NULL_STAGE = _NullStage()
+
+class _Stage:
+    """
+    Timer of a stage of an instrumented request.
+    """
+
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+
+    def __enter__(self):
+        self.start_time = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.metrics.add_time(self.name, time.perf_counter() - self.start_time)
+        return False
+
+class Metrics:
+    """
+    Times of the stages and counters of one request.
+
+    While a request is instrumented, the functions stage, timed and count of this module
+    record into its Metrics; otherwise they do nothing.
+    """
+
+    def __init__(self, request_id=None, profile=False):
+        self.request_id = request_id
+        self.timings = {}
+        self.calls = {}
+        self.counters = {}
+        self.profile = profile
+        self.profile_stats = None
+        self._profiler = None
+        self._previous = None
+
+    def add_time(self, name, seconds):
+        self.timings[name] = self.timings.get(name, 0.0) + seconds
+        self.calls[name] = self.calls.get(name, 0) + 1
+
+    def add_count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def __enter__(self):
+        self._previous = getattr(_local, 'metrics', None)
+        _local.metrics = self
+        if self.profile and _profile_lock.acquire(blocking=False):
+            self._profiler = cProfile.Profile()
+            self._profiler.enable()
+        self.start_time = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.total = time.perf_counter() - self.start_time
+        if self._profiler is not None:
+            self._profiler.disable()
+            _profile_lock.release()
+            self.profile_stats = format_profile(self._profiler)
+            self._profiler = None
+        _local.metrics = self._previous
+        return False
+
+    def record(self):
+        """
+        Get the metrics of the request.
+
+        Returns:
+        Dictionary: id of the request, total and per stage milliseconds, calls of every stage, counters
+        and, if it was profiled, the cProfile statistics
+        """
+        record = {
+            'id': self.request_id,
+            'time': time.time(),
+            'total_ms': round(1000 * getattr(self, 'total', 0.0), 3),
+            'timings_ms': {name: round(1000 * seconds, 3) for name, seconds in self.timings.items()},
+            'calls': dict(self.calls),
+            'counters': dict(self.counters),
+        }
+        if self.profile:
+            # the profile is skipped while another request is profiled
+            record['profile'] = self.profile_stats
+        return record
+
+def format_profile(profiler, limit=30):
+    """
+    Get the statistics of a profiler as text.
+
+    Args:
+    cProfile.Profile: a profiler that has run
+    Integer: number of functions shown
+
+    Returns:
+    String: the functions with the highest cumulative time
+    """
+    stream = io.StringIO()
+    pstats.Stats(profiler, stream=stream).sort_stats('cumulative').print_stats(limit)
+    return stream.getvalue()
+
+def stage(name):
+    """
+    Time a stage of the request being answered.
+
+    Args:
+    String: name of the stage
+
+    Returns:
+    Context manager: adds its elapsed time to the stage, or does nothing if the request isn't instrumented
+    """
+    metrics = getattr(_local, 'metrics', None)
+    if metrics is None:
+        return _NULL_STAGE
+    return _Stage(metrics, name)
+
+def timed(name):
+    """
+    Decorate a function so that every call is timed as a stage of the request being answered.
+
+    Args:
+    String: name of the stage
+
+    Returns:
+    Function: decorator
+    """
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            metrics = getattr(_local, 'metrics', None)
+            if metrics is None:
+                return function(*args, **kwargs)
+            start_time = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                metrics.add_time(name, time.perf_counter() - start_time)
+        return wrapper
+    return decorator
+
+def count(name, n=1):
+    """
+    Add to a counter of the request being answered, if it is instrumented.
+
+    Args:
+    String: name of the counter
+    Integer: amount added
+
+    Returns:
+    Void
+    """
+    metrics = getattr(_local, 'metrics', None)
+    if metrics is not None:
+        metrics.add_count(name, n)
+
+class MetricsRegistry:
+    """
+    Totals of the metrics of all the requests, exported in the Prometheus text format.
+    """
+
+    def __init__(self, prefix='gtfs'):
+        self.prefix = prefix
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.request_seconds = 0.0
+        self.stage_seconds = {}
+        self.stage_calls = {}
+        self.counters = {}
+
+    def add(self, metrics):
+        """
+        Add the metrics of a finished request to the totals.
+
+        Args:
+        Metrics: metrics of the request
+
+        Returns:
+        Void
+        """
+        with self.lock:
+            self.requests += 1
+            self.request_seconds += getattr(metrics, 'total', 0.0)
+            for name, seconds in metrics.timings.items():
+                self.stage_seconds[name] = self.stage_seconds.get(name, 0.0) + seconds
+                self.stage_calls[name] = self.stage_calls.get(name, 0) + metrics.calls[name]
+            for name, n in metrics.counters.items():
+                self.counters[name] = self.counters.get(name, 0) + n
+
+    def prometheus_text(self):
+        """
+        Get the totals in the Prometheus text exposition format.
+
+        Returns:
+        String: one sample per line, with HELP and TYPE comments
+        """
+        prefix = self.prefix
+        lines = []
+
+        def metric(name, help_text, samples):
+            lines.append('# HELP {}_{} {}'.format(prefix, name, help_text))
+            lines.append('# TYPE {}_{} counter'.format(prefix, name))
+            for labels, value in samples:
+                lines.append('{}_{}{} {}'.format(prefix, name, labels, value))
+
+        with self.lock:
+            metric('requests_total', 'Instrumented requests.', [('', self.requests)])
+            metric('request_seconds_total', 'Time answering instrumented requests.', [('', repr(self.request_seconds))])
+            metric('stage_seconds_total', 'Time spent in each stage.',
+                   [('{{stage="{}"}}'.format(name), repr(seconds)) for name, seconds in sorted(self.stage_seconds.items())])
+            metric('stage_calls_total', 'Calls of each stage.',
+                   [('{{stage="{}"}}'.format(name), n) for name, n in sorted(self.stage_calls.items())])
+            for name, n in sorted(self.counters.items()):
+                metric(name + '_total', name.replace('_', ' ').capitalize() + '.', [('', n)])
+        return '\n'.join(lines) + '\n'
+
+class JsonLinesExporter:
+    """
+    Writes the metrics of every request as a JSON line.
+    """
+
+    def __init__(self, filename):
+        self.lock = threading.Lock()
+        self.file = open(filename, 'a', encoding='utf-8')
+
+    def write(self, metrics):
+        """
+        Append the metrics of a finished request.
+
+        Args:
+        Metrics: metrics of the request
+
+        Returns:
+        Void
+        """
+        line = json.dumps(metrics.record(), ensure_ascii=False) + '\n'
+        with self.lock:
+            self.file.write(line)
+            self.file.flush()
+
+    def close(self):
+        self.file.close()
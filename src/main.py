@@ -1,9 +1,12 @@
+from concurrent.futures import ThreadPoolExecutor
 from rdflib import Graph
 from rdflib.namespace import Namespace, NamespaceManager, RDF, RDFS, XSD
-from data_reading import add_routes, add_stops, add_transfers
-from find_coordinates import get_coordinates
-from find_stops import find_nearest_stops
-from find_routes import find_routes, find_best_routes
+from graph_snapshot import load_graph
+from network_index import load_network_index
+from find_coordinates import configure_geocoding, geocode
+from find_stops import load_stop_index, find_nearest_stops
+from find_routes import find_best_routes
+from routing import find_station_journeys
 import time
 
 # create graph
@@ -12,58 +15,100 @@ namespace_manager = NamespaceManager(Graph())
 namespace_manager.bind('ex', EX, override=False)
 namespace_manager.bind('rdfs', RDFS, override=False)
 namespace_manager.bind('xsd', XSD, override=False)
-g = Graph()
-g.namespace_manager = namespace_manager
-
-# load ontology and populate it
-g.parse('data/ontology/gtfs.ttl')
-g = add_routes(g, 'data/processed/routes.csv')
-g = add_stops(g, 'data/processed/stops.csv')
-g = add_transfers(g, 'data/processed/transfers.csv')
-
-# ask for the origin address, must be from the Community of Madrid
-print('Which is the origin address?')
-street = input('street name: ')
-housenumber = input('house number: ')
-if housenumber:
-    street = housenumber + ' ' + street
-city = input('city name: ')
-if city:
-    query = {'street': street, 'city': city}
-else:
-    query = street
-# get geographic coordinates of origin address
-lat, lon = get_coordinates(query)
-# find stops near origin
-origin_stops = find_nearest_stops(lat, lon)
-
-# ask for the destination address, must be from the Community of Madrid
-print('Which is the destination address?')
-street = input('street name: ')
-housenumber = input('house number: ')
-if housenumber:
-    street = housenumber + ' ' + street
-city = input('city name: ')
-if city:
-    query = {'street': street, 'city': city}
-else:
-    query = street
-# get geographic coordinates of destination address
-lat, lon = get_coordinates(query)
+
+def load_network():
+    """
+    Load the graph and index the stops, routes and transfers of the graph for the path queries.
+
+    Returns:
+    Tuple: RDF graph and NetworkIndex
+    """
+    # load ontology and populate it, from the snapshot if it is up to date
+    g = load_graph('data/ontology/gtfs.ttl', 'data/processed/', 'data/snapshot/')
+    g.namespace_manager = namespace_manager
+    return g, load_network_index(g, 'data/snapshot/', 'data/processed/')
+
+def ask_address(name):
+    """
+    Ask for an address, must be from the Community of Madrid.
+
+    Args:
+    String: origin or destination
+
+    Returns:
+    Dictionary with keys street and city, or String: postal address
+    """
+    print('Which is the {} address?'.format(name))
+    street = input('street name: ')
+    housenumber = input('house number: ')
+    if housenumber:
+        street = housenumber + ' ' + street
+    city = input('city name: ')
+    if city:
+        return {'street': street, 'city': city}
+    return street
+
+def get_location(query):
+    """
+    Get the location of an address, failing if it isn't found.
+
+    Args:
+    Dictionary with keys street and city, or String: postal address
+
+    Returns:
+    Tuple: latitude (Float), longitude (Float) and address (String)
+    """
+    location = geocode(query)
+    if location is None:
+        raise ValueError('address not found: {}'.format(query))
+    return location
+
+def get_nearest_stops(location, stop_index):
+    """
+    Find the stops near a location as soon as it is geocoded and the stops are indexed.
+
+    Args:
+    Future: location, as returned by get_location
+    Future: spatial index of the stops
+
+    Returns:
+    List: stop_id of nearby stops
+    """
+    lat, lon, _ = location.result()
+    return find_nearest_stops(lat, lon, stop_index=stop_index.result())
+
+# geocode with Nominatim, keeping the results in a persistent cache
+configure_geocoding(cache_filename='data/cache/geocoding.sqlite3')
+
+# tasks run in order of submission, so a task only waits for tasks that already started
+pool = ThreadPoolExecutor(max_workers=4)
+# load the graph and the indexes in the background while the addresses are typed
+network = pool.submit(load_network)
+# spatial index of the stops for the nearest stop queries
+stop_index = pool.submit(load_stop_index, 'data/processed/stops.csv')
+
+# geocode the origin address and find its stops while the destination address is typed
+origin = pool.submit(get_location, ask_address('origin'))
+origin_stops = pool.submit(get_nearest_stops, origin, stop_index)
+destination = pool.submit(get_location, ask_address('destination'))
 
 # start clock
 start_time = time.time()
 
+# show the retrieved addresses to confirm that they are the ones that are looked for
+print(origin.result()[2])
+print(destination.result()[2])
+
 # find stops near destination
-destination_stops = find_nearest_stops(lat, lon)
+destination_stops = get_nearest_stops(destination, stop_index)
 
-# find best paths between origin and destination
-paths = find_routes(g, origin_stops, destination_stops)
-best_paths = find_best_routes(g, paths)
-print (best_paths)
+# find best paths between origin and destination, as the query service does
+g, network = network.result()
+best_paths = find_best_routes(network, find_station_journeys(network, origin_stops.result(), destination_stops))
 
 # close the graph
 g.close()
+pool.shutdown()
 
-# get time of program execution after getting coordinates from Nominatim
+# get time of program execution after the addresses are typed, waiting for the geocoding and loading that are left
 print("--- %s seconds ---" % (time.time() - start_time))
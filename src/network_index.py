@@ -0,0 +1,625 @@
+import csv
+import json
+import os
+import sys
+import numpy as np
+from rdflib import BNode, Literal, URIRef
+from rdflib.namespace import Namespace, RDF, RDFS
+from data_processing import calculate_distance
+from graph_snapshot import PROCESSED_PATH, SNAPSHOT_PATH, SNAPSHOT_VERSION, SnapshotStore
+from instrumentation import count
+
+EX = Namespace('http://example.com/gtfs#')
+# version of the layout of NetworkIndex, a new one builds again the indexes saved with the snapshot
+NETWORK_INDEX_VERSION = 3
+# arrays of NetworkIndex saved with the snapshot, those that weren't built are left out
+INDEX_ARRAYS = ['stop_lat', 'stop_lon', 'stop_routes_ptr', 'stop_routes', 'route_stops_ptr', 'route_stops', 'transfers_ptr',
+                'transfers', 'stop_route_codes', 'route_pair_codes', 'route_pair_ptr', 'route_pair_from', 'route_pair_to',
+                'route_patterns_ptr', 'route_patterns', 'pattern_distance', 'pattern_rows', 'pattern_codes', 'stop_stations',
+                'station_stops_ptr', 'station_stops']
+
+def compressed_rows(rows, columns, n_rows):
+    """
+    Build a compressed sparse row adjacency from a list of (row, column) pairs.
+
+    Args:
+    Numpy array: row of each pair
+    Numpy array: column of each pair
+    Integer: number of rows
+
+    Returns:
+    Tuple: offsets array of length n_rows + 1 and the columns sorted by row
+    """
+    rows = np.asarray(rows, dtype=np.int32)
+    columns = np.asarray(columns, dtype=np.int32)
+    order = np.lexsort((columns, rows))
+    ptr = np.searchsorted(rows[order], np.arange(n_rows + 1)).astype(np.int32)
+    return ptr, columns[order]
+
+def gather_rows(ptr, columns, rows):
+    """
+    Get the columns adjacent to several rows of a compressed sparse row adjacency.
+
+    Args:
+    Numpy array: offsets of the adjacency
+    Numpy array: columns of the adjacency
+    Numpy array: rows to look up
+
+    Returns:
+    Tuple: for every adjacent column, the row it comes from and the column itself
+    """
+    starts = ptr[rows]
+    counts = ptr[rows + 1] - starts
+    total = counts.sum()
+    # position of every gathered column inside the columns array
+    offsets = np.repeat(starts - np.cumsum(counts) + counts, counts) + np.arange(total)
+    count('index_entries_visited', int(total))
+    return np.repeat(rows, counts), columns[offsets]
+
+class NetworkIndex:
+    """
+    Integer-coded copy of the stops, routes and transfers of the transport network graph.
+
+    Stops and routes are numbered by their position in the stops and routes lists.
+    Adjacencies are kept as compressed sparse rows: stop -> routes, route -> stops
+    and stop -> transfer targets. Optionally, the transfers between each pair of routes
+    are kept sorted by pair, as compressed sparse rows too, and so are the stops of every direction
+    of each route (a pattern) with their distance along it: route -> patterns.
+    If the stops are clustered into stations, stations is the index of the same network with a stop
+    for every station, and stop_stations the station of every stop.
+    """
+
+    def __init__(self, stops, routes, labels, modes, stop_lat, stop_lon, stop_routes, transfers, route_transfers=None,
+                 route_patterns=None):
+        self.stops = stops
+        self.routes = routes
+        self.stop_index = {stop: i for i, stop in enumerate(stops)}
+        self.route_index = {route: i for i, route in enumerate(routes)}
+        self.labels = labels
+        self.modes = modes
+        self.stop_lat = stop_lat
+        self.stop_lon = stop_lon
+        self.stations = None
+        self.stop_stations = None
+        stop_column, route_column = stop_routes
+        self.stop_routes_ptr, self.stop_routes = compressed_rows(stop_column, route_column, len(stops))
+        self.route_stops_ptr, self.route_stops = compressed_rows(route_column, stop_column, len(routes))
+        transfer_from, transfer_to = transfers
+        self.transfers_ptr, self.transfers = compressed_rows(transfer_from, transfer_to, len(stops))
+        # sorted codes of the (stop, route) pairs to test membership of many pairs at once
+        self.stop_route_codes = np.sort(np.asarray(stop_column, dtype=np.int64) * len(routes) + route_column)
+        self.route_pair_codes = None
+        if route_transfers is not None:
+            route_from, route_to, transfer_from, transfer_to = [np.asarray(column, dtype=np.int32) for column in route_transfers]
+            codes = route_from.astype(np.int64) * len(routes) + route_to
+            order = np.lexsort((transfer_to, transfer_from, codes))
+            self.route_pair_codes, starts = np.unique(codes[order], return_index=True)
+            self.route_pair_ptr = np.append(starts, len(order)).astype(np.int32)
+            self.route_pair_from = transfer_from[order]
+            self.route_pair_to = transfer_to[order]
+        self.route_patterns_ptr = None
+        if route_patterns is not None:
+            route, direction, stop, distance = [np.asarray(column) for column in route_patterns]
+            # the rows of a pattern are consecutive and in the order of its stops
+            first = np.ones(len(route), dtype=bool)
+            first[1:] = (route[1:] != route[:-1]) | (direction[1:] != direction[:-1])
+            starts = np.flatnonzero(first)
+            self.route_patterns_ptr, self.route_patterns = compressed_rows(route[starts], np.arange(len(starts)), len(routes))
+            self.pattern_distance = distance.astype(np.float64)
+            # sorted codes of the (pattern, stop) pairs and their rows, in order along the pattern for repeated stops
+            codes = np.repeat(np.arange(len(starts), dtype=np.int64), np.diff(np.append(starts, len(route)))) * len(stops) + stop
+            self.pattern_rows = np.argsort(codes, kind='stable').astype(np.int32)
+            self.pattern_codes = codes[self.pattern_rows]
+
+    def platforms_of(self, station):
+        """
+        Get the stops clustered into a station.
+
+        Args:
+        Integer: station number, in the index of the stations
+
+        Returns:
+        Numpy array: stop numbers of its platforms
+        """
+        start, end = self.station_stops_ptr[station], self.station_stops_ptr[station + 1]
+        count('index_entries_visited', int(end - start))
+        return self.station_stops[start:end]
+
+    def routes_of(self, stop):
+        """
+        Get the routes that serve a stop.
+
+        Args:
+        Integer: stop number
+
+        Returns:
+        Numpy array: route numbers
+        """
+        start, end = self.stop_routes_ptr[stop], self.stop_routes_ptr[stop + 1]
+        count('index_entries_visited', int(end - start))
+        return self.stop_routes[start:end]
+
+    def stops_of(self, route):
+        """
+        Get the stops of a route.
+
+        Args:
+        Integer: route number
+
+        Returns:
+        Numpy array: stop numbers
+        """
+        start, end = self.route_stops_ptr[route], self.route_stops_ptr[route + 1]
+        count('index_entries_visited', int(end - start))
+        return self.route_stops[start:end]
+
+    def transfers_of(self, stops):
+        """
+        Get the transfers that start at any of the given stops.
+
+        Args:
+        Numpy array: stop numbers
+
+        Returns:
+        Tuple: arrays with the stop where each transfer starts and the stop where it ends
+        """
+        return gather_rows(self.transfers_ptr, self.transfers, stops)
+
+    def transfers_between(self, route_from, route_to):
+        """
+        Get the transfers from a stop of a route to a stop of another route.
+
+        Args:
+        Integer: number of the first route
+        Integer: number of the second route
+
+        Returns:
+        Tuple: arrays with the stop where each transfer starts and the stop where it ends,
+        or None if the transfers between routes weren't loaded
+        """
+        if self.route_pair_codes is None:
+            return None
+        code = route_from * len(self.routes) + route_to
+        position = np.searchsorted(self.route_pair_codes, code)
+        if position == len(self.route_pair_codes) or self.route_pair_codes[position] != code:
+            return self.route_pair_from[:0], self.route_pair_to[:0]
+        start, end = self.route_pair_ptr[position], self.route_pair_ptr[position + 1]
+        count('index_entries_visited', int(end - start))
+        return self.route_pair_from[start:end], self.route_pair_to[start:end]
+
+    def ride_distances(self, routes, stops_from, stops_to):
+        """
+        Get the distances of riding routes from some stops to others.
+
+        On a route with patterns, it's the distance along the shortest direction that visits the first stop
+        before the second one, a difference of the distances of both stops from the start of the pattern.
+        If no direction does, the ride is impossible and its distance infinite. On a route without patterns,
+        it's the straight-line distance between the stops.
+
+        Args:
+        Numpy array: route numbers
+        Numpy array: numbers of the boarding stops
+        Numpy array: numbers of the alighting stops, broadcastable with the routes and the boarding stops
+
+        Returns:
+        Numpy array: distances in kilometers
+        """
+        routes, stops_from, stops_to = np.broadcast_arrays(routes, stops_from, stops_to)
+        shape = routes.shape
+        routes, stops_from, stops_to = routes.ravel(), stops_from.ravel(), stops_to.ravel()
+        distances = np.full(len(routes), np.inf)
+        count('index_entries_visited', len(routes))
+        if self.route_patterns_ptr is None:
+            n_patterns = np.zeros(len(routes), dtype=np.int32)
+        else:
+            n_patterns = self.route_patterns_ptr[routes + 1] - self.route_patterns_ptr[routes]
+            for k in range(int(n_patterns.max()) if len(routes) else 0):
+                rides = np.flatnonzero(n_patterns > k)
+                patterns = self.route_patterns[self.route_patterns_ptr[routes[rides]] + k].astype(np.int64)
+                # board at the first visit to the stop and alight at the last one
+                codes = patterns * len(self.stops) + stops_from[rides]
+                board = np.minimum(np.searchsorted(self.pattern_codes, codes, side='left'), len(self.pattern_codes) - 1)
+                found = self.pattern_codes[board] == codes
+                codes = patterns * len(self.stops) + stops_to[rides]
+                alight = np.maximum(np.searchsorted(self.pattern_codes, codes, side='right') - 1, 0)
+                found &= self.pattern_codes[alight] == codes
+                board = self.pattern_rows[board]
+                alight = self.pattern_rows[alight]
+                found &= board <= alight
+                distance = np.where(found, self.pattern_distance[alight] - self.pattern_distance[board], np.inf)
+                distances[rides] = np.minimum(distances[rides], distance)
+        straight = np.flatnonzero(n_patterns == 0)
+        if len(straight):
+            distances[straight] = calculate_distance(self.stop_lat[stops_from[straight]], self.stop_lon[stops_from[straight]],
+                                                     self.stop_lat[stops_to[straight]], self.stop_lon[stops_to[straight]])
+        return distances.reshape(shape)
+
+    def has_route(self, stops, route):
+        """
+        Check which stops are served by a route.
+
+        Args:
+        Numpy array: stop numbers
+        Integer: route number
+
+        Returns:
+        Numpy array: boolean mask over the stops
+        """
+        codes = stops.astype(np.int64) * len(self.routes) + route
+        count('index_entries_visited', len(codes))
+        positions = np.searchsorted(self.stop_route_codes, codes)
+        positions = np.minimum(positions, len(self.stop_route_codes) - 1)
+        return self.stop_route_codes[positions] == codes
+
+def read_route_transfers(filename, stop_index, route_index):
+    """
+    Read the file with the transfers between each pair of routes written by data_processing.py.
+
+    Args:
+    String: path to the file with the transfers between routes
+    Dictionary: number of each Stop instance
+    Dictionary: number of each Route instance
+
+    Returns:
+    Tuple: lists with the route and stop numbers of the columns route_from, route_to, transfer_from and transfer_to
+    """
+    columns = ([], [], [], [])
+    with open(filename, 'r') as csvfile:
+        reader = csv.DictReader(csvfile)
+        for row in reader:
+            numbers = (route_index.get(URIRef(EX[row['route_from']])), route_index.get(URIRef(EX[row['route_to']])),
+                       stop_index.get(URIRef(EX[row['transfer_from']])), stop_index.get(URIRef(EX[row['transfer_to']])))
+            if None not in numbers:
+                for column, number in zip(columns, numbers):
+                    column.append(number)
+    return columns
+
+def read_route_patterns(filename, stop_index, route_index):
+    """
+    Read the file with the stops of every direction of the routes written by data_processing.py.
+
+    Args:
+    String: path to the file with the stops of the routes
+    Dictionary: number of each Stop instance
+    Dictionary: number of each Route instance
+
+    Returns:
+    Tuple: lists with the route number, direction_id, stop number and distance along the direction of every row
+    """
+    columns = ([], [], [], [])
+    with open(filename, 'r') as csvfile:
+        reader = csv.DictReader(csvfile)
+        for row in reader:
+            route = route_index.get(URIRef(EX[row['route_id']]))
+            stop = stop_index.get(URIRef(EX[row['stop_id']]))
+            if route is not None and stop is not None:
+                for column, value in zip(columns, (route, int(row['direction_id']), stop, float(row['distance']))):
+                    column.append(value)
+    return columns
+
+def read_stations(stations_filename, stop_stations_filename, station_transfers_filename, stop_index):
+    """
+    Read the files with the stations and the transfers between them written by data_processing.py.
+
+    Args:
+    String: path to the file with the stations
+    String: path to the file with the station of every stop
+    String: path to the file with the transfers between stations
+    Dictionary: number of each Stop instance
+
+    Returns:
+    Tuple: station_id, station_name, latitude and longitude of every station, number of the station of every stop
+    (-1 if it has none) and lists with the station numbers where every transfer starts and ends
+    """
+    with open(stations_filename, 'r') as csvfile:
+        rows = list(csv.DictReader(csvfile))
+    station_ids = [row['station_id'] for row in rows]
+    station_index = {station: i for i, station in enumerate(station_ids)}
+    names = [row['station_name'] for row in rows]
+    lat = np.array([float(row['station_lat']) for row in rows])
+    lon = np.array([float(row['station_lon']) for row in rows])
+    stop_stations = np.full(len(stop_index), -1, dtype=np.int32)
+    with open(stop_stations_filename, 'r') as csvfile:
+        for row in csv.DictReader(csvfile):
+            stop = stop_index.get(URIRef(EX[row['stop_id']]))
+            if stop is not None:
+                stop_stations[stop] = station_index[row['station_id']]
+    transfers = ([], [])
+    with open(station_transfers_filename, 'r') as csvfile:
+        for row in csv.DictReader(csvfile):
+            transfers[0].append(station_index[row['station_from']])
+            transfers[1].append(station_index[row['station_to']])
+    return station_ids, names, lat, lon, stop_stations, transfers
+
+def build_station_index(network, station_ids, names, lat, lon, stop_stations, transfers):
+    """
+    Build the index of the network at station level and link it to the index of the stops.
+
+    Every station is a stop served by the routes of its platforms, the transfers are those between stations
+    plus a change of route inside every station, and the stops of the directions of the routes are their stations.
+    The routes keep their numbers, so paths found at station level can be expanded to the platforms.
+
+    Args:
+    NetworkIndex: index of the network, updated with the stations
+    List: station_id of every station
+    List: name of every station
+    Numpy array: latitude of every station
+    Numpy array: longitude of every station
+    Numpy array: number of the station of every stop, -1 if it has none
+    Tuple: lists with the station numbers where every transfer starts and ends
+
+    Returns:
+    NetworkIndex: index of the stations
+    """
+    stations = [URIRef(EX[station]) for station in station_ids]
+    n_stations = len(stations)
+    labels = dict(network.labels)
+    labels.update({station: Literal(name) for station, name in zip(stations, names)})
+    stop_column = np.repeat(np.arange(len(network.stops)), np.diff(network.stop_routes_ptr))
+    known = stop_stations[stop_column] >= 0
+    codes = np.unique(stop_stations[stop_column[known]].astype(np.int64) * len(network.routes) + network.stop_routes[known])
+    station_routes = (codes // len(network.routes), codes % len(network.routes))
+    # changing routes inside a station is always possible
+    transfer_from = np.concatenate([np.asarray(transfers[0], dtype=np.int64), np.arange(n_stations)])
+    transfer_to = np.concatenate([np.asarray(transfers[1], dtype=np.int64), np.arange(n_stations)])
+    route_transfers = None
+    if network.route_pair_codes is not None:
+        # every route of the station where a transfer starts with every route of the station where it ends
+        ptr, routes = compressed_rows(*station_routes, n_stations)
+        counts = np.diff(ptr)
+        station_from, route_from = gather_rows(ptr, routes, transfer_from)
+        station_to, route_to = gather_rows(ptr, routes, np.repeat(transfer_to, counts[transfer_from]))
+        expanded = np.repeat(np.arange(len(route_from)), counts[np.repeat(transfer_to, counts[transfer_from])])
+        different = route_from[expanded] != route_to
+        route_transfers = (route_from[expanded][different], route_to[different], station_from[expanded][different],
+                           station_to[different])
+    route_patterns = None
+    if network.route_patterns_ptr is not None:
+        # the rows of the patterns, with the station of their stops
+        row_codes = np.empty(len(network.pattern_codes), dtype=np.int64)
+        row_codes[network.pattern_rows] = network.pattern_codes
+        patterns, stops = row_codes // len(network.stops), row_codes % len(network.stops)
+        pattern_routes = np.empty(len(network.route_patterns), dtype=np.int64)
+        pattern_routes[network.route_patterns] = np.repeat(np.arange(len(network.routes)), np.diff(network.route_patterns_ptr))
+        known = stop_stations[stops] >= 0
+        route_patterns = (pattern_routes[patterns[known]], patterns[known], stop_stations[stops[known]],
+                          network.pattern_distance[known])
+    station_index = NetworkIndex(stations, network.routes, labels, network.modes, np.asarray(lat, dtype=np.float64),
+                                 np.asarray(lon, dtype=np.float64), station_routes, (transfer_from, transfer_to), route_transfers,
+                                 route_patterns)
+    network.stations = station_index
+    network.stop_stations = stop_stations
+    known = np.flatnonzero(stop_stations >= 0)
+    network.station_stops_ptr, network.station_stops = compressed_rows(stop_stations[known], known, n_stations)
+    return station_index
+
+def build_network_index(g, route_transfers_filename=None, route_stops_filename=None):
+    """
+    Build the integer-coded index of the transport network from the RDF graph.
+
+    The graph is scanned once; later queries run on the index without triple pattern matching.
+
+    Args:
+    RDF Graph: graph that represents the transport network
+    String: path to the file with the transfers between routes, None to leave them out
+    String: path to the file with the stops of every direction of the routes, None to leave them out
+
+    Returns:
+    NetworkIndex: index of the stops, routes and transfers of the graph
+    """
+    stops = sorted(set(g.subjects(RDF.type, URIRef(EX.Stop))))
+    routes = sorted(set(g.subjects(RDF.type, URIRef(EX.Route))))
+    stop_index = {stop: i for i, stop in enumerate(stops)}
+    route_index = {route: i for i, route in enumerate(routes)}
+    # keep the first value of every instance, as Graph.value does
+    labels = {}
+    for instance, label in g.subject_objects(URIRef(RDFS.label)):
+        labels.setdefault(instance, label)
+    modes = {}
+    for route, mode in g.subject_objects(URIRef(EX.has_mode)):
+        modes.setdefault(route, mode)
+    coordinates = []
+    for predicate in [EX.has_latitude, EX.has_longitude]:
+        values = np.full(len(stops), np.nan)
+        seen = set()
+        for stop, value in g.subject_objects(URIRef(predicate)):
+            if stop not in seen and stop in stop_index:
+                seen.add(stop)
+                values[stop_index[stop]] = float(value)
+        coordinates.append(values)
+    stop_routes = ([], [])
+    for stop, route in g.subject_objects(URIRef(EX.has_route)):
+        stop_routes[0].append(stop_index[stop])
+        stop_routes[1].append(route_index[route])
+    transfer_to = dict(g.subject_objects(URIRef(EX.has_transfer_to)))
+    transfers = ([], [])
+    for transfer, transfer_from in g.subject_objects(URIRef(EX.has_transfer_from)):
+        if transfer_from in stop_index and transfer_to.get(transfer) in stop_index:
+            transfers[0].append(stop_index[transfer_from])
+            transfers[1].append(stop_index[transfer_to[transfer]])
+    route_transfers = None
+    if route_transfers_filename is not None:
+        route_transfers = read_route_transfers(route_transfers_filename, stop_index, route_index)
+    route_patterns = None
+    if route_stops_filename is not None:
+        route_patterns = read_route_patterns(route_stops_filename, stop_index, route_index)
+    return NetworkIndex(stops, routes, labels, modes, coordinates[0], coordinates[1], stop_routes, transfers, route_transfers,
+                        route_patterns)
+
+def term_arrays(terms):
+    """
+    Get RDF terms as arrays of text, to save them without pickle.
+
+    Args:
+    List: URIRef, BNode or Literal terms
+
+    Returns:
+    Dictionary: arrays with the value, the kind ('uri', 'blank' or 'literal'), the language and the datatype of every term,
+    empty strings if it has none
+    """
+    kinds = ['literal' if isinstance(term, Literal) else 'blank' if isinstance(term, BNode) else 'uri' for term in terms]
+    return {
+        'value': np.array([str(term) for term in terms], dtype=str),
+        'kind': np.array(kinds, dtype=str),
+        'lang': np.array([getattr(term, 'language', None) or '' for term in terms], dtype=str),
+        'datatype': np.array([str(getattr(term, 'datatype', None) or '') for term in terms], dtype=str),
+    }
+
+def make_terms(arrays):
+    """
+    Build the RDF terms saved as arrays of text by term_arrays.
+
+    Args:
+    Dictionary: arrays with the value, kind, language and datatype of every term
+
+    Returns:
+    List: URIRef, BNode or Literal terms
+    """
+    terms = []
+    for value, kind, lang, datatype in zip(*[arrays[name].tolist() for name in ['value', 'kind', 'lang', 'datatype']]):
+        if kind == 'uri':
+            terms.append(URIRef(value))
+        elif kind == 'blank':
+            terms.append(BNode(value))
+        else:
+            terms.append(Literal(value, lang=lang or None, datatype=URIRef(datatype) if datatype else None))
+    return terms
+
+def save_network_index(network, key, index_path):
+    """
+    Save the index of the network as .npy files that can be memory-mapped, with the index of its stations.
+
+    The stops, routes, labels and modes are saved as arrays of text, and the adjacencies as they are,
+    so the index is loaded without scanning the graph and without pickle.
+
+    Args:
+    NetworkIndex: index of the network
+    JSON-serializable object: what the index was built from
+    String: path to the folder of the index
+
+    Returns:
+    Void
+    """
+    os.makedirs(index_path, exist_ok=True)
+    # the metadata is written last, so an interrupted save leaves an invalid index
+    if os.path.exists(index_path + 'meta.json'):
+        os.remove(index_path + 'meta.json')
+    indexes = {}
+    for prefix, index in [('', network), ('stations.', network.stations)]:
+        if index is None:
+            continue
+        arrays = {}
+        for field, terms in [('stops', index.stops), ('routes', index.routes), ('label_keys', list(index.labels.keys())),
+                             ('labels', list(index.labels.values())), ('mode_keys', list(index.modes.keys())),
+                             ('modes', list(index.modes.values()))]:
+            for name, array in term_arrays(terms).items():
+                arrays[field + '_' + name] = array
+        for name in INDEX_ARRAYS:
+            if getattr(index, name, None) is not None:
+                arrays[name] = getattr(index, name)
+        for name, array in arrays.items():
+            np.save(index_path + prefix + name + '.npy', array, allow_pickle=False)
+        indexes[prefix] = sorted(arrays)
+    with open(index_path + 'meta.json', 'w') as f:
+        json.dump({'key': key, 'indexes': indexes}, f)
+
+def read_network_index(key, index_path):
+    """
+    Load the index of the network saved by save_network_index.
+
+    Args:
+    JSON-serializable object: what the index has to be built from
+    String: path to the folder of the index
+
+    Returns:
+    NetworkIndex: index of the network, with its adjacencies memory-mapped, or None if it isn't saved
+    or was built from something else
+    """
+    try:
+        with open(index_path + 'meta.json', 'r') as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return None
+    # compare through JSON, which turns tuples into lists
+    if meta.get('key') != json.loads(json.dumps(key)) or '' not in meta.get('indexes', {}):
+        return None
+    indexes = {}
+    try:
+        for prefix, names in meta['indexes'].items():
+            arrays = {}
+            for name in names:
+                # np.asarray drops the np.memmap subclass, whose slicing is much slower, but keeps the mapping;
+                # the terms are read whole, to build them
+                mmap_mode = 'r' if name in INDEX_ARRAYS else None
+                arrays[name] = np.asarray(np.load(index_path + prefix + name + '.npy', mmap_mode=mmap_mode, allow_pickle=False))
+            terms = {field: make_terms({name: arrays[field + '_' + name] for name in ['value', 'kind', 'lang', 'datatype']})
+                     for field in ['stops', 'routes', 'label_keys', 'labels', 'mode_keys', 'modes']}
+            index = NetworkIndex.__new__(NetworkIndex)
+            index.stops = terms['stops']
+            index.routes = terms['routes']
+            index.stop_index = {stop: i for i, stop in enumerate(index.stops)}
+            index.route_index = {route: i for i, route in enumerate(index.routes)}
+            index.labels = dict(zip(terms['label_keys'], terms['labels']))
+            index.modes = dict(zip(terms['mode_keys'], terms['modes']))
+            index.stations = None
+            for name in INDEX_ARRAYS:
+                setattr(index, name, arrays.get(name))
+            indexes[prefix] = index
+    except (OSError, ValueError, KeyError):
+        return None
+    network = indexes['']
+    network.stations = indexes.get('stations.')
+    return network
+
+def network_index_key(g):
+    """
+    Get what the saved index of a graph is built from.
+
+    Args:
+    RDF Graph: graph that represents the transport network
+
+    Returns:
+    Tuple: versions of the snapshot and of the index and fingerprint of the snapshot, or None if the graph isn't backed
+    by a snapshot
+    """
+    if not isinstance(g.store, SnapshotStore):
+        return None
+    # indexes of another layout are stale even if the data didn't change
+    return (SNAPSHOT_VERSION, NETWORK_INDEX_VERSION, g.store.meta['fingerprint'])
+
+def load_network_index(g, snapshot_path=SNAPSHOT_PATH, processed_path=PROCESSED_PATH):
+    """
+    Get the index of the transport network graph, reusing the one saved next to its snapshot.
+
+    If the graph is backed by a snapshot, the index is saved in the network/ folder of the snapshot the first time
+    it is built, by save_network_index, and reused while the fingerprint of the snapshot and NETWORK_INDEX_VERSION
+    don't change.
+    The transfers between routes, the stops of every direction of the routes and the stations are read
+    from the processed data, if they are there. Without the stops of every direction, route_stops.csv,
+    rides are scored with the straight-line distance, and a warning is written to the standard error.
+
+    Args:
+    RDF Graph: graph that represents the transport network
+    String: path to the folder of the snapshot
+    String: path to the folder with the processed data
+
+    Returns:
+    NetworkIndex: index of the stops, routes and transfers of the graph
+    """
+    key = network_index_key(g)
+    route_stops_filename = processed_path + 'route_stops.csv'
+    network = None
+    if key is not None:
+        network = read_network_index(key, snapshot_path + 'network/')
+    if network is None:
+        route_transfers_filename = processed_path + 'route_transfers.csv'
+        network = build_network_index(g, route_transfers_filename if os.path.exists(route_transfers_filename) else None,
+                                      route_stops_filename if os.path.exists(route_stops_filename) else None)
+        station_filenames = [processed_path + name for name in ['stations.csv', 'stop_stations.csv', 'station_transfers.csv']]
+        if all(os.path.exists(filename) for filename in station_filenames):
+            build_station_index(network, *read_stations(*station_filenames, network.stop_index))
+        if key is not None:
+            save_network_index(network, key, snapshot_path + 'network/')
+    if network.route_patterns_ptr is None:
+        sys.stderr.write('{} not found, rides are scored with the straight-line distance\n'.format(route_stops_filename))
+    return network
@@ -0,0 +1,303 @@
+import argparse
+import csv
+import os
+import sys
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from graph_snapshot import load_graph
+from network_index import network_index_key, load_network_index, read_network_index
+from find_stops import KM_PER_DEGREE, load_stop_index, find_nearest_stops_batch
+from find_routes import select_best_routes
+from routing import find_station_journeys
+
+PAIR_COLUMNS = ['id', 'origin_lat', 'origin_lon', 'destination_lat', 'destination_lon']
+RESULT_COLUMNS = ['origin_stops', 'destination_stops', 'options', 'distance', 'transfers',
+                  'origin_id', 'origin_route_id', 'origin_route_mode', 'destination_route_id', 'destination_route_mode',
+                  'destination_id']
+
+# network of every worker process, the lists of stops near the points and the rows it already found
+_network = None
+_stop_lists = None
+_memo = None
+
+def read_pairs(filename):
+    """
+    Read a table of origins and destinations.
+
+    Args:
+    String: path to a CSV file with columns origin_lat, origin_lon, destination_lat, destination_lon
+    and, optionally, id
+
+    Returns:
+    Pandas dataframe with columns: 'id', 'origin_lat', 'origin_lon', 'destination_lat' and 'destination_lon'.
+    The id is the row number if the file doesn't have it.
+    """
+    pairs = pd.read_csv(filename, dtype={'id': str})
+    if 'id' not in pairs.columns:
+        pairs['id'] = np.arange(len(pairs)).astype(str)
+    return pd.DataFrame(pairs, columns=PAIR_COLUMNS)
+
+def table_pairs(pairs):
+    """
+    Get the points and the pairs of a table of origins and destinations.
+
+    Args:
+    Pandas dataframe: pairs as returned by read_pairs
+
+    Returns:
+    Tuple: latitude and longitude of the points, the origins and then the destinations, the number of pairs
+    and a function that gets the id, origin point and destination point of the pairs from a position to another
+    """
+    ids = pairs['id'].values
+    lat = np.concatenate([pairs['origin_lat'].values, pairs['destination_lat'].values]).astype(np.float64)
+    lon = np.concatenate([pairs['origin_lon'].values, pairs['destination_lon'].values]).astype(np.float64)
+
+    def get_pairs(start, stop):
+        positions = np.arange(start, stop)
+        return ids[start:stop].tolist(), positions, positions + len(pairs)
+
+    return lat, lon, len(pairs), get_pairs
+
+def grid_pairs(stop_index, step=1.0, radius=0.5):
+    """
+    Get every pair of zones of a grid over the stops, from the center of one zone to the center of another.
+
+    Only the zones are kept in memory; the pairs are generated from their position when they are solved.
+
+    Args:
+    StopIndex: spatial index of the stops
+    Float: size of the zones in kilometers
+    Float: maximum distance in kilometers to the stops of a zone, zones without stops are left out
+
+    Returns:
+    Tuple: latitude and longitude of the centers of the zones, the number of pairs and a function that gets
+    the id (the numbers of both zones), origin zone and destination zone of the pairs from a position to another
+    """
+    step_lat = step / KM_PER_DEGREE
+    step_lon = step / (KM_PER_DEGREE * np.cos(np.deg2rad(stop_index.stop_lat.mean())))
+    lat = np.arange(stop_index.stop_lat.min() + step_lat / 2, stop_index.stop_lat.max() + step_lat, step_lat)
+    lon = np.arange(stop_index.stop_lon.min() + step_lon / 2, stop_index.stop_lon.max() + step_lon, step_lon)
+    lat, lon = [values.ravel() for values in np.meshgrid(lat, lon, indexing='ij')]
+    served = np.array([len(stops) > 0 for stops in stop_index.nearest_many(lat, lon, radius)], dtype=bool)
+    lat, lon = lat[served], lon[served]
+    n = len(lat)
+
+    def get_pairs(start, stop):
+        # pairs by origin zone, and by destination zone leaving out the origin
+        positions = np.arange(start, stop)
+        origins = positions // max(n - 1, 1)
+        destinations = positions % max(n - 1, 1)
+        destinations += destinations >= origins
+        return ([str(o) + '_' + str(d) for o, d in zip(origins.tolist(), destinations.tolist())], origins, destinations)
+
+    return lat, lon, n * (n - 1), get_pairs
+
+def find_point_stops(lat, lon, stop_index, radius=0.5):
+    """
+    Find the stops near every point at once, numbering the different lists of stops.
+
+    Args:
+    Numpy array: latitude of the points
+    Numpy array: longitude of the points
+    StopIndex: spatial index of the stops
+    Float: maximum distance in kilometers
+
+    Returns:
+    Tuple: the different lists of stops and, for every point, the number of its list
+    """
+    stop_lists = {}
+    codes = np.array([stop_lists.setdefault(tuple(stops), len(stop_lists))
+                      for stops in find_nearest_stops_batch(np.column_stack([lat, lon]), radius, stop_index)], dtype=np.int64)
+    return [list(stops) for stops in stop_lists], codes
+
+def summarize_paths(origin_stops, destination_stops, paths):
+    """
+    Get the row of the matrix of a pair from its best paths.
+
+    Args:
+    List: stops near the origin
+    List: stops near the destination
+    List: best paths, as returned by select_best_routes
+
+    Returns:
+    List: values of the columns in RESULT_COLUMNS, empty for the path if there isn't any
+    """
+    row = [len(origin_stops), len(destination_stops), len(paths)]
+    if not paths:
+        return row + [''] * (len(RESULT_COLUMNS) - len(row))
+    best = paths[0]
+    direct = best['origin_route_id'] == best['destination_route_id'] and best['origin_id'] == best['mid_stop_1_id']
+    transfers = 0 if direct else 1 + len(best.get('connections', []))
+    return row + [round(best['distance'], 6), transfers, best['origin_id'], best['origin_route_id'], best['origin_route_mode'],
+                  best['destination_route_id'], best['destination_route_mode'], best['destination_id']]
+
+def solve_pairs(network, stop_lists, origins, destinations, max_transfers=1, memo=None):
+    """
+    Find the best path of many pairs of origin and destination stops.
+
+    Pairs with the same stops, like those between the same zones, are solved once. Every pair is searched
+    with find_station_journeys, like the queries of main.py and server.py, so the matrix has the same paths,
+    between platforms and stations and with any number of transfers.
+
+    Args:
+    NetworkIndex: index of the graph that represents the transport network
+    List: the different lists of stops near the points, as returned by find_point_stops
+    Numpy array: number of the list of stops near the origin of every pair
+    Numpy array: number of the list of stops near the destination of every pair
+    Integer: maximum number of transfers
+    Dictionary: rows already found for pairs of lists of stops, updated with the new ones
+
+    Returns:
+    List: for every pair, the values of the columns in RESULT_COLUMNS
+    """
+    memo = {} if memo is None else memo
+    rows = []
+    for key in zip(origins.tolist(), destinations.tolist()):
+        if key not in memo:
+            origin_stops, destination_stops = stop_lists[key[0]], stop_lists[key[1]]
+            paths = select_best_routes(network, find_station_journeys(network, origin_stops, destination_stops, max_transfers))
+            memo[key] = summarize_paths(origin_stops, destination_stops, paths)
+        rows.append(memo[key])
+    return rows
+
+def init_worker(network, stop_lists, key=None, index_path=None):
+    """
+    Set the network of a worker process.
+
+    The workers don't load the graph: the parent process refreshes the snapshot and its index once, and the workers
+    map the saved index or, if the graph isn't backed by a snapshot, get a copy of the network.
+
+    Args:
+    NetworkIndex: index of the network, or None to read the one saved in the folder of the index
+    List: the different lists of stops near the points, as returned by find_point_stops
+    Tuple: what the saved index was built from, as returned by network_index_key
+    String: path to the folder of the saved index
+
+    Returns:
+    Void
+    """
+    global _network, _stop_lists, _memo
+    if network is None:
+        network = read_network_index(key, index_path)
+        if network is None:
+            raise RuntimeError('the index of the network in {} changed while the matrix was computed'.format(index_path))
+    _network = network
+    _stop_lists = stop_lists
+    _memo = {}
+
+def solve_shard(origins, destinations, max_transfers):
+    """
+    Find the best path of a shard of the pairs in a worker process.
+
+    Args:
+    Numpy array: number of the list of stops near the origin of every pair
+    Numpy array: number of the list of stops near the destination of every pair
+    Integer: maximum number of transfers
+
+    Returns:
+    List: for every pair, the values of the columns in RESULT_COLUMNS
+    """
+    return solve_pairs(_network, _stop_lists, origins, destinations, max_transfers, _memo)
+
+def compute_od_matrix(lat, lon, n_pairs, get_pairs, output, radius=0.5, max_transfers=1, workers=None, shard_size=200,
+                      ontology_path='data/ontology/gtfs.ttl', processed_path='data/processed/', snapshot_path='data/snapshot/'):
+    """
+    Find the best path between the origin and destination of every pair and write them as CSV rows.
+
+    The stops near every point are found once, in one pass, and the snapshot of the graph and the index of the network
+    are loaded once, building them again if they are out of date. Then the pairs are split into shards that are
+    solved in a pool of processes, which share the memory-mapped index, and the rows are written
+    in the order of the pairs as soon as their shard is solved. Shards only carry the numbers of the stops
+    of their pairs, and they are made as the pool is ready for them, so the pairs are never all in memory.
+
+    Args:
+    Numpy array: latitude of the points
+    Numpy array: longitude of the points
+    Integer: number of pairs
+    Function: gets the id, origin point and destination point of the pairs from a position to another,
+    as returned by table_pairs or grid_pairs
+    File: stream where the CSV rows are written
+    Float: maximum distance in kilometers to the stops of an origin or destination
+    Integer: maximum number of transfers
+    Integer: number of processes, the number of CPUs if None
+    Integer: number of pairs of every shard
+    String: path to the ontology file
+    String: path to the folder with the processed data
+    String: path to the folder of the snapshot
+
+    Returns:
+    Integer: number of pairs with some path
+    """
+    stop_index = load_stop_index(processed_path + 'stops.csv')
+    stop_lists, point_codes = find_point_stops(lat, lon, stop_index, radius)
+    starts = range(0, n_pairs, shard_size)
+    writer = csv.writer(output)
+    writer.writerow(PAIR_COLUMNS + RESULT_COLUMNS)
+    workers = min(workers or os.cpu_count(), max(len(starts), 1))
+    # the snapshot and the index are brought up to date here, before any worker reads them
+    g = load_graph(ontology_path, processed_path, snapshot_path)
+    network = load_network_index(g, snapshot_path, processed_path)
+    pool = None
+    if workers == 1:
+        init_worker(network, stop_lists)
+    else:
+        key = network_index_key(g)
+        initargs = (None, stop_lists, key, snapshot_path + 'network/') if key is not None else (network, stop_lists)
+        pool = ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=initargs)
+    # shards being solved, with their pairs, at most two per process
+    pending = deque()
+    shards = iter(starts)
+    found = 0
+    try:
+        while True:
+            while len(pending) < 2 * workers:
+                start = next(shards, None)
+                if start is None:
+                    break
+                ids, origins, destinations = get_pairs(start, min(start + shard_size, n_pairs))
+                args = (point_codes[origins], point_codes[destinations], max_transfers)
+                result = pool.submit(solve_shard, *args) if pool is not None else solve_shard(*args)
+                pending.append((ids, origins, destinations, result))
+            if not pending:
+                break
+            ids, origins, destinations, result = pending.popleft()
+            rows = result.result() if pool is not None else result
+            for pair_id, o, d, row in zip(ids, origins.tolist(), destinations.tolist(), rows):
+                writer.writerow([pair_id, lat[o], lon[o], lat[d], lon[d]] + row)
+                found += row[2] > 0
+            output.flush()
+    finally:
+        if pool is not None:
+            pool.shutdown(cancel_futures=True)
+    return found
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Find the best path between many origins and destinations.')
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--pairs', metavar='FILE',
+                        help='CSV file with columns origin_lat, origin_lon, destination_lat, destination_lon and optionally id')
+    source.add_argument('--grid', type=float, metavar='KM', help='every pair of zones of a grid of this size over the stops')
+    parser.add_argument('output', nargs='?', default='-', help='CSV file of the matrix, the standard output by default')
+    parser.add_argument('--radius', type=float, default=0.5, help='maximum distance in kilometers to the stops')
+    parser.add_argument('--max-transfers', type=int, default=1)
+    parser.add_argument('--workers', type=int, help='number of processes, the number of CPUs by default')
+    parser.add_argument('--shard-size', type=int, default=200, help='number of pairs solved at once by a process')
+    parser.add_argument('--ontology', default='data/ontology/gtfs.ttl')
+    parser.add_argument('--processed', default='data/processed/')
+    parser.add_argument('--snapshot', default='data/snapshot/')
+    args = parser.parse_args()
+
+    if args.pairs is not None:
+        lat, lon, n_pairs, get_pairs = table_pairs(read_pairs(args.pairs))
+    else:
+        lat, lon, n_pairs, get_pairs = grid_pairs(load_stop_index(args.processed + 'stops.csv'), args.grid, args.radius)
+    output = sys.stdout if args.output == '-' else open(args.output, 'w', newline='')
+    try:
+        found = compute_od_matrix(lat, lon, n_pairs, get_pairs, output, args.radius, args.max_transfers, args.workers,
+                                  args.shard_size, args.ontology, args.processed, args.snapshot)
+    finally:
+        if output is not sys.stdout:
+            output.close()
+    sys.stderr.write('{} of {} pairs have a path\n'.format(found, n_pairs))
@@ -0,0 +1,129 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from instrumentation import count
+
+# version of the format of the cached answers, a new one discards the stored answers
+QUERY_CACHE_VERSION = 1
+
+class QueryCache:
+    """
+    Cache of the answers of path queries, keyed by the stops near their origin and destination.
+
+    The answers are kept in memory and, if a file is given, in a SQLite file that survives restarts.
+    When there are more than max_entries, the least recently used ones are evicted. Every answer is stored
+    with the version of the processed data it was found with, and answers of other versions are discarded.
+    """
+
+    def __init__(self, data_version, max_entries=1000, filename=None):
+        self.version = '{}:{}'.format(QUERY_CACHE_VERSION, data_version)
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+        self.connection = None
+        if filename:
+            if os.path.dirname(filename):
+                os.makedirs(os.path.dirname(filename), exist_ok=True)
+            self.connection = sqlite3.connect(filename, check_same_thread=False)
+            self.connection.execute('CREATE TABLE IF NOT EXISTS query_results '
+                                    '(key TEXT PRIMARY KEY, version TEXT, result TEXT, used REAL)')
+            # answers found with other processed data are stale
+            self.evictions += self.connection.execute('DELETE FROM query_results WHERE version != ?', (self.version,)).rowcount
+            self.connection.commit()
+
+    @staticmethod
+    def make_key(origin_stops, destination_stops, max_transfers):
+        """
+        Get the key of a query.
+
+        Args:
+        List: stops near the origin
+        List: stops near the destination
+        Integer: maximum number of transfers
+
+        Returns:
+        String: the key
+        """
+        return json.dumps([list(origin_stops), list(destination_stops), max_transfers])
+
+    def get(self, key):
+        """
+        Get the cached answer of a query.
+
+        Args:
+        String: key of the query, as returned by make_key
+
+        Returns:
+        Tuple: whether the query is cached and its answer
+        """
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                count('query_cache_hits')
+                return True, self.entries[key]
+            row = None
+            if self.connection is not None:
+                row = self.connection.execute('SELECT result FROM query_results WHERE key = ? AND version = ?',
+                                              (key, self.version)).fetchone()
+            if row is None:
+                self.misses += 1
+                count('query_cache_misses')
+                return False, None
+            self.hits += 1
+            count('query_cache_hits')
+            result = json.loads(row[0])
+            self.connection.execute('UPDATE query_results SET used = ? WHERE key = ?', (time.time(), key))
+            self.connection.commit()
+            self._remember(key, result)
+        return True, result
+
+    def put(self, key, result):
+        """
+        Store the answer of a query, evicting the least recently used ones.
+
+        Args:
+        String: key of the query, as returned by make_key
+        JSON-serializable object: answer of the query
+
+        Returns:
+        Void
+        """
+        with self.lock:
+            self._remember(key, result)
+            if self.connection is not None:
+                self.connection.execute('INSERT OR REPLACE INTO query_results VALUES (?, ?, ?, ?)',
+                                        (key, self.version, json.dumps(result, ensure_ascii=False), time.time()))
+                self.connection.execute('DELETE FROM query_results WHERE key IN '
+                                        '(SELECT key FROM query_results ORDER BY used DESC LIMIT -1 OFFSET ?)',
+                                        (self.max_entries,))
+                self.connection.commit()
+
+    def _remember(self, key, result):
+        self.entries[key] = result
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def stats(self):
+        """
+        Get the statistics of the cache since it was opened.
+
+        Returns:
+        Dictionary: version of the processed data, number of entries in memory, hits, misses, evictions and hit rate
+        """
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {'version': self.version, 'entries': len(self.entries), 'hits': self.hits, 'misses': self.misses,
+                    'evictions': self.evictions, 'hit_rate': self.hits / lookups if lookups else 0.0}
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
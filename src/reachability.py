@@ -0,0 +1,232 @@
+import argparse
+import json
+import sys
+import numpy as np
+import pandas as pd
+from network_index import compressed_rows, gather_rows
+
+PROCESSED_PATH = 'data/processed/'
+
+def make_bitsets(rows, columns, n_rows, n_columns):
+    """
+    Build one bitset per row from a list of (row, column) pairs.
+
+    Args:
+    Numpy array: row of each pair
+    Numpy array: column of each pair
+    Integer: number of rows
+    Integer: number of columns
+
+    Returns:
+    Numpy array: 64-bit words of shape (n_rows, ceil(n_columns / 64)), bit j of row i set if the pair (i, j) is given
+    """
+    bitsets = np.zeros((n_rows, (n_columns + 63) // 64), dtype=np.uint64)
+    columns = np.asarray(columns, dtype=np.int64)
+    np.bitwise_or.at(bitsets, (np.asarray(rows, dtype=np.int64), columns >> 6),
+                     np.left_shift(np.uint64(1), (columns & 63).astype(np.uint64)))
+    return bitsets
+
+def union(bitsets, rows):
+    """
+    Get the union of some rows of a table of bitsets.
+
+    Args:
+    Numpy array: bitsets, as returned by make_bitsets
+    Numpy array: rows to join
+
+    Returns:
+    Numpy array: words of the union
+    """
+    if len(rows) == 0:
+        return np.zeros(bitsets.shape[1], dtype=np.uint64)
+    return np.bitwise_or.reduce(bitsets[rows], axis=0)
+
+def members(bitset, n):
+    """
+    Get the positions of the bits set in a bitset.
+
+    Args:
+    Numpy array: words of the bitset
+    Integer: number of bits
+
+    Returns:
+    Numpy array: positions in increasing order
+    """
+    bits = np.unpackbits(bitset.astype('<u8').view(np.uint8), bitorder='little')[:n]
+    return np.flatnonzero(bits)
+
+class ReachabilityIndex:
+    """
+    Bitsets of the stops of every route, of the routes of every stop and of the routes that can be reached
+    from every route walking one transfer.
+
+    A route reaches every one of its stops, in any direction, and a transfer is a walk of the transfers
+    table from a stop of a route to a stop of another route, or a change of route at the same stop.
+    The stops reachable from some stops with at most N transfers are then found with N + 2 unions of bitsets.
+    """
+
+    def __init__(self, stop_ids, route_ids, stop_names, stop_lat, stop_lon, stop_routes, transfers):
+        self.stop_ids = np.asarray(stop_ids)
+        self.route_ids = np.asarray(route_ids)
+        self.stop_names = np.asarray(stop_names)
+        self.stop_lat = np.asarray(stop_lat, dtype=np.float64)
+        self.stop_lon = np.asarray(stop_lon, dtype=np.float64)
+        self.stop_codes = {stop: i for i, stop in enumerate(self.stop_ids.tolist())}
+        n_stops, n_routes = len(self.stop_ids), len(self.route_ids)
+        stop_column, route_column = stop_routes
+        self.route_stops = make_bitsets(route_column, stop_column, n_routes, n_stops)
+        self.stop_routes = make_bitsets(stop_column, route_column, n_stops, n_routes)
+        # routes of the stops at both ends of every transfer, changing at the same stop included
+        transfer_from, transfer_to = transfers
+        transfer_from = np.concatenate([transfer_from, np.arange(n_stops)])
+        transfer_to = np.concatenate([transfer_to, np.arange(n_stops)])
+        ptr, routes = compressed_rows(stop_column, route_column, n_stops)
+        n_routes_of = np.diff(ptr)
+        route_from = gather_rows(ptr, routes, transfer_from)[1]
+        # the route where every transfer starts and the stop where it ends, once
+        pairs = np.unique(route_from.astype(np.int64) * n_stops + np.repeat(transfer_to, n_routes_of[transfer_from]))
+        route_from, stop_to = pairs // n_stops, pairs % n_stops
+        route_to = gather_rows(ptr, routes, stop_to)[1]
+        self.route_transfers = make_bitsets(np.repeat(route_from, n_routes_of[stop_to]), route_to, n_routes, n_routes)
+
+    def get_stop_codes(self, stops):
+        """
+        Get the positions in the index of a list of stops, skipping unknown ones.
+
+        Args:
+        List: stop_id of the stops
+
+        Returns:
+        Numpy array: positions of the stops
+        """
+        return np.array([self.stop_codes[stop] for stop in stops if stop in self.stop_codes], dtype=np.int64)
+
+    def reachable(self, origin_stops, max_transfers=1):
+        """
+        Find the stops that can be reached from some stops with at most max_transfers transfers.
+
+        Each round joins the transfers of the routes reached in the previous round and keeps
+        those that weren't reached before, so every route and stop is labelled with its fewest transfers.
+
+        Args:
+        List: stop_id of the origin stops
+        Integer: maximum number of transfers
+
+        Returns:
+        Tuple: positions of the reachable stops, the origin stops included, and the fewest transfers to reach each of them
+        """
+        n_stops, n_routes = len(self.stop_ids), len(self.route_ids)
+        origins = self.get_stop_codes(origin_stops)
+        reached_stops = make_bitsets(np.zeros(len(origins), dtype=np.int64), origins, 1, n_stops)[0]
+        transfers = np.full(n_stops, -1, dtype=np.int32)
+        transfers[origins] = 0
+        frontier = union(self.stop_routes, origins)
+        reached_routes = frontier.copy()
+        for n in range(max_transfers + 1):
+            routes = members(frontier, n_routes)
+            if len(routes) == 0:
+                break
+            new_stops = union(self.route_stops, routes) & ~reached_stops
+            reached_stops |= new_stops
+            transfers[members(new_stops, n_stops)] = n
+            if n < max_transfers:
+                frontier = union(self.route_transfers, routes) & ~reached_routes
+                reached_routes |= frontier
+        stops = members(reached_stops, n_stops)
+        return stops, transfers[stops]
+
+    def reachable_stops(self, origin_stops, max_transfers=1):
+        """
+        Find the stop_id of the stops that can be reached from some stops with at most max_transfers transfers.
+
+        Args:
+        List: stop_id of the origin stops
+        Integer: maximum number of transfers
+
+        Returns:
+        Dictionary: fewest transfers to reach every reachable stop, by stop_id
+        """
+        stops, transfers = self.reachable(origin_stops, max_transfers)
+        return dict(zip(self.stop_ids[stops].tolist(), transfers.tolist()))
+
+    def reachable_geojson(self, origin_stops, max_transfers=1):
+        """
+        Find the stops that can be reached from some stops with at most max_transfers transfers, as GeoJSON.
+
+        Args:
+        List: stop_id of the origin stops
+        Integer: maximum number of transfers
+
+        Returns:
+        Dictionary: GeoJSON FeatureCollection with a Point for every reachable stop and its stop_id, name
+        and fewest transfers as properties
+        """
+        stops, transfers = self.reachable(origin_stops, max_transfers)
+        return {
+            'type': 'FeatureCollection',
+            'features': [{'type': 'Feature',
+                          'geometry': {'type': 'Point', 'coordinates': [lon, lat]},
+                          'properties': {'stop_id': stop, 'stop_name': name, 'transfers': n}}
+                         for stop, name, lat, lon, n in zip(self.stop_ids[stops].tolist(), self.stop_names[stops].tolist(),
+                                                            self.stop_lat[stops].tolist(), self.stop_lon[stops].tolist(),
+                                                            transfers.tolist())],
+        }
+
+def build_reachability_index(stops, transfers):
+    """
+    Build the reachability index of the stops and transfers of the processed data.
+
+    Args:
+    Pandas dataframe: stops, with a row for every stop and route
+    Pandas dataframe: transfers
+
+    Returns:
+    ReachabilityIndex: bitsets of the stops, routes and transfers
+    """
+    stop_codes, stop_ids = pd.factorize(stops['stop_id'])
+    route_codes, route_ids = pd.factorize(stops['route_id'])
+    # the name and coordinates of a stop are those of its first row
+    first = np.unique(stop_codes, return_index=True)[1]
+    transfers = transfers[transfers['transfer_from'].isin(stop_ids) & transfers['transfer_to'].isin(stop_ids)]
+    return ReachabilityIndex(stop_ids.values, route_ids.values, stops['stop_name'].values[first],
+                             stops['stop_lat'].values[first], stops['stop_lon'].values[first], (stop_codes, route_codes),
+                             (stop_ids.get_indexer(transfers['transfer_from']), stop_ids.get_indexer(transfers['transfer_to'])))
+
+def load_reachability_index(processed_path=PROCESSED_PATH):
+    """
+    Build the reachability index from the files written by data_processing.py.
+
+    Args:
+    String: path to the folder with the processed data
+
+    Returns:
+    ReachabilityIndex: bitsets of the stops, routes and transfers
+    """
+    stops = pd.read_csv(processed_path + 'stops.csv', dtype={'stop_id': str, 'stop_name': str, 'route_id': str})
+    transfers = pd.read_csv(processed_path + 'transfers.csv', dtype=str)
+    return build_reachability_index(stops, transfers)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Find the stops that can be reached from an origin.')
+    origin = parser.add_mutually_exclusive_group(required=True)
+    origin.add_argument('--origin', metavar='LAT,LON', help='coordinates of the origin, reached from its nearby stops')
+    origin.add_argument('--stops', nargs='+', metavar='STOP_ID', help='stop_id of the origin stops')
+    parser.add_argument('--radius', type=float, default=0.5, help='maximum distance in kilometers to the stops of the origin')
+    parser.add_argument('--max-transfers', type=int, default=1)
+    parser.add_argument('--geojson', action='store_true', help='write a GeoJSON FeatureCollection instead of the stop_id')
+    parser.add_argument('--processed', default=PROCESSED_PATH)
+    args = parser.parse_args()
+
+    index = load_reachability_index(args.processed)
+    if args.stops is not None:
+        origin_stops = args.stops
+    else:
+        from find_stops import load_stop_index, find_nearest_stops
+        lat, lon = [float(value) for value in args.origin.split(',')]
+        origin_stops = find_nearest_stops(lat, lon, radius=args.radius, stop_index=load_stop_index(args.processed + 'stops.csv'))
+    if args.geojson:
+        json.dump(index.reachable_geojson(origin_stops, args.max_transfers), sys.stdout, ensure_ascii=False)
+        sys.stdout.write('\n')
+    else:
+        for stop, transfers in index.reachable_stops(origin_stops, args.max_transfers).items():
+            print('{},{}'.format(stop, transfers))
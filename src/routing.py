@@ -0,0 +1,437 @@
+import weakref
+import numpy as np
+from data_processing import calculate_distance
+from find_routes import get_route_mode_label, get_path_stops, get_local_name, get_stop_numbers, select_best_paths
+from network_index import gather_rows
+from instrumentation import timed, count, stage
+
+# tables of every network index that don't depend on the query
+_network_tables = weakref.WeakKeyDictionary()
+
+def get_stop_distances(network, stops_from, stops_to):
+    """
+    Get the distances between stops of the network index.
+
+    Args:
+    NetworkIndex: index of the graph that represents the transport network
+    Numpy array: stop numbers of the first points
+    Numpy array: stop numbers of the second points, broadcastable with the first ones
+
+    Returns:
+    Numpy array: distances in kilometers
+    """
+    return calculate_distance(network.stop_lat[stops_from], network.stop_lon[stops_from],
+                              network.stop_lat[stops_to], network.stop_lon[stops_to])
+
+def get_network_tables(network):
+    """
+    Get the modes of the routes and the transfers with their length, computed once for every network index.
+
+    Args:
+    NetworkIndex: index of the graph that represents the transport network
+
+    Returns:
+    Tuple: sorted labels of the modes, number of the mode of every route, and the stop where
+    every transfer starts, the stop where it ends and its length
+    """
+    tables = _network_tables.get(network)
+    if tables is None:
+        mode_labels = [get_route_mode_label(network, route) for route in network.routes]
+        modes = sorted(set(mode_labels))
+        route_modes = np.array([modes.index(label) for label in mode_labels], dtype=np.int32)
+        transfer_from = np.repeat(np.arange(len(network.stops), dtype=np.int32), np.diff(network.transfers_ptr))
+        transfer_to = network.transfers
+        transfer_distances = get_stop_distances(network, transfer_from, transfer_to)
+        tables = (modes, route_modes, transfer_from, transfer_to, transfer_distances)
+        _network_tables[network] = tables
+    return tables
+
+def new_labels(shape):
+    """
+    Get empty labels of the stops.
+
+    Args:
+    Tuple: shape of the labels, (2, number of modes, number of stops)
+
+    Returns:
+    Tuple: arrays of that shape with the distance to reach each stop, the last route ridden, the stop where
+    the ride that reaches it boards or the walk that reaches it starts, and the label of that stop it comes from
+    """
+    return (np.full(shape, np.inf), np.full(shape, -1, dtype=np.int32), np.full(shape, -1, dtype=np.int32),
+            np.full(shape, -1, dtype=np.int32))
+
+def push_labels(labels, stops, cost, route, board, slot):
+    """
+    Add the distances of riding a route to the labels of its stops.
+
+    Every mode and stop keeps two labels: the shortest distance and the shortest distance riding another route
+    last, so a transfer can always board a route other than the one it alighted from.
+
+    Args:
+    Tuple: labels, as returned by new_labels, updated in place
+    Numpy array: stops of the route
+    Numpy array: distance to reach each stop (columns) for each mode of the first route (rows)
+    Integer: route number
+    Numpy array: boarding stop of each distance
+    Numpy array: label of the boarding stop of each distance
+
+    Returns:
+    Void
+    """
+    distance, last_route = labels[0], labels[1]
+    first = cost < distance[0][:, stops]
+    second = ~first & (cost < distance[1][:, stops]) & (last_route[0][:, stops] != route)
+    modes, columns = np.nonzero(first)
+    targets = stops[columns]
+    # the first label moves to the second place unless it rode the same route
+    moved = last_route[0, modes, targets] != route
+    for array in labels:
+        array[1, modes[moved], targets[moved]] = array[0, modes[moved], targets[moved]]
+    values = (cost, np.broadcast_to(route, cost.shape), board, slot)
+    for array, value in zip(labels, values):
+        array[0, modes, targets] = value[modes, columns]
+    modes, columns = np.nonzero(second)
+    for array, value in zip(labels, values):
+        array[1, modes, stops[columns]] = value[modes, columns]
+
+def board_labels(walked, route, stops):
+    """
+    Get the label of every stop of a route from which the route can be boarded.
+
+    Args:
+    Tuple: labels of the stops after walking, as returned by walk
+    Integer: route number
+    Numpy array: stops of the route
+
+    Returns:
+    Tuple: distance to reach each stop (columns) for each mode of the first route (rows) without having ridden
+    the route last, and which label it is
+    """
+    slot = (walked[1][0][:, stops] == route).astype(np.int32)
+    return np.where(slot == 0, walked[0][0][:, stops], walked[0][1][:, stops]), slot
+
+def ride(network, walked, routes):
+    """
+    Ride each of the given routes from the stops with a label to every other stop of the route.
+
+    Args:
+    NetworkIndex: index of the graph that represents the transport network
+    Tuple: labels of the stops after walking, as returned by walk
+    Iterable: route numbers
+
+    Returns:
+    Tuple: labels of the stops after riding, as returned by new_labels
+    """
+    labels = new_labels(walked[0].shape)
+    for route in routes:
+        stops = network.stops_of(route)
+        distances, slot = board_labels(walked, route, stops)
+        boarded = np.isfinite(distances).any(axis=0)
+        if not boarded.any():
+            continue
+        boards = stops[boarded]
+        # distance through every boarding stop (axis 1) to every stop of the route (axis 2)
+        total = distances[:, boarded][:, :, None] + network.ride_distances(route, boards[:, None], stops[None, :])[None, :, :]
+        best = total.argmin(axis=1)
+        cost = np.take_along_axis(total, best[:, None, :], axis=1)[:, 0, :]
+        push_labels(labels, stops, cost, route, boards[best], np.take_along_axis(slot[:, boarded], best, axis=1))
+    return labels
+
+def walk(network, arrival, transfer_from, transfer_to, transfer_distances):
+    """
+    Walk every transfer that starts at a stop with a label.
+
+    Args:
+    NetworkIndex: index of the graph that represents the transport network
+    Tuple: labels of the stops after riding, as returned by new_labels
+    Numpy array: stop where each transfer starts
+    Numpy array: stop where each transfer ends
+    Numpy array: length of each transfer
+
+    Returns:
+    Tuple: labels of the stops after walking, as returned by new_labels, with the route ridden before the walk
+    and the stop the walk starts from
+    """
+    distance, last_route = arrival[0], arrival[1]
+    walked = new_labels(distance.shape)
+    # every transfer from both labels of the stop where it starts
+    starts = np.concatenate([transfer_from, transfer_from])
+    targets = np.concatenate([transfer_to, transfer_to])
+    slots = np.repeat(np.arange(2, dtype=np.int32), len(transfer_from))
+    lengths = np.concatenate([transfer_distances, transfer_distances])
+    for mode in range(distance.shape[1]):
+        cost = distance[:, mode, transfer_from].ravel() + lengths
+        routes = last_route[:, mode, transfer_from].ravel()
+        reached = np.flatnonzero(np.isfinite(cost))
+        order = reached[np.lexsort((cost[reached], targets[reached]))]
+        for slot in range(2):
+            if slot == 1:
+                # the second label of a stop rode another route than the first one
+                order = order[routes[order] != walked[1][0, mode, targets[order]]]
+            # shortest transfer to every stop, the first one listed in case of ties
+            first = np.ones(len(order), dtype=bool)
+            first[1:] = targets[order][1:] != targets[order][:-1]
+            chosen = order[first]
+            for array, values in zip(walked, (cost, routes, starts, slots)):
+                array[slot, mode, targets[chosen]] = values[chosen]
+    return walked
+
+@timed('find_routes')
+def find_journeys(network, origin_stops, destination_stops, max_transfers=1, every_round=False):
+    """
+    Find the best paths between two nodes in the graph, doing at most max_transfers transfers.
+
+    Round-based search over the routes, like RAPTOR but with the distance of find_path_distance
+    instead of the time, riding the routes only in the direction of their stops: the first round rides the routes of the origin stops and every other round
+    walks a transfer and rides the routes reached. The label of a stop is the shortest distance to reach it,
+    kept apart for every mode of the first route, so each round is a single scan of the routes reached
+    and the best path for every pair of origin and destination modes is not lost. As in find_routes, a transfer
+    never boards the route it alighted from, so every stop also keeps the shortest distance riding another route last.
+
+    For every mode of the origin route, destination route and destination stop, only the shortest path
+    is kept, so the best paths selected from these ones are the same as those selected from all
+    the paths with the same number of transfers. With every_round, the shortest path is kept for every
+    number of transfers too, so the paths with fewer transfers don't depend on max_transfers.
+
+    Args:
+    NetworkIndex: index of the graph that represents the transport network
+    List: list of stops near the origin
+    List: list of stops near the destination
+    Integer: maximum number of transfers
+    Boolean: whether to keep the shortest path of every number of transfers
+
+    Returns:
+    List: list of paths in the format returned by the function find_routes. Paths with more
+    than one transfer repeat the fields mid_stop_1, mid_stop_2 and route before the destination route.
+    """
+    origins = get_stop_numbers(network, origin_stops)
+    destinations = get_stop_numbers(network, destination_stops)
+    if len(origins) == 0 or len(destinations) == 0:
+        return []
+    modes, route_modes, transfer_from, transfer_to, transfer_distances = get_network_tables(network)
+    n_stops = len(network.stops)
+
+    # best path for every mode of the origin route, destination route, destination and, with every_round,
+    # number of transfers: (distance, number of transfers, origin or last boarding stop, label of the boarding stop)
+    best = {}
+    destination_routes = {}
+    for destination in destinations.tolist():
+        for route in network.routes_of(destination).tolist():
+            destination_routes.setdefault(route, []).append(destination)
+    # paths without transfers are preferable
+    for route, route_destinations in destination_routes.items():
+        route_origins = origins[network.has_route(origins, route)]
+        if len(route_origins) == 0:
+            continue
+        distances = network.ride_distances(route, route_origins[:, None], np.array(route_destinations)[None, :]) - 0.6
+        nearest = distances.argmin(axis=0)
+        for j, destination in enumerate(route_destinations):
+            if np.isfinite(distances[nearest[j], j]):
+                key = (route_modes[route], route, destination) + ((0,) if every_round else ())
+                best[key] = (distances[nearest[j], j], 0, route_origins[nearest[j]], -1)
+
+    # first round: ride the routes of the origin stops
+    origin_routes = {}
+    for origin in origins.tolist():
+        for route in network.routes_of(origin).tolist():
+            origin_routes.setdefault(route, []).append(origin)
+    arrival = new_labels((2, len(modes), n_stops))
+    for route, route_origins in origin_routes.items():
+        stops = network.stops_of(route)
+        route_origins = np.array(route_origins)
+        distances = network.ride_distances(route, route_origins[:, None], stops[None, :])
+        nearest = distances.argmin(axis=0)
+        cost = np.full((len(modes), len(stops)), np.inf)
+        cost[route_modes[route]] = distances[nearest, np.arange(len(stops))]
+        push_labels(arrival, stops, cost, route, np.broadcast_to(route_origins[nearest], cost.shape),
+                    np.full(cost.shape, -1, dtype=np.int32))
+    # labels after every ride and after the walk that follows it
+    rides = [arrival]
+    walks = []
+    for transfers in range(1, max_transfers + 1):
+        if transfers == 1:
+            # as in find_path_distance, paths with one transfer at the origin are preferable
+            preferred = (arrival[0] - 0.6 * (arrival[2] == np.arange(n_stops)),) + arrival[1:]
+            first_walk = last_walk = walk(network, preferred, transfer_from, transfer_to, transfer_distances)
+        else:
+            walks.append(walk(network, rides[-1], transfer_from, transfer_to, transfer_distances))
+            last_walk = walks[-1]
+        # last ride: the routes of the destination stops
+        for route, route_destinations in destination_routes.items():
+            stops = network.stops_of(route)
+            distances, slot = board_labels(last_walk, route, stops)
+            boarded = np.isfinite(distances).any(axis=0)
+            if not boarded.any():
+                continue
+            boards = stops[boarded]
+            slot = slot[:, boarded]
+            total = distances[:, boarded][:, :, None] + \
+                network.ride_distances(route, boards[:, None], np.array(route_destinations)[None, :])[None, :, :]
+            nearest = total.argmin(axis=1)
+            for mode in range(len(modes)):
+                for j, destination in enumerate(route_destinations):
+                    distance = total[mode, nearest[mode, j], j]
+                    key = (mode, route, destination) + ((transfers,) if every_round else ())
+                    if np.isfinite(distance) and (key not in best or distance < best[key][0]):
+                        best[key] = (distance, transfers, boards[nearest[mode, j]], slot[mode, nearest[mode, j]])
+        if transfers < max_transfers:
+            if transfers == 1:
+                walks.append(walk(network, arrival, transfer_from, transfer_to, transfer_distances))
+            reached = np.flatnonzero(np.isfinite(walks[-1][0]).any(axis=(0, 1)))
+            routes = np.unique(gather_rows(network.stop_routes_ptr, network.stop_routes, reached)[1])
+            rides.append(ride(network, walks[-1], routes))
+
+    stops = network.stops
+    routes = network.routes
+    paths = []
+    for key, (distance, transfers, stop, slot) in sorted(best.items(), key=lambda item: item[1][0]):
+        mode, route, destination = key[:3]
+        if transfers == 0:
+            paths.append((stops[stop], routes[route], stops[stop], stops[stop], routes[route], stops[destination]))
+            continue
+        # follow the labels back from the last boarding stop to the origin
+        path = [routes[route], stops[destination]]
+        walked = first_walk if transfers == 1 else walks[transfers - 1]
+        for k in range(transfers - 1, -1, -1):
+            mid_stop_1, label = walked[2][slot, mode, stop], walked[3][slot, mode, stop]
+            labels = rides[k]
+            path = [routes[labels[1][label, mode, mid_stop_1]], stops[mid_stop_1], stops[stop]] + path
+            stop, slot = labels[2][label, mode, mid_stop_1], labels[3][label, mode, mid_stop_1]
+            if k > 0:
+                walked = walks[k - 1]
+        paths.append(tuple([stops[stop]] + path))
+    count('candidate_paths', len(paths))
+    return paths
+
+def expand_station_path(network, path, near_origin, near_destination, served=None):
+    """
+    Choose the platforms of the stations of a path found at station level.
+
+    Every ride boards and alights at platforms of its stations served by its route. The platforms are those
+    of the shortest path, as measured by find_path_distance, found leg by leg. The origin and destination
+    are stops near the origin and destination if their stations have any served by the route.
+
+    Args:
+    NetworkIndex: index of the network, with its stations
+    Tuple: path found in the index of the stations, in the format returned by find_journeys
+    Numpy array: whether each stop is near the origin
+    Numpy array: whether each stop is near the destination
+    Dictionary: platforms of a station served by a route, by station and route, filled as they are needed
+
+    Returns:
+    Tuple: the path with the platforms of its stations, or None if no platforms can be ridden in order
+    """
+    path_stations = [network.stations.stop_index[station] for station in get_path_stops(path)]
+    routes = [network.route_index[route] for route in path[1::3]]
+    direct = len(path) == 6 and routes[0] == routes[1] and path[0] == path[2] == path[3]
+    served = {} if served is None else served
+    candidates = []
+    for position, station in enumerate(path_stations):
+        route = routes[position // 2]
+        platforms = served.get((station, route))
+        if platforms is None:
+            platforms = network.platforms_of(station)
+            platforms = served[(station, route)] = platforms[network.has_route(platforms, route)]
+        # prefer the stops near the origin or destination
+        near = near_origin if position == 0 else near_destination if position == len(path_stations) - 1 else None
+        if near is not None and near[platforms].any():
+            platforms = platforms[near[platforms]]
+        if len(platforms) == 0:
+            return None
+        candidates.append(platforms)
+    if direct:
+        origin_platforms, destination_platforms = candidates[0], candidates[-1]
+        stays = -0.6 + network.ride_distances(routes[0], origin_platforms, origin_platforms)
+        distances = stays[:, None] + network.ride_distances(routes[0], origin_platforms[:, None], destination_platforms[None, :])
+        best = np.unravel_index(np.argmin(distances), distances.shape)
+        if not np.isfinite(distances[best]):
+            return None
+        origin, destination = network.stops[origin_platforms[best[0]]], network.stops[destination_platforms[best[1]]]
+        return (origin, path[1], origin, origin, path[4], destination)
+    # shortest distance to every platform of the stop, and the platform of the previous stop it comes from
+    distances = np.zeros(len(candidates[0]))
+    previous = []
+    for position in range(1, len(candidates)):
+        platforms_from, platforms_to = candidates[position - 1], candidates[position]
+        if position % 2:
+            legs = network.ride_distances(routes[position // 2], platforms_from[:, None], platforms_to[None, :])
+            # as in find_path_distance, paths with one transfer at the origin are preferable
+            if len(candidates) == 4 and position == 1:
+                legs = legs - 0.6 * (platforms_from[:, None] == platforms_to[None, :])
+        else:
+            legs = get_stop_distances(network, platforms_from[:, None], platforms_to[None, :])
+        total = distances[:, None] + legs
+        previous.append(total.argmin(axis=0))
+        distances = total.min(axis=0)
+    last = int(distances.argmin())
+    if not np.isfinite(distances[last]):
+        return None
+    chosen = [last]
+    for position in range(len(candidates) - 1, 0, -1):
+        chosen.append(int(previous[position - 1][chosen[-1]]))
+    stops = [network.stops[platforms[i]] for platforms, i in zip(candidates, reversed(chosen))]
+    expanded = [stops[0]]
+    for i, route in enumerate(path[1::3][:-1]):
+        expanded += [route, stops[2 * i + 1], stops[2 * i + 2]]
+    return tuple(expanded + [path[-2], stops[-1]])
+
+def find_station_journeys(network, origin_stops, destination_stops, max_transfers=1, per_mode_pair=3):
+    """
+    Find the best paths between two nodes in the graph, between platforms and between stations,
+    doing at most max_transfers transfers.
+
+    The paths that find_journeys finds between the platforms are completed with paths found at station level,
+    where changing routes inside a station isn't a walk: find_journeys runs on the index of the stations,
+    from the stations of the stops near the origin to those of the stops near the destination, keeping
+    the shortest path of every number of transfers. The distances between stations are approximate,
+    so for every number of transfers a few of the shortest paths of every pair of modes are expanded
+    to platforms by expand_station_path, and they are scored with their platforms by select_best_routes
+    along with the paths between platforms. The best paths are never longer than those of find_journeys,
+    and allowing more transfers never makes them longer. Without stations in the index, it is the same
+    as find_journeys.
+
+    Args:
+    NetworkIndex: index of the graph that represents the transport network
+    List: list of stops near the origin
+    List: list of stops near the destination
+    Integer: maximum number of transfers
+    Integer: number of paths between stations expanded for every pair of modes and number of transfers
+
+    Returns:
+    List: list of paths in the format returned by the function find_journeys, with platforms as stops,
+    those found between platforms first
+    """
+    paths = find_journeys(network, origin_stops, destination_stops, max_transfers)
+    if network.stations is None:
+        return paths
+    origins = get_stop_numbers(network, origin_stops)
+    destinations = get_stop_numbers(network, destination_stops)
+    origin_stations = [get_local_name(network.stations.stops[station])
+                       for station in dict.fromkeys(network.stop_stations[origins].tolist()) if station >= 0]
+    destination_stations = [get_local_name(network.stations.stops[station])
+                            for station in dict.fromkeys(network.stop_stations[destinations].tolist()) if station >= 0]
+    count('origin_stations', len(origin_stations))
+    count('destination_stations', len(destination_stations))
+    station_paths = find_journeys(network.stations, origin_stations, destination_stations, max_transfers, every_round=True)
+    # the paths of every length are selected apart, so those with fewer transfers don't depend on max_transfers
+    lengths = np.array([len(path) for path in station_paths], dtype=np.int32)
+    selected = []
+    for length in np.unique(lengths).tolist():
+        positions = np.flatnonzero(lengths == length)
+        chosen = select_best_paths(network.stations, [station_paths[i] for i in positions.tolist()],
+                                   per_mode_pair=per_mode_pair)[0]
+        selected += positions[chosen].tolist()
+    count('paths_pruned', len(station_paths) - len(selected))
+    near_origin = np.zeros(len(network.stops), dtype=bool)
+    near_origin[origins] = True
+    near_destination = np.zeros(len(network.stops), dtype=bool)
+    near_destination[destinations] = True
+    served = {}
+    known = set(paths)
+    with stage('expand_stations'):
+        for i in sorted(selected):
+            path = expand_station_path(network, station_paths[i], near_origin, near_destination, served)
+            if path is not None and path not in known:
+                known.add(path)
+                paths.append(path)
+    return paths
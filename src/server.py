@@ -0,0 +1,490 @@
+import argparse
+import contextlib
+import json
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+from graph_snapshot import load_graph
+from network_index import load_network_index
+import find_coordinates
+from find_coordinates import GazetteerGeocoder, configure_geocoding, get_coordinates
+from find_stops import load_stop_index, find_nearest_stops
+from find_routes import select_best_routes
+from routing import find_station_journeys
+from instrumentation import Metrics, MetricsRegistry, JsonLinesExporter
+from data_processing import read_data_version
+from query_cache import QueryCache
+from reachability import load_reachability_index
+
+# totals of the instrumented queries, their JSON lines log and whether queries may ask to be profiled
+metrics_registry = None
+metrics_exporter = None
+allow_profile = False
+
+def configure_metrics(instrument=False, log_filename=None, profile=False):
+    """
+    Set up the instrumentation of the queries, disabled by default.
+
+    Args:
+    Boolean: whether to time the stages and count the work of every query
+    String: file where the metrics of every query are appended as JSON lines, None not to write them
+    Boolean: whether a query with "profile": true is answered under cProfile
+
+    Returns:
+    MetricsRegistry: totals of the metrics, or None if the queries aren't instrumented
+    """
+    global metrics_registry, metrics_exporter, allow_profile
+    if metrics_exporter is not None:
+        metrics_exporter.close()
+    instrument = instrument or log_filename is not None or profile
+    metrics_registry = MetricsRegistry() if instrument else None
+    metrics_exporter = JsonLinesExporter(log_filename) if log_filename else None
+    allow_profile = profile
+    return metrics_registry
+
+# answers of the queries, keyed by the stops near their origin and destination
+query_cache = None
+
+def configure_query_cache(max_entries=1000, filename=None, processed_path='data/processed/'):
+    """
+    Set up the cache of the answers of the queries.
+
+    Args:
+    Integer: maximum number of answers kept, 0 to disable the cache
+    String: SQLite file where the answers are kept between restarts, None to keep them only in memory
+    String: path to the folder with the processed data, whose version invalidates the answers
+
+    Returns:
+    QueryCache: the cache, or None if it is disabled
+    """
+    global query_cache
+    if query_cache is not None:
+        query_cache.close()
+    query_cache = QueryCache(read_data_version(processed_path), max_entries, filename) if max_entries > 0 else None
+    return query_cache
+
+# largest max_transfers a query may ask for, each transfer is a round of the search
+max_transfers_limit = 3
+
+def configure_query_limits(max_transfers=3):
+    """
+    Set the bounds of the parameters of the queries.
+
+    Args:
+    Integer: largest max_transfers a query may ask for
+
+    Returns:
+    Void
+    """
+    global max_transfers_limit
+    max_transfers_limit = max_transfers
+
+def load_network(ontology_path, processed_path, snapshot_path):
+    """
+    Load everything needed to answer queries: the graph, its index and the spatial index of the stops.
+
+    Args:
+    String: path to the ontology file
+    String: path to the folder with the processed data
+    String: path to the folder of the snapshot
+
+    Returns:
+    Tuple: RDF graph, NetworkIndex and StopIndex
+    """
+    g = load_graph(ontology_path, processed_path, snapshot_path)
+    network = load_network_index(g, snapshot_path, processed_path)
+    stop_index = load_stop_index(processed_path + 'stops.csv')
+    return g, network, stop_index
+
+class QueryError(ValueError):
+    """
+    Error in the fields of a query, answered with the HTTP status 400 instead of 500.
+    """
+
+def get_location(location, field='location'):
+    """
+    Get the geographic coordinates of the origin or destination of a query.
+
+    Args:
+    List or Dictionary with keys lat and lon: geographic coordinates, returned as they are
+    String or Dictionary with keys street and city: postal address, geocoded with get_coordinates
+    String: name of the field of the query, for the error messages
+
+    Returns:
+    Tuple: latitude (Float) and longitude (Float) coordinates
+
+    Raises:
+    QueryError: if the coordinates aren't two numbers or the address isn't found
+    """
+    if isinstance(location, (list, tuple)) or (isinstance(location, dict) and 'lat' in location):
+        try:
+            lat, lon = location if isinstance(location, (list, tuple)) else (location['lat'], location['lon'])
+            return (float(lat), float(lon))
+        except (ValueError, TypeError, KeyError):
+            raise QueryError('{} must have two numbers, the latitude and longitude'.format(field))
+    if not isinstance(location, (str, dict)):
+        raise QueryError('{} must be coordinates or an address'.format(field))
+    try:
+        return get_coordinates(location, verbose=False)
+    except ValueError as error:
+        raise QueryError('{}: {}'.format(field, error))
+
+def get_number(query, field, default, kind):
+    """
+    Get a numeric field of a query.
+
+    Args:
+    Dictionary: query
+    String: name of the field
+    Integer or Float: value if the field is missing
+    Type: int or float
+
+    Returns:
+    Integer or Float: value of the field
+
+    Raises:
+    QueryError: if the field isn't a number of that kind
+    """
+    try:
+        return kind(query.get(field, default))
+    except (ValueError, TypeError):
+        raise QueryError('{} must be {}'.format(field, 'an integer' if kind is int else 'a number'))
+
+def get_max_transfers(query):
+    """
+    Get the maximum number of transfers of a query, 1 by default, checking it is within max_transfers_limit.
+
+    Args:
+    Dictionary: query
+
+    Returns:
+    Integer: maximum number of transfers
+
+    Raises:
+    QueryError: if it isn't an integer between 0 and max_transfers_limit
+    """
+    max_transfers = get_number(query, 'max_transfers', 1, int)
+    if not 0 <= max_transfers <= max_transfers_limit:
+        raise QueryError('max_transfers must be between 0 and {}'.format(max_transfers_limit))
+    return max_transfers
+
+def answer_query(network, stop_index, query):
+    """
+    Find the best paths between the origin and destination of a query.
+
+    Args:
+    NetworkIndex: index of the graph that represents the transport network
+    StopIndex: spatial index of the stops
+    Dictionary: query with keys origin, destination and, optionally, id, radius (kilometers)
+    and max_transfers (1 by default)
+
+    Returns:
+    Dictionary: the id of the query, the paths as returned by select_best_routes,
+    the number of stops found near the origin and destination, whether the paths were cached
+    and the time in milliseconds of each stage
+
+    Raises:
+    QueryError: if a field of the query is missing or invalid
+    """
+    for field in ['origin', 'destination']:
+        if field not in query:
+            raise QueryError('missing field {}'.format(field))
+    radius = get_number(query, 'radius', 0.5, float)
+    max_transfers = get_max_transfers(query)
+    timing = {}
+    start_time = time.perf_counter()
+    origin = get_location(query['origin'], 'origin')
+    destination = get_location(query['destination'], 'destination')
+    timing['geocoding'] = time.perf_counter()
+    origin_stops = find_nearest_stops(*origin, radius=radius, stop_index=stop_index)
+    destination_stops = find_nearest_stops(*destination, radius=radius, stop_index=stop_index)
+    timing['nearest_stops'] = time.perf_counter()
+    # the paths only depend on the stops near the origin and destination
+    key = QueryCache.make_key(origin_stops, destination_stops, max_transfers)
+    cached, result = query_cache.get(key) if query_cache is not None else (False, None)
+    if cached:
+        candidate_paths, best_paths = result
+        timing['query_cache'] = time.perf_counter()
+    else:
+        paths = find_station_journeys(network, origin_stops, destination_stops, max_transfers)
+        timing['find_routes'] = time.perf_counter()
+        best_paths = select_best_routes(network, paths)
+        timing['best_routes'] = time.perf_counter()
+        candidate_paths = len(paths)
+        if query_cache is not None:
+            query_cache.put(key, [candidate_paths, best_paths])
+    # elapsed milliseconds of each stage
+    previous_time = start_time
+    for stage, stage_time in timing.items():
+        timing[stage] = round(1000 * (stage_time - previous_time), 3)
+        previous_time = stage_time
+    timing['total'] = round(1000 * (previous_time - start_time), 3)
+    return {
+        'id': query.get('id'),
+        'origin': origin,
+        'destination': destination,
+        'origin_stops': len(origin_stops),
+        'destination_stops': len(destination_stops),
+        'candidate_paths': candidate_paths,
+        'paths': best_paths,
+        'cached': cached,
+        'timing_ms': timing,
+    }
+
+def safe_answer_query(network, stop_index, query):
+    """
+    Answer a query with try_answer_query and, if the queries are instrumented, record its counters and profile.
+
+    Args:
+    NetworkIndex: index of the graph that represents the transport network
+    StopIndex: spatial index of the stops
+    Dictionary: query as accepted by answer_query
+
+    Returns:
+    Dictionary: the response of answer_query, or the id of the query and the error.
+    If the queries are instrumented, it also has the counters of the query and, if it was profiled, the profile
+    """
+    if metrics_registry is None:
+        return try_answer_query(network, stop_index, query)
+    is_query = isinstance(query, dict)
+    metrics = Metrics(query.get('id') if is_query else None, allow_profile and is_query and bool(query.get('profile')))
+    with metrics:
+        response = try_answer_query(network, stop_index, query)
+    metrics_registry.add(metrics)
+    if metrics_exporter is not None:
+        metrics_exporter.write(metrics)
+    response['counters'] = metrics.counters
+    if metrics.profile:
+        response['profile'] = metrics.profile_stats
+    return response
+
+def try_answer_query(network, stop_index, query):
+    """
+    Call answer_query, returning an error response if the query isn't a JSON object or answering it fails.
+
+    Args:
+    NetworkIndex: index of the graph that represents the transport network
+    StopIndex: spatial index of the stops
+    Dictionary: query as accepted by answer_query
+
+    Returns:
+    Dictionary: the response of answer_query, or the id of the query, the error and its HTTP status,
+    400 if the query is invalid and 500 if answering it failed
+    """
+    if not isinstance(query, dict):
+        return {'id': None, 'error': 'query must be an object', 'status': 400}
+    try:
+        return answer_query(network, stop_index, query)
+    except QueryError as error:
+        return {'id': query.get('id'), 'error': str(error), 'status': 400}
+    except Exception as error:
+        return {'id': query.get('id'), 'error': '{}: {}'.format(type(error).__name__, error), 'status': 500}
+
+def serve_stdio(network, stop_index, workers, input_stream=sys.stdin, output_stream=sys.stdout):
+    """
+    Answer queries read as JSON lines from the input stream, writing one JSON line per response.
+
+    Queries are answered concurrently, so responses may be written in a different order;
+    they carry the id of their query.
+
+    Args:
+    NetworkIndex: index of the graph that represents the transport network
+    StopIndex: spatial index of the stops
+    Integer: number of worker threads
+    File: stream with one JSON query per line
+    File: stream where the responses are written
+
+    Returns:
+    Void
+    """
+    lock = threading.Lock()
+
+    def respond(line):
+        try:
+            query = json.loads(line)
+        except ValueError as error:
+            response = {'id': None, 'error': 'invalid JSON: {}'.format(error), 'status': 400}
+        else:
+            response = safe_answer_query(network, stop_index, query)
+        with lock:
+            output_stream.write(json.dumps(response, ensure_ascii=False) + '\n')
+            output_stream.flush()
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for line in input_stream:
+            if line.strip():
+                pool.submit(respond, line)
+
+class QueryHandler(BaseHTTPRequestHandler):
+    """
+    HTTP interface of the query service.
+
+    GET /route?origin=lat,lon&destination=lat,lon[&radius=km][&max_transfers=n] or POST /route with a JSON query,
+    GET /reachable?origin=lat,lon[&radius=km][&max_transfers=n][&format=geojson] for the stops that can be reached
+    from the origin, GET /stats for the statistics of the geocoding and query caches and GET /metrics for the totals
+    of the instrumented queries in the Prometheus text format.
+    """
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path == '/health':
+            self.send_json(200, {'status': 'ok'})
+            return
+        if url.path == '/stats':
+            cache = find_coordinates.default_cache
+            self.send_json(200, {'geocoding_cache': cache.stats() if cache is not None else None,
+                                 'query_cache': query_cache.stats() if query_cache is not None else None})
+            return
+        if url.path == '/metrics':
+            if metrics_registry is None:
+                self.send_json(404, {'error': 'instrumentation is disabled, start the server with --instrument'})
+                return
+            self.send_text(200, metrics_registry.prometheus_text(), 'text/plain; version=0.0.4; charset=utf-8')
+            return
+        if url.path not in ('/route', '/reachable'):
+            self.send_json(404, {'error': 'not found'})
+            return
+        parameters = {key: values[0] for key, values in parse_qs(url.query).items()}
+        if url.path == '/reachable':
+            self.answer_reachable(parameters)
+            return
+        try:
+            query = {'origin': parameters['origin'].split(','), 'destination': parameters['destination'].split(',')}
+        except KeyError as error:
+            self.send_json(400, {'error': 'missing parameter {}'.format(error)})
+            return
+        for parameter in ['radius', 'max_transfers']:
+            if parameter in parameters:
+                query[parameter] = parameters[parameter]
+        self.answer(query)
+
+    def do_POST(self):
+        if urlparse(self.path).path != '/route':
+            self.send_json(404, {'error': 'not found'})
+            return
+        try:
+            query = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+        except ValueError as error:
+            self.send_json(400, {'error': 'invalid JSON: {}'.format(error)})
+            return
+        self.answer(query)
+
+    def answer(self, query):
+        response = safe_answer_query(self.server.network, self.server.stop_index, query)
+        self.send_json(response.get('status', 200), response)
+
+    def answer_reachable(self, parameters):
+        if self.server.reachability is None:
+            self.send_json(404, {'error': 'the reachability index isn\'t loaded'})
+            return
+        if 'origin' not in parameters:
+            self.send_json(400, {'error': 'missing parameter \'origin\''})
+            return
+        try:
+            lat, lon = get_location(parameters['origin'].split(','), 'origin')
+            origin_stops = find_nearest_stops(lat, lon, radius=get_number(parameters, 'radius', 0.5, float),
+                                              stop_index=self.server.stop_index)
+            max_transfers = get_max_transfers(parameters)
+        except QueryError as error:
+            self.send_json(400, {'error': str(error)})
+            return
+        reachability = self.server.reachability
+        if parameters.get('format') == 'geojson':
+            self.send_text(200, json.dumps(reachability.reachable_geojson(origin_stops, max_transfers), ensure_ascii=False),
+                           'application/geo+json; charset=utf-8')
+        else:
+            self.send_json(200, {'origin': [lat, lon], 'origin_stops': len(origin_stops),
+                                 'stops': reachability.reachable_stops(origin_stops, max_transfers)})
+
+    def send_json(self, status, body):
+        self.send_text(status, json.dumps(body, ensure_ascii=False), 'application/json; charset=utf-8')
+
+    def send_text(self, status, text, content_type):
+        content = text.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format, *args):
+        sys.stderr.write('{} - {}\n'.format(self.address_string(), format % args))
+
+class PoolHTTPServer(HTTPServer):
+    """
+    HTTP server that handles each connection in a fixed pool of worker threads.
+    """
+
+    def __init__(self, address, network, stop_index, workers, reachability=None):
+        super().__init__(address, QueryHandler)
+        self.network = network
+        self.stop_index = stop_index
+        self.reachability = reachability
+        self.pool = ThreadPoolExecutor(max_workers=workers)
+
+    def process_request(self, request, client_address):
+        self.pool.submit(self.process_request_in_worker, request, client_address)
+
+    def process_request_in_worker(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+    def server_close(self):
+        super().server_close()
+        self.pool.shutdown(wait=True)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Answer origin/destination queries with the transport network loaded once.')
+    parser.add_argument('--http', type=int, metavar='PORT', help='serve HTTP on this port instead of JSON lines on stdin/stdout')
+    parser.add_argument('--host', default='127.0.0.1', help='address of the HTTP server')
+    parser.add_argument('--workers', type=int, default=4, help='number of worker threads')
+    parser.add_argument('--gazetteer', metavar='FILE', help='geocode addresses with this CSV file instead of Nominatim')
+    parser.add_argument('--geocoding-cache', default='data/cache/geocoding.sqlite3', metavar='FILE',
+                        help='file of the geocoding cache, empty to disable it')
+    parser.add_argument('--query-cache-size', type=int, default=1000, metavar='N',
+                        help='number of answers of queries kept in the cache, 0 to disable it')
+    parser.add_argument('--query-cache', metavar='FILE', help='keep the answers of the queries in this file between restarts')
+    parser.add_argument('--instrument', action='store_true', help='time the stages and count the work of every query')
+    parser.add_argument('--metrics-log', metavar='FILE', help='append the metrics of every query to this file as JSON lines')
+    parser.add_argument('--profile', action='store_true', help='answer the queries with "profile": true under cProfile')
+    parser.add_argument('--max-transfers-limit', type=int, default=3, metavar='N',
+                        help='largest max_transfers a query may ask for')
+    parser.add_argument('--ontology', default='data/ontology/gtfs.ttl')
+    parser.add_argument('--processed', default='data/processed/')
+    parser.add_argument('--snapshot', default='data/snapshot/')
+    args = parser.parse_args()
+
+    configure_geocoding(GazetteerGeocoder(args.gazetteer) if args.gazetteer else None, args.geocoding_cache or None)
+    configure_metrics(args.instrument, args.metrics_log, args.profile)
+    configure_query_cache(args.query_cache_size, args.query_cache, args.processed)
+    configure_query_limits(args.max_transfers_limit)
+    # the loading of the network is logged as a request with id startup
+    startup = Metrics('startup') if metrics_exporter is not None else contextlib.nullcontext()
+    with startup:
+        g, network, stop_index = load_network(args.ontology, args.processed, args.snapshot)
+    if metrics_exporter is not None:
+        metrics_exporter.write(startup)
+    if args.http is None:
+        serve_stdio(network, stop_index, args.workers)
+    else:
+        server = PoolHTTPServer((args.host, args.http), network, stop_index, args.workers,
+                                load_reachability_index(args.processed))
+        sys.stderr.write('Serving on http://{}:{}/route\n'.format(args.host, args.http))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+    if metrics_exporter is not None:
+        metrics_exporter.close()
+    if query_cache is not None:
+        query_cache.close()
+    g.close()
@@ -0,0 +1,184 @@
+import argparse
+import csv
+import os
+import numpy as np
+
+RAW_PATH = 'data/raw/crtm/'
+# center of Madrid and spread in degrees of the stops of the city and regional data sources
+CENTER = (40.4168, -3.7038)
+CITY_SPREAD = (0.05, 0.07)
+REGION_SPREAD = (0.15, 0.2)
+# stops, routes and trips of each data source for scale 1, close to the size of the real data sources
+# stop_times.txt of the bus data sources, with many trips for every route, is the largest file
+FEED_SIZES = {
+    'M4': (240, 16, 320),
+    'M10': (40, 4, 80),
+    'M5': (100, 12, 24),
+    'M6': (4600, 210, 4200),
+    'M89': (6000, 430, 8600),
+}
+# route_type of each data source, as in the GTFS files of CRTM
+FEED_MODES = {'M4': 1, 'M10': 0, 'M5': 2, 'M6': 3, 'M89': 3}
+
+def write_csv(filename, header, rows):
+    """
+    Write a CSV file with a header.
+
+    Args:
+    String: path to the file
+    List: names of the columns
+    Iterable: rows
+
+    Returns:
+    Void
+    """
+    with open(filename, 'w', newline='') as csvfile:
+        writer = csv.writer(csvfile)
+        writer.writerow(header)
+        writer.writerows(rows)
+
+def generate_stops(rng, n_stops, spread):
+    """
+    Get random locations of stops around the center of Madrid.
+
+    Args:
+    Numpy Generator: random numbers
+    Integer: number of stops
+    Tuple: standard deviation of the latitude and longitude in degrees
+
+    Returns:
+    Tuple: arrays with the latitude and longitude of the stops, rounded to 5 decimals as in the real data
+    """
+    lat = np.clip(rng.normal(CENTER[0], spread[0], n_stops), 40.05, 40.95)
+    lon = np.clip(rng.normal(CENTER[1], spread[1], n_stops), -4.45, -3.05)
+    return np.round(lat, 5), np.round(lon, 5)
+
+def generate_route_stops(rng, lat, lon, n_routes, min_length=8, max_length=40):
+    """
+    Get the stops of random routes, each one following a straight corridor across the stops.
+
+    Args:
+    Numpy Generator: random numbers
+    Numpy array: latitude of the stops
+    Numpy array: longitude of the stops
+    Integer: number of routes
+    Integer: minimum number of stops of a route
+    Integer: maximum number of stops of a route
+
+    Returns:
+    List: for every route, the array of its stops in order
+    """
+    x = (lon - CENTER[1]) * np.cos(np.deg2rad(CENTER[0]))
+    y = lat - CENTER[0]
+    routes = []
+    for _ in range(n_routes):
+        center = rng.integers(len(lat))
+        angle = rng.uniform(0, np.pi)
+        along = (x - x[center]) * np.cos(angle) + (y - y[center]) * np.sin(angle)
+        across = np.abs((y - y[center]) * np.cos(angle) - (x - x[center]) * np.sin(angle))
+        length = min(int(rng.integers(min_length, max_length + 1)), len(lat))
+        # the stops nearest to the line, in order along it
+        corridor = np.argsort(across + 0.1 * np.abs(along), kind='stable')[:length]
+        routes.append(corridor[np.argsort(along[corridor], kind='stable')])
+    return routes
+
+def generate_feed(feed, raw_path=RAW_PATH, scale=1.0, seed=0):
+    """
+    Write a synthetic GTFS data source with the layout of the CRTM data source of the same name.
+
+    M4 and M10 have stations and accesses (location_type 1 and 2) whose coordinates replace those of the stops,
+    M5 has empty trips.txt and stop_times.txt files and the stops of every itinerary in M5_ParadasPorItinerario.csv,
+    and M6 and M89 have night lines, whose short name starts with N.
+
+    Args:
+    String: name of the data source: M4, M10, M5, M6 or M89
+    String: path to the folder with the raw data sources
+    Float: size of the data source relative to the real one
+    Integer: seed of the random numbers
+
+    Returns:
+    Dictionary: number of stops, routes, trips and stop times written
+    """
+    rng = np.random.default_rng([seed, list(FEED_SIZES).index(feed)])
+    n_stops, n_routes, n_trips = [max(int(round(size * scale)), 2) for size in FEED_SIZES[feed]]
+    n_trips = max(n_trips, 2 * n_routes)
+    code = feed[1:]
+    output_path = raw_path + feed + '/'
+    os.makedirs(output_path, exist_ok=True)
+    lat, lon = generate_stops(rng, n_stops, CITY_SPREAD if feed in ['M4', 'M6', 'M10'] else REGION_SPREAD)
+    route_stops = generate_route_stops(rng, lat, lon, n_routes)
+
+    # routes
+    short_names = []
+    for i in range(n_routes):
+        if feed == 'M5':
+            short_names.append('C{}'.format(i + 1))
+        elif feed in ['M6', 'M89'] and i % 10 == 9:
+            short_names.append('N{}'.format(i + 1))
+        else:
+            short_names.append(str(i + 1))
+    route_ids = ['{}__{}___'.format(code, name) for name in short_names]
+    write_csv(output_path + 'routes.txt', ['route_id', 'agency_id', 'route_short_name', 'route_long_name', 'route_type'],
+              [(route_ids[i], 'CRTM', short_names[i], 'Line {} {}'.format(feed, short_names[i]), FEED_MODES[feed])
+               for i in range(n_routes)])
+
+    # stops, with a station and one or two accesses for every stop of the subway and light subway
+    stop_ids = ['par_{}_{}'.format(code, i) for i in range(n_stops)]
+    header = ['stop_id', 'stop_code', 'stop_name', 'stop_lat', 'stop_lon', 'location_type', 'parent_station']
+    rows = []
+    for i in range(n_stops):
+        parent_station = 'est_{}_{}'.format(code, i) if feed in ['M4', 'M10'] and i % 4 else ''
+        rows.append((stop_ids[i], i, 'STOP {} {}'.format(feed, i), lat[i], lon[i], 0, parent_station))
+    if feed in ['M4', 'M10']:
+        for i in range(n_stops):
+            station = 'est_{}_{}'.format(code, i)
+            rows.append((station, i, 'STATION {} {}'.format(feed, i), lat[i], lon[i], 1, ''))
+            for j in range(1 + i % 2):
+                offset = rng.normal(0, 0.0005, 2).round(5)
+                rows.append(('acc_{}_{}_{}'.format(code, i, j), i, 'ACCESS {} {}'.format(feed, i),
+                             round(lat[i] + offset[0], 5), round(lon[i] + offset[1], 5), 2, station))
+    write_csv(output_path + 'stops.txt', header, rows)
+
+    # trips, every route has one trip in each direction and the rest are repeated; odd trips go backwards
+    trip_routes = np.concatenate([np.repeat(np.arange(n_routes), 2), rng.integers(0, n_routes, n_trips - 2 * n_routes)])
+    trip_ids = ['{}_{}_{}'.format(code, trip_routes[i], i) for i in range(n_trips)]
+    stop_times = []
+    for i, route in enumerate(trip_routes.tolist()):
+        stops = route_stops[route] if i % 2 == 0 else route_stops[route][::-1]
+        stop_times += [(trip_ids[i], '08:00:00', stop_ids[stop], sequence + 1) for sequence, stop in enumerate(stops.tolist())]
+    if feed == 'M5':
+        # as downloaded from CRTM, trips.txt and stop_times.txt of the Railway data source are empty
+        write_csv(output_path + 'trips.txt', ['route_id', 'service_id', 'trip_id'], [])
+        write_csv(output_path + 'stop_times.txt', ['trip_id', 'arrival_time', 'stop_id', 'stop_sequence'], [])
+        write_csv(output_path + 'M5_ParadasPorItinerario.csv', ['CODIGOGESTIONLINEA', 'CODIGOITINERARIO', 'IDFESTACION', 'NUMEROORDEN'],
+                  [(short_names[trip_routes[int(trip.split('_')[-1])]], trip, stop[len('par_'):], sequence)
+                   for trip, _, stop, sequence in stop_times])
+    else:
+        write_csv(output_path + 'trips.txt', ['route_id', 'service_id', 'trip_id', 'direction_id'],
+                  [(route_ids[trip_routes[i]], 'LA', trip_ids[i], i % 2) for i in range(n_trips)])
+        write_csv(output_path + 'stop_times.txt', ['trip_id', 'arrival_time', 'stop_id', 'stop_sequence'], stop_times)
+    return {'stops': n_stops, 'routes': n_routes, 'trips': n_trips, 'stop_times': len(stop_times)}
+
+def generate_network(raw_path=RAW_PATH, scale=1.0, seed=0):
+    """
+    Write the five synthetic GTFS data sources.
+
+    Args:
+    String: path to the folder with the raw data sources
+    Float: size of the data sources relative to the real ones
+    Integer: seed of the random numbers
+
+    Returns:
+    Dictionary: sizes of every data source, as returned by generate_feed
+    """
+    return {feed: generate_feed(feed, raw_path, scale, seed) for feed in FEED_SIZES}
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Write synthetic GTFS data sources with the layout of the CRTM ones.')
+    parser.add_argument('raw', nargs='?', default=RAW_PATH, help='folder of the raw data sources')
+    parser.add_argument('--scale', type=float, default=1.0, help='size relative to the real data sources')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    for feed, sizes in generate_network(args.raw, args.scale, args.seed).items():
+        print(feed, sizes)
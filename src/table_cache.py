@@ -0,0 +1,108 @@
+import json
+import os
+import numpy as np
+import pandas as pd
+
+TABLE_CACHE_VERSION = 1
+
+def file_stamp(filename):
+    """
+    Get what identifies the content of a file without reading it.
+
+    Args:
+    String: path to the file
+
+    Returns:
+    List: name, size and modification time in nanoseconds of the file
+    """
+    stat = os.stat(filename)
+    return [os.path.basename(filename), stat.st_size, stat.st_mtime_ns]
+
+def save_table(table, key, cache_path):
+    """
+    Save a dataframe as one .npy file per column.
+
+    Numeric columns are saved as they are and text columns as fixed-width strings with a mask
+    of the missing values, so the table is loaded without parsing and without pickle.
+
+    Args:
+    Pandas dataframe: table with numeric and text columns
+    JSON-serializable object: what the table was built from
+    String: path to the folder of the cache
+
+    Returns:
+    Boolean: whether the table could be saved
+    """
+    columns = []
+    arrays = {}
+    for i, column in enumerate(table.columns):
+        values = table[column].values
+        if values.dtype == object:
+            missing = pd.isna(values)
+            if not all(isinstance(value, str) for value in values[~missing]):
+                return False
+            arrays['{}.npy'.format(i)] = np.array(np.where(missing, '', values).tolist(), dtype=str)
+            arrays['{}_missing.npy'.format(i)] = missing
+            columns.append({'name': column, 'kind': 'text'})
+        elif values.dtype.kind in 'biuf':
+            arrays['{}.npy'.format(i)] = values
+            columns.append({'name': column, 'kind': 'numeric'})
+        else:
+            return False
+    os.makedirs(cache_path, exist_ok=True)
+    # the metadata is written last, so an interrupted save leaves an invalid cache
+    if os.path.exists(cache_path + 'meta.json'):
+        os.remove(cache_path + 'meta.json')
+    for name, array in arrays.items():
+        np.save(cache_path + name, array, allow_pickle=False)
+    with open(cache_path + 'meta.json', 'w') as f:
+        json.dump({'version': TABLE_CACHE_VERSION, 'key': key, 'rows': len(table), 'columns': columns}, f)
+    return True
+
+def load_table(key, cache_path):
+    """
+    Load a dataframe saved by save_table.
+
+    Args:
+    JSON-serializable object: what the table has to be built from
+    String: path to the folder of the cache
+
+    Returns:
+    Pandas dataframe: the table, or None if it isn't saved or was built from something else
+    """
+    try:
+        with open(cache_path + 'meta.json', 'r') as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return None
+    # compare through JSON, which turns tuples into lists
+    if meta.get('version') != TABLE_CACHE_VERSION or meta.get('key') != json.loads(json.dumps(key)):
+        return None
+    data = {}
+    for i, column in enumerate(meta['columns']):
+        values = np.load(cache_path + '{}.npy'.format(i), allow_pickle=False)
+        if column['kind'] == 'text':
+            values = values.astype(object)
+            values[np.load(cache_path + '{}_missing.npy'.format(i), allow_pickle=False)] = np.nan
+        data[column['name']] = values
+    return pd.DataFrame(data, index=pd.RangeIndex(meta['rows']))
+
+def cached_table(key, cache_path, build):
+    """
+    Get a table from the cache or, if it isn't there, build it and save it.
+
+    Args:
+    JSON-serializable object: what the table is built from, like the stamps of its source files
+    String: path to the folder of the cache, or None not to use the cache
+    Function: builds the table when called without arguments
+
+    Returns:
+    Pandas dataframe: the table
+    """
+    if cache_path is None:
+        return build()
+    table = load_table(key, cache_path)
+    if table is None:
+        table = build().reset_index(drop=True)
+        save_table(table, key, cache_path)
+    return table
@@ -0,0 +1,407 @@
+import argparse
+import hashlib
+import json
+import os
+import time
+import numpy as np
+import pandas as pd
+from rdflib import Graph, URIRef, Literal
+from rdflib.collection import Collection
+from rdflib.namespace import Namespace, RDF, RDFS, XSD
+from data_reading import term_text
+
+EX = Namespace('http://example.com/gtfs#')
+SH = Namespace('http://www.w3.org/ns/shacl#')
+
+SHAPES_PATH = 'test/gtfs_shapes.txt'
+PROCESSED_PATH = 'data/processed/'
+FEEDS_PATH = 'data/processed/feeds/'
+# bump to validate every feed again when the checks change
+VALIDATION_VERSION = 1
+
+# how the instances of each class are stored in the processed data: file, column with the identifier,
+# and for every property, the column with its values and their kind ('iri' or the datatype of the literals)
+CLASS_TABLES = {
+    EX.Stop: ('stops.csv', 'stop_id', {
+        RDFS.label: ('stop_name', XSD.string),
+        EX.has_route: ('route_id', 'iri'),
+        EX.has_latitude: ('stop_lat', XSD.decimal),
+        EX.has_longitude: ('stop_lon', XSD.decimal),
+    }),
+    EX.Route: ('routes.csv', 'route_id', {
+        RDFS.label: ('route_short_name', XSD.string),
+        RDFS.comment: ('route_long_name', XSD.string),
+        EX.has_mode: ('route_type', 'iri'),
+    }),
+    EX.Transfer: ('transfers.csv', 'transfer_id', {
+        EX.has_transfer_from: ('transfer_from', 'iri'),
+        EX.has_transfer_to: ('transfer_to', 'iri'),
+    }),
+}
+
+# constraints of the property shapes that can be checked on the tables
+PROPERTY_CONSTRAINTS = [SH.path, SH.minCount, SH.maxCount, SH.datatype,
+                        SH.minInclusive, SH.maxInclusive, SH.minExclusive, SH.maxExclusive, SH.name, SH.description]
+NODE_CONSTRAINTS = [RDF.type, SH.targetClass, SH.property, SH.closed, SH.ignoredProperties, RDFS.label, RDFS.comment]
+RANGE_CONSTRAINTS = {
+    SH.minInclusive: ('MinInclusiveConstraintComponent', '>=', lambda values, bound: values >= bound),
+    SH.maxInclusive: ('MaxInclusiveConstraintComponent', '<=', lambda values, bound: values <= bound),
+    SH.minExclusive: ('MinExclusiveConstraintComponent', '>', lambda values, bound: values > bound),
+    SH.maxExclusive: ('MaxExclusiveConstraintComponent', '<', lambda values, bound: values < bound),
+}
+# lexical forms of xsd:decimal that rdflib keeps as they are
+DECIMAL_PATTERN = r'-?(0|[1-9]\d*)(\.\d+)?'
+
+def compile_shapes(shapes_filename):
+    """
+    Get the node shapes of a SHACL file as plain dictionaries, checking that they can be validated on the tables.
+
+    Args:
+    String: path to the SHACL shapes, in Turtle
+
+    Returns:
+    Tuple: list of node shapes, with keys name, target_classes, properties, closed and ignored,
+    and the namespace manager of the shapes to write the results
+    """
+    shapes = Graph()
+    shapes.parse(shapes_filename, format='turtle')
+    node_shapes = []
+    for node in sorted(set(shapes.subjects(RDF.type, SH.NodeShape))):
+        for predicate in set(shapes.predicates(node)):
+            if predicate not in NODE_CONSTRAINTS:
+                raise ValueError('unsupported constraint {} of {}'.format(predicate, node))
+        properties = []
+        for property_node in shapes.objects(node, SH.property):
+            constraints = dict(shapes.predicate_objects(property_node))
+            for predicate in constraints:
+                if predicate not in PROPERTY_CONSTRAINTS:
+                    raise ValueError('unsupported constraint {} of {}'.format(predicate, node))
+            if not isinstance(constraints.get(SH.path), URIRef):
+                raise ValueError('only predicate paths are supported in {}'.format(node))
+            properties.append(constraints)
+        ignored = shapes.value(node, SH.ignoredProperties)
+        node_shapes.append({
+            'name': node,
+            'target_classes': list(shapes.objects(node, SH.targetClass)),
+            'properties': properties,
+            'closed': bool(shapes.value(node, SH.closed, default=Literal(False)).toPython()),
+            'ignored': list(Collection(shapes, ignored)) if ignored is not None else [],
+        })
+    return node_shapes, shapes.namespace_manager
+
+def read_table(filename):
+    """
+    Read a table of the processed data keeping the values as they are written, as in the RDF graph.
+
+    Args:
+    String: path to the file
+
+    Returns:
+    Pandas dataframe with a text column for every column of the file.
+    """
+    return pd.read_csv(filename, dtype=str, keep_default_na=False)
+
+def get_terms(values, kind):
+    """
+    Get the RDF terms of the values of a column.
+
+    Args:
+    Iterable: values of the column
+    String or URIRef: 'iri' or the datatype of the literals
+
+    Returns:
+    List: the terms
+    """
+    if kind == 'iri':
+        return [URIRef(EX[value]) for value in values]
+    # plain literals are written without datatype
+    return [Literal(value, datatype=None if kind == XSD.string else kind) for value in values]
+
+def matches_decimal(values):
+    """
+    Check which values are xsd:decimal lexical forms that rdflib keeps as they are.
+
+    Args:
+    Pandas series: values of a column
+
+    Returns:
+    Pandas series: boolean mask over the values
+    """
+    return values.str.fullmatch(DECIMAL_PATTERN).astype(bool)
+
+def normalize_lexical(values, datatype):
+    """
+    Get the lexical forms of the literals of a column as they are in the RDF graph.
+
+    rdflib normalizes the lexical form of the well-typed literals, like '+40.1' to '40.1',
+    so two values of the column may be the same term of the graph.
+
+    Args:
+    Pandas series: values of the column
+    URIRef: datatype of the literals
+
+    Returns:
+    Pandas series: lexical forms
+    """
+    if datatype == XSD.string:
+        return values
+    kept = matches_decimal(values) if datatype == XSD.decimal else pd.Series(False, index=values.index)
+    if kept.all():
+        return values
+    # the values that aren't in the usual form are normalized by rdflib itself
+    normalized = {value: str(Literal(value, datatype=datatype)) for value in values[~kept].unique()}
+    values = values.copy()
+    values[~kept] = values[~kept].map(normalized)
+    return values
+
+def is_well_typed(values, datatype):
+    """
+    Check which lexical forms are valid for a datatype, as rdflib does.
+
+    Args:
+    Pandas series: lexical forms, as returned by normalize_lexical
+    URIRef: datatype of the literals
+
+    Returns:
+    Pandas series: boolean mask over the values
+    """
+    if datatype == XSD.string:
+        return pd.Series(True, index=values.index)
+    valid = matches_decimal(values).to_numpy() if datatype == XSD.decimal else np.zeros(len(values), dtype=bool)
+    ill_typed = {value: bool(Literal(value, datatype=datatype).ill_typed) for value in values[~valid].unique()}
+    valid[~valid] = [not ill_typed[value] for value in values[~valid]]
+    return pd.Series(valid, index=values.index)
+
+def make_result(component, focus_node, path, value, message):
+    """
+    Get a validation result with the same fields as a result of a SHACL validation report.
+
+    Args:
+    String: local name of the constraint component in the SHACL namespace
+    URIRef: focus node
+    URIRef: result path
+    URIRef or Literal: value node, None for the constraints on the number of values
+    String: message of the result
+
+    Returns:
+    Dictionary: constraint component, focus node, result path and value in N-Triples, and message
+    """
+    return {
+        'constraint_component': term_text(SH[component]),
+        'focus_node': term_text(focus_node),
+        'result_path': term_text(path),
+        'value': term_text(value) if value is not None else None,
+        'message': message,
+    }
+
+def validate_table(node_shape, target_class, table, namespace_manager):
+    """
+    Check the instances of a class stored in a table against a node shape.
+
+    Every constraint is checked on whole columns: the number of values of each instance
+    is counted by grouping the rows, and the datatypes and ranges are checked on the distinct values.
+
+    Args:
+    Dictionary: node shape, as returned by compile_shapes
+    URIRef: class of the instances
+    Pandas dataframe: table of the instances, as returned by read_table
+    NamespaceManager: prefixes used in the messages
+
+    Returns:
+    List: validation results, as returned by make_result
+    """
+    _, id_column, properties = CLASS_TABLES[target_class]
+    results = []
+    instances = table[id_column].unique()
+
+    def name(term):
+        return term.n3(namespace_manager)
+
+    for constraints in node_shape['properties']:
+        path = constraints[SH.path]
+        if path in properties:
+            column, kind = properties[path]
+            values = table[[id_column, column]].copy()
+            values[column] = normalize_lexical(values[column], kind) if kind != 'iri' else values[column]
+            values = values.drop_duplicates()
+        else:
+            kind = None
+            values = pd.DataFrame({id_column: [], 'value': []}, dtype=str)
+            column = 'value'
+        # number of values of every instance
+        counts = values.groupby(id_column)[column].size().reindex(instances, fill_value=0)
+        for constraint, component, word, test in [(SH.minCount, 'MinCountConstraintComponent', 'Less', lambda c, n: c < n),
+                                                  (SH.maxCount, 'MaxCountConstraintComponent', 'More', lambda c, n: c > n)]:
+            if constraint in constraints:
+                bound = constraints[constraint].toPython()
+                for instance in counts.index[test(counts.values, bound)]:
+                    focus_node = URIRef(EX[instance])
+                    results.append(make_result(component, focus_node, path, None, '{} than {} values on {}->{}'.format(
+                        word, bound, focus_node.n3(), name(path))))
+        if kind is None or len(values) == 0:
+            continue
+        distinct = pd.Series(values[column].unique())
+        failed = {}
+        if SH.datatype in constraints:
+            datatype = constraints[SH.datatype]
+            valid = is_well_typed(distinct, kind) if kind == datatype else pd.Series(False, index=distinct.index)
+            failed[SH.datatype] = (distinct[~valid], 'DatatypeConstraintComponent',
+                                   'Value is not Literal with datatype {}'.format(name(datatype)))
+        for constraint, (component, operator, test) in RANGE_CONSTRAINTS.items():
+            if constraint in constraints:
+                bound = constraints[constraint]
+                comparable = kind not in ('iri', XSD.string)
+                numbers = pd.to_numeric(distinct.where(is_well_typed(distinct, kind)), errors='coerce') if comparable else \
+                    pd.Series(float('nan'), index=distinct.index)
+                valid = test(numbers, float(bound.toPython())) & numbers.notna()
+                failed[constraint] = (distinct[~valid], component, 'Value is not {} {}'.format(operator, bound.n3(namespace_manager)))
+        for failed_values, component, message in failed.values():
+            rows = values[values[column].isin(failed_values)]
+            for instance, value in zip(rows[id_column], get_terms(rows[column], kind)):
+                results.append(make_result(component, URIRef(EX[instance]), path, value, message))
+    if node_shape['closed']:
+        allowed = set(constraints[SH.path] for constraints in node_shape['properties']) | set(node_shape['ignored'])
+        for path, (column, kind) in properties.items():
+            if path in allowed:
+                continue
+            values = table[[id_column, column]].copy()
+            values[column] = normalize_lexical(values[column], kind) if kind != 'iri' else values[column]
+            values = values.drop_duplicates()
+            for instance, value in zip(values[id_column], get_terms(values[column], kind)):
+                focus_node = URIRef(EX[instance])
+                results.append(make_result('ClosedConstraintComponent', focus_node, path, value,
+                                           'Node {} is closed. It cannot have value: {}'.format(focus_node.n3(), value.n3())))
+    return results
+
+def validate_tables(node_shapes, tables, namespace_manager):
+    """
+    Check the processed data against the SHACL shapes without building the RDF graph.
+
+    Args:
+    List: node shapes, as returned by compile_shapes
+    Dictionary: tables of the processed data by file name, as returned by read_table
+    NamespaceManager: prefixes used in the messages
+
+    Returns:
+    List: validation results, as returned by make_result
+    """
+    results = []
+    for node_shape in node_shapes:
+        for target_class in node_shape['target_classes']:
+            if target_class in CLASS_TABLES and CLASS_TABLES[target_class][0] in tables:
+                results += validate_table(node_shape, target_class, tables[CLASS_TABLES[target_class][0]], namespace_manager)
+    return results
+
+def shapes_fingerprint(shapes_filename):
+    """
+    Get a fingerprint of the SHACL shapes and the version of the checks.
+
+    Args:
+    String: path to the SHACL shapes
+
+    Returns:
+    String: SHA-256 digest
+    """
+    with open(shapes_filename, 'rb') as f:
+        return hashlib.sha256(f.read() + str(VALIDATION_VERSION).encode()).hexdigest()
+
+def validate_processed_data(shapes_filename=SHAPES_PATH, processed_path=PROCESSED_PATH, feeds_path=FEEDS_PATH):
+    """
+    Check the processed data against the SHACL shapes, validating each GTFS data source on its own.
+
+    The stops and routes of each data source are validated from its per-feed outputs, and the results
+    are saved next to them, so only the data sources processed again since the last validation are validated.
+    The stop_id and route_id of different data sources don't overlap. The transfers, which join the
+    data sources, are validated from the processed data. If there aren't per-feed outputs,
+    the processed data is validated as a whole.
+
+    Args:
+    String: path to the SHACL shapes
+    String: path to the folder with the processed data
+    String: path to the folder with the per-feed outputs
+
+    Returns:
+    List: validation results, as returned by make_result
+    """
+    node_shapes, namespace_manager = compile_shapes(shapes_filename)
+    shapes_key = shapes_fingerprint(shapes_filename)
+    feeds = sorted(name for name in os.listdir(feeds_path) if os.path.exists(feeds_path + name + '/meta.json')) \
+        if os.path.isdir(feeds_path) else []
+    feed_files = ['stops.csv', 'routes.csv'] if feeds else []
+    results = []
+    for feed in feeds:
+        with open(feeds_path + feed + '/meta.json', 'r') as f:
+            key = {'feed': json.load(f)['fingerprint'], 'shapes': shapes_key}
+        filename = feeds_path + feed + '/validation.json'
+        try:
+            with open(filename, 'r') as f:
+                saved = json.load(f)
+            if saved['key'] == key:
+                results += saved['results']
+                continue
+        except (OSError, ValueError, KeyError):
+            pass
+        tables = {name: read_table(feeds_path + feed + '/' + name) for name in feed_files}
+        feed_results = validate_tables(node_shapes, tables, namespace_manager)
+        with open(filename, 'w') as f:
+            json.dump({'key': key, 'results': feed_results}, f)
+        results += feed_results
+    tables = {name: read_table(processed_path + name) for name, _, _ in CLASS_TABLES.values() if name not in feed_files}
+    return results + validate_tables(node_shapes, tables, namespace_manager)
+
+def validate_graph(g, shapes_filename=SHAPES_PATH):
+    """
+    Check the RDF graph against the SHACL shapes with pyshacl, the reference for validate_processed_data.
+
+    Args:
+    RDF Graph: graph that represents the transport network
+    String: path to the SHACL shapes
+
+    Returns:
+    List: validation results, as returned by make_result
+    """
+    import pyshacl
+    _, report, _ = pyshacl.validate(g, shacl_graph=shapes_filename, shacl_graph_format='turtle')
+    results = []
+    for result in report.subjects(RDF.type, SH.ValidationResult):
+        value = report.value(result, SH.value)
+        component = report.value(result, SH.sourceConstraintComponent)
+        results.append(make_result(component[len(SH):], report.value(result, SH.focusNode), report.value(result, SH.resultPath),
+                                   value, str(report.value(result, SH.resultMessage))))
+    return results
+
+def result_keys(results):
+    """
+    Get what identifies each validation result, leaving out its message.
+
+    Args:
+    List: validation results, as returned by make_result
+
+    Returns:
+    List: sorted tuples with the constraint component, focus node, result path and value of the results
+    """
+    return sorted((result['constraint_component'], result['focus_node'], result['result_path'], result['value'] or '')
+                  for result in results)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Check the processed data against the SHACL shapes.')
+    parser.add_argument('--shapes', default=SHAPES_PATH)
+    parser.add_argument('--processed', default=PROCESSED_PATH)
+    parser.add_argument('--ontology', default='data/ontology/gtfs.ttl')
+    parser.add_argument('--reference', action='store_true',
+                        help='also validate the RDF graph with pyshacl and check that the results are the same')
+    args = parser.parse_args()
+
+    start_time = time.perf_counter()
+    results = validate_processed_data(args.shapes, args.processed, args.processed + 'feeds/')
+    print('Conforms: {} ({} results in {:.2f} s)'.format(not results, len(results), time.perf_counter() - start_time))
+    for result in results[:20]:
+        print(result['message'])
+    if args.reference:
+        from data_reading import build_graph
+        start_time = time.perf_counter()
+        reference = validate_graph(build_graph(args.ontology, args.processed), args.shapes)
+        print('pyshacl: {} results in {:.2f} s'.format(len(reference), time.perf_counter() - start_time))
+        if result_keys(results) != result_keys(reference):
+            raise SystemExit('the results differ from those of pyshacl')
+        print('Same results as pyshacl')
@@ -0,0 +1,115 @@
+import contextlib
+import io
+import os
+import sys
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# the modules of src/ import each other as top-level modules
+sys.path.insert(0, os.path.join(ROOT, 'src'))
+
+import numpy as np
+import pandas as pd
+from data_processing import calculate_distance
+from data_reading import build_graph
+from network_index import build_network_index, build_station_index, read_stations
+from find_stops import load_stop_index, find_nearest_stops
+
+PROCESSED_PATH = os.path.join(ROOT, 'data', 'processed') + '/'
+ONTOLOGY_PATH = os.path.join(ROOT, 'data', 'ontology', 'gtfs.ttl')
+# center of Madrid and radius in kilometers of the sample of the processed data
+SAMPLE_CENTER = (40.4168, -3.7038)
+SAMPLE_RADIUS = 2.5
+
+@pytest.fixture(scope='session')
+def sample_path(tmp_path_factory):
+    """
+    Processed data of the stops near the center of Madrid, with their routes and the transfers between them.
+    """
+    path = str(tmp_path_factory.mktemp('processed')) + '/'
+    stops = pd.read_csv(PROCESSED_PATH + 'stops.csv', dtype=str)
+    distances = calculate_distance(SAMPLE_CENTER[0], SAMPLE_CENTER[1], stops['stop_lat'].astype(float).values,
+                                   stops['stop_lon'].astype(float).values)
+    stop_ids = set(stops['stop_id'][distances < SAMPLE_RADIUS])
+    stops = stops[stops['stop_id'].isin(stop_ids)]
+    routes = pd.read_csv(PROCESSED_PATH + 'routes.csv', dtype=str)
+    routes = routes[routes['route_id'].isin(stops['route_id'])]
+    transfers = pd.read_csv(PROCESSED_PATH + 'transfers.csv', dtype=str)
+    transfers = transfers[transfers['transfer_from'].isin(stop_ids) & transfers['transfer_to'].isin(stop_ids)]
+    route_transfers = pd.read_csv(PROCESSED_PATH + 'route_transfers.csv', dtype=str)
+    route_transfers = route_transfers[route_transfers['transfer_from'].isin(stop_ids) &
+                                      route_transfers['transfer_to'].isin(stop_ids)]
+    stop_stations = pd.read_csv(PROCESSED_PATH + 'stop_stations.csv', dtype=str)
+    stop_stations = stop_stations[stop_stations['stop_id'].isin(stop_ids)]
+    stations = pd.read_csv(PROCESSED_PATH + 'stations.csv', dtype=str)
+    stations = stations[stations['station_id'].isin(stop_stations['station_id'])]
+    station_transfers = pd.read_csv(PROCESSED_PATH + 'station_transfers.csv', dtype=str)
+    station_transfers = station_transfers[station_transfers['station_from'].isin(stations['station_id']) &
+                                          station_transfers['station_to'].isin(stations['station_id'])]
+    for name, table in [('stops.csv', stops), ('routes.csv', routes), ('transfers.csv', transfers),
+                        ('route_transfers.csv', route_transfers), ('stations.csv', stations),
+                        ('stop_stations.csv', stop_stations), ('station_transfers.csv', station_transfers)]:
+        table.to_csv(path + name, index=False)
+    return path
+
+@pytest.fixture(scope='session')
+def sample_graph(sample_path):
+    return build_graph(ONTOLOGY_PATH, sample_path)
+
+@pytest.fixture(scope='session')
+def sample_network(sample_graph, sample_path):
+    return build_network_index(sample_graph, sample_path + 'route_transfers.csv')
+
+def make_queries(stops_filename, n_queries, radius=0.4, seed=0):
+    """
+    Stops near the origin and destination of random queries between stops.
+    """
+    stop_index = load_stop_index(stops_filename)
+    rng = np.random.default_rng(seed)
+    queries = []
+    for _ in range(n_queries):
+        origin, destination = rng.integers(0, len(stop_index.stop_lat), 2)
+        queries.append((find_nearest_stops(stop_index.stop_lat[origin], stop_index.stop_lon[origin], radius, stop_index),
+                        find_nearest_stops(stop_index.stop_lat[destination], stop_index.stop_lon[destination], radius, stop_index)))
+    return queries
+
+def add_stations(network, processed_path):
+    build_station_index(network, *read_stations(processed_path + 'stations.csv', processed_path + 'stop_stations.csv',
+                                                processed_path + 'station_transfers.csv', network.stop_index))
+    return network
+
+@pytest.fixture(scope='session')
+def sample_station_network(sample_graph, sample_path):
+    return add_stations(build_network_index(sample_graph, sample_path + 'route_transfers.csv'), sample_path)
+
+@pytest.fixture(scope='session')
+def sample_queries(sample_path):
+    return make_queries(sample_path + 'stops.csv', 25)
+
+@pytest.fixture(scope='session')
+def synthetic_path(tmp_path_factory):
+    """
+    Processed data of a small synthetic network, with the stops of every direction of the routes.
+    """
+    from synthetic_gtfs import generate_network
+    from data_processing import FEEDS, update_processed_data
+    path = str(tmp_path_factory.mktemp('synthetic'))
+    raw_path, processed_path = path + '/raw/', path + '/processed/'
+    os.makedirs(processed_path)
+    with contextlib.redirect_stdout(io.StringIO()):
+        generate_network(raw_path, 0.3)
+        update_processed_data(FEEDS, 1, raw_path, processed_path, processed_path + 'feeds/', None, cache_path=None)
+    return processed_path
+
+@pytest.fixture(scope='session')
+def synthetic_graph(synthetic_path):
+    return build_graph(ONTOLOGY_PATH, synthetic_path)
+
+@pytest.fixture(scope='session')
+def synthetic_network(synthetic_graph, synthetic_path):
+    network = build_network_index(synthetic_graph, synthetic_path + 'route_transfers.csv', synthetic_path + 'route_stops.csv')
+    return add_stations(network, synthetic_path)
+
+@pytest.fixture(scope='session')
+def synthetic_queries(synthetic_path):
+    return make_queries(synthetic_path + 'stops.csv', 40, 0.5)
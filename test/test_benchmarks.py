@@ -0,0 +1,42 @@
+import os
+import pytest
+from benchmarks import compare_reports
+from synthetic_gtfs import generate_network
+
+def read_files(path):
+    files = {}
+    for folder, _, filenames in os.walk(path):
+        for filename in filenames:
+            with open(os.path.join(folder, filename), 'rb') as f:
+                files[os.path.relpath(os.path.join(folder, filename), path)] = f.read()
+    return files
+
+def test_generate_network_is_deterministic(tmp_path):
+    sizes = generate_network(str(tmp_path / 'first') + '/', 0.05, 1)
+    assert generate_network(str(tmp_path / 'second') + '/', 0.05, 1) == sizes
+    generate_network(str(tmp_path / 'other') + '/', 0.05, 2)
+    first = read_files(tmp_path / 'first')
+    assert first and read_files(tmp_path / 'second') == first
+    # another seed places other stops
+    other = read_files(tmp_path / 'other')
+    assert other.keys() == first.keys() and other != first
+
+def make_report(times):
+    return {'scales': {scale: {'results': {name: {'min': time, 'median': time, 'runs': 3} for name, time in results.items()}}
+                       for scale, results in times.items()}}
+
+def test_compare_reports():
+    baseline = make_report({'0.1': {'build_graph': 2.0, 'find_routes': 1.0, 'find_stops': 0.0}})
+    report = make_report({'0.1': {'build_graph': 2.4, 'find_routes': 1.3, 'find_stops': 0.001, 'new_benchmark': 1.0},
+                          '0.3': {'build_graph': 5.0}})
+    comparison = compare_reports(report, baseline, tolerance=0.25)
+    # benchmarks and scales missing from the baseline aren't compared
+    assert [(row['scale'], row['name']) for row in comparison] == [('0.1', 'build_graph'), ('0.1', 'find_routes'),
+                                                                    ('0.1', 'find_stops')]
+    build_graph, find_routes, find_stops = comparison
+    assert build_graph['ratio'] == pytest.approx(1.2) and not build_graph['regression']
+    assert find_routes['ratio'] == pytest.approx(1.3) and find_routes['regression']
+    assert find_routes['baseline'] == 1.0 and find_routes['current'] == 1.3
+    assert find_stops['ratio'] == float('inf') and find_stops['regression']
+    # a larger tolerance accepts the same slowdown
+    assert not any(row['regression'] for row in compare_reports(report, make_report({'0.1': {'find_routes': 1.0}}), 0.5))
@@ -0,0 +1,19 @@
+import pandas as pd
+import pytest
+from conftest import PROCESSED_PATH
+from data_processing import find_transfers
+
+@pytest.fixture(scope='module')
+def stops():
+    return pd.read_csv(PROCESSED_PATH + 'stops.csv', dtype={'stop_id': str, 'stop_name': str, 'route_id': str})
+
+def test_find_transfers_matches_processed_transfers(stops):
+    # transfers.csv was written by the brute force comparison of every pair of stops
+    transfers = pd.read_csv(PROCESSED_PATH + 'transfers.csv', dtype=str)
+    assert find_transfers(stops).reset_index(drop=True).equals(transfers)
+
+def test_find_transfers_block_size(stops):
+    # blocks that split stops with the same latitude find the same transfers
+    sample = stops.iloc[:3000]
+    expected = find_transfers(sample, block_size=len(sample)).reset_index(drop=True)
+    assert find_transfers(sample, block_size=7).reset_index(drop=True).equals(expected)
@@ -0,0 +1,15 @@
+from find_routes import find_routes, iter_best_routes, select_best_routes, find_path_distances, describe_path
+
+def describe_paths(network, paths):
+    distances = find_path_distances(network, paths)
+    return [describe_path(network, path, distance) for path, distance in zip(paths, distances.tolist())]
+
+def test_iter_best_routes(sample_network, sample_queries):
+    # the pruned search generates the paths that would be selected from all of them, in the same order
+    found = 0
+    for origin_stops, destination_stops in sample_queries:
+        expected = select_best_routes(sample_network, find_routes(sample_network, origin_stops, destination_stops))
+        paths = list(iter_best_routes(sample_network, origin_stops, destination_stops))
+        assert describe_paths(sample_network, paths) == expected
+        found += len(expected)
+    assert found > 0
@@ -0,0 +1,49 @@
+import numpy as np
+import pandas as pd
+import pytest
+from conftest import PROCESSED_PATH
+from data_processing import calculate_distance
+from find_stops import load_stop_index
+
+@pytest.fixture(scope='module')
+def stop_index():
+    return load_stop_index(PROCESSED_PATH + 'stops.csv')
+
+@pytest.fixture(scope='module')
+def points(stop_index):
+    """
+    Random locations over the grid of the stops, some of them at a stop.
+    """
+    rng = np.random.default_rng(0)
+    lat = rng.uniform(stop_index.stop_lat.min() - 0.01, stop_index.stop_lat.max() + 0.01, 200)
+    lon = rng.uniform(stop_index.stop_lon.min() - 0.01, stop_index.stop_lon.max() + 0.01, 200)
+    at_stop = rng.integers(0, len(stop_index.stop_lat), 50)
+    return (np.concatenate([lat, stop_index.stop_lat[at_stop]]),
+            np.concatenate([lon, stop_index.stop_lon[at_stop]]))
+
+def brute_force(stop_index, lat, lon, radius):
+    """
+    stop_id of the stops less than radius kilometers from a location, comparing every stop, sorted by distance.
+    """
+    distances = calculate_distance(lat, lon, stop_index.stop_lat, stop_index.stop_lon)
+    order = np.argsort(distances, kind='stable')
+    order = order[distances[order] < radius]
+    return order, distances[order]
+
+@pytest.mark.parametrize('radius', [0.1, 0.5, 2.0])
+def test_within(stop_index, points, radius):
+    for lat, lon in zip(*points):
+        positions, distances = stop_index.within(lat, lon, radius)
+        expected_positions, expected_distances = brute_force(stop_index, lat, lon, radius)
+        assert positions.tolist() == expected_positions.tolist()
+        assert np.allclose(distances, expected_distances)
+
+@pytest.mark.parametrize('radius', [0.1, 0.5, 2.0])
+def test_nearest_many(stop_index, points, radius):
+    lat, lon = points
+    result = stop_index.nearest_many(lat, lon, radius)
+    assert len(result) == len(lat)
+    for stops, point_lat, point_lon in zip(result, lat, lon):
+        assert stops == stop_index.nearest(point_lat, point_lon, radius)
+        positions, _ = brute_force(stop_index, point_lat, point_lon, radius)
+        assert stops == pd.unique(stop_index.stop_ids[positions]).tolist()
@@ -0,0 +1,35 @@
+from rdflib import Literal, URIRef
+from rdflib.namespace import RDF, RDFS
+from graph_snapshot import save_snapshot, load_snapshot
+
+EX = 'http://example.com/gtfs#'
+
+def test_snapshot_has_the_triples_of_the_graph(sample_graph, tmp_path):
+    snapshot_path = str(tmp_path) + '/'
+    save_snapshot(sample_graph, 'sample', snapshot_path)
+    snapshot = load_snapshot('sample', snapshot_path)
+    assert len(snapshot) == len(sample_graph)
+    assert set(snapshot) == set(sample_graph)
+
+def test_snapshot_answers_triple_patterns(sample_graph, tmp_path):
+    snapshot_path = str(tmp_path) + '/'
+    save_snapshot(sample_graph, 'sample', snapshot_path)
+    snapshot = load_snapshot('sample', snapshot_path)
+    stop = next(sample_graph.subjects(RDF.type, URIRef(EX + 'Stop')))
+    route = sample_graph.value(stop, URIRef(EX + 'has_route'))
+    label = sample_graph.value(stop, RDFS.label)
+    assert route is not None and label is not None
+    patterns = [(stop, None, None), (None, URIRef(EX + 'has_route'), route), (None, None, route),
+                (stop, RDFS.label, None), (None, RDFS.label, label), (None, RDF.type, URIRef(EX + 'Stop')),
+                (URIRef(EX + 'unknown'), None, None), (None, None, Literal('unknown'))]
+    for pattern in patterns:
+        assert set(snapshot.triples(pattern)) == set(sample_graph.triples(pattern)), pattern
+    assert len(set(snapshot.triples((None, None, route)))) > 1
+    assert set(snapshot.namespaces()) >= {(prefix, namespace) for prefix, namespace in sample_graph.namespaces()
+                                          if prefix == 'ex'}
+
+def test_snapshot_of_other_data_is_not_loaded(sample_graph, tmp_path):
+    snapshot_path = str(tmp_path) + '/'
+    save_snapshot(sample_graph, 'sample', snapshot_path)
+    assert load_snapshot('other', snapshot_path) is None
+    assert load_snapshot('sample', str(tmp_path / 'missing') + '/') is None
@@ -0,0 +1,46 @@
+import numpy as np
+from graph_snapshot import save_snapshot, load_snapshot
+from instrumentation import Metrics
+from network_index import INDEX_ARRAYS, load_network_index, read_network_index
+from routing import find_journeys
+
+def assert_same_index(loaded, built):
+    assert loaded.stops == built.stops and loaded.routes == built.routes
+    assert loaded.stop_index == built.stop_index and loaded.route_index == built.route_index
+    assert loaded.labels == built.labels and loaded.modes == built.modes
+    for name in INDEX_ARRAYS:
+        expected = getattr(built, name, None)
+        if expected is None:
+            assert getattr(loaded, name) is None, name
+        else:
+            assert np.array_equal(getattr(loaded, name), expected), name
+            assert getattr(loaded, name).dtype == expected.dtype, name
+
+def test_saved_index_is_the_built_index(sample_graph, sample_path, tmp_path):
+    snapshot_path = str(tmp_path) + '/'
+    save_snapshot(sample_graph, 'sample', snapshot_path)
+    built = load_network_index(load_snapshot('sample', snapshot_path), snapshot_path, sample_path)
+    assert built.stations is not None
+    loaded = load_network_index(load_snapshot('sample', snapshot_path), snapshot_path, sample_path)
+    assert_same_index(loaded, built)
+    assert_same_index(loaded.stations, built.stations)
+    assert loaded.stations.stations is None
+    # the adjacencies are mapped from the saved files, not copied
+    assert isinstance(loaded.stop_routes.base, np.memmap)
+
+def test_saved_index_of_other_data(sample_graph, sample_path, tmp_path):
+    snapshot_path = str(tmp_path) + '/'
+    save_snapshot(sample_graph, 'sample', snapshot_path)
+    network = load_network_index(load_snapshot('sample', snapshot_path), snapshot_path, sample_path)
+    assert read_network_index(['other'], snapshot_path + 'network/') is None
+    assert read_network_index(['other'], snapshot_path + 'missing/') is None
+    # a snapshot of other data builds the index again
+    save_snapshot(sample_graph, 'other', snapshot_path)
+    rebuilt = load_network_index(load_snapshot('other', snapshot_path), snapshot_path, sample_path)
+    assert rebuilt is not network and rebuilt.stops == network.stops
+
+def test_index_lookups_are_counted(sample_network, sample_queries):
+    origin_stops, destination_stops = next(query for query in sample_queries if all(query))
+    with Metrics() as metrics:
+        find_journeys(sample_network, origin_stops, destination_stops, 1)
+    assert metrics.counters['index_entries_visited'] > 0
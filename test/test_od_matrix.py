@@ -0,0 +1,25 @@
+import io
+import os
+import pandas as pd
+from conftest import ONTOLOGY_PATH
+from find_stops import load_stop_index
+from od_matrix import grid_pairs, compute_od_matrix
+
+def solve_grid(sample_path, snapshot_path, workers):
+    output = io.StringIO()
+    lat, lon, n_pairs, get_pairs = grid_pairs(load_stop_index(sample_path + 'stops.csv'), 1.5)
+    found = compute_od_matrix(lat, lon, n_pairs, get_pairs, output, workers=workers, shard_size=20,
+                              ontology_path=ONTOLOGY_PATH, processed_path=sample_path, snapshot_path=snapshot_path)
+    output.seek(0)
+    return found, pd.read_csv(output, dtype=str)
+
+def test_workers_share_the_snapshot(sample_path, tmp_path):
+    # the snapshot is missing, the parent builds it and its index before the workers open them
+    snapshot_path = str(tmp_path) + '/'
+    found, matrix = solve_grid(sample_path, snapshot_path, 3)
+    assert os.path.exists(snapshot_path + 'network/meta.json')
+    assert found > 0 and len(matrix) > 20
+    # one process finds the same paths
+    single_found, single_matrix = solve_grid(sample_path, snapshot_path, 1)
+    assert single_found == found
+    pd.testing.assert_frame_equal(single_matrix, matrix)
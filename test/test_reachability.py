@@ -0,0 +1,42 @@
+import numpy as np
+import pandas as pd
+import pytest
+from reachability import build_reachability_index
+
+@pytest.fixture(scope='module')
+def sample_tables(sample_path):
+    stops = pd.read_csv(sample_path + 'stops.csv', dtype={'stop_id': str, 'stop_name': str, 'route_id': str})
+    transfers = pd.read_csv(sample_path + 'transfers.csv', dtype=str)
+    return stops, transfers
+
+def breadth_first_search(stops, transfers, origin_stops, max_transfers):
+    """
+    Fewest transfers to reach every stop from some stops, with sets of stop_id and route_id.
+    """
+    route_stops = stops.groupby('route_id')['stop_id'].agg(set).to_dict()
+    stop_routes = stops.groupby('stop_id')['route_id'].agg(set).to_dict()
+    walks = transfers.groupby('transfer_from')['transfer_to'].agg(set).to_dict()
+    origins = [stop for stop in origin_stops if stop in stop_routes]
+    reached = {stop: 0 for stop in origins}
+    routes = set().union(*[stop_routes[stop] for stop in origins])
+    reached_routes = set(routes)
+    for n in range(max_transfers + 1):
+        stops_of_routes = set().union(*[route_stops[route] for route in routes])
+        for stop in stops_of_routes - reached.keys():
+            reached[stop] = n
+        # walk a transfer, or stay at the same stop, and take another route
+        next_stops = stops_of_routes | set().union(*[walks.get(stop, set()) for stop in stops_of_routes])
+        routes = set().union(*[stop_routes[stop] for stop in next_stops]) - reached_routes
+        reached_routes |= routes
+    return reached
+
+@pytest.mark.parametrize('max_transfers', [0, 1, 2])
+def test_reachable_stops(sample_tables, max_transfers):
+    stops, transfers = sample_tables
+    index = build_reachability_index(stops, transfers)
+    rng = np.random.default_rng(0)
+    stop_ids = stops['stop_id'].unique()
+    for origin in rng.choice(stop_ids, 20, replace=False).tolist():
+        origin_stops = [origin, 'unknown_stop']
+        assert index.reachable_stops(origin_stops, max_transfers) == \
+            breadth_first_search(stops, transfers, origin_stops, max_transfers)
@@ -0,0 +1,138 @@
+import numpy as np
+import pytest
+from rdflib import Literal, URIRef
+from rdflib.namespace import Namespace
+from network_index import NetworkIndex
+from find_routes import find_routes, select_best_routes, find_path_distances, describe_path, get_path_stops
+from routing import find_journeys, find_station_journeys
+
+EX = Namespace('http://example.com/gtfs#')
+
+def baseline_find_routes(g, origin_stops, destination_stops):
+    """
+    Paths with at most one transfer, found with triple patterns on the RDF graph as find_routes first did.
+    """
+    paths = []
+    for origin in origin_stops:
+        origin = URIRef(EX[origin])
+        for destination in destination_stops:
+            destination = URIRef(EX[destination])
+            for origin_route in g.objects(origin, EX.has_route):
+                for destination_route in g.objects(destination, EX.has_route):
+                    if origin_route == destination_route:
+                        paths.append((origin, origin_route, origin, origin, destination_route, destination))
+                        continue
+                    for mid_stop_1 in g.subjects(EX.has_route, origin_route):
+                        for transfer in g.subjects(EX.has_transfer_from, mid_stop_1):
+                            mid_stop_2 = g.value(transfer, EX.has_transfer_to)
+                            if (mid_stop_2, EX.has_route, destination_route) in g:
+                                paths.append((origin, origin_route, mid_stop_1, mid_stop_2, destination_route, destination))
+    return paths
+
+def summarize(paths):
+    return [(path['origin_route_mode'], path['destination_route_mode'], path['distance']) for path in paths]
+
+def describe_paths(network, paths):
+    distances = find_path_distances(network, paths)
+    return [describe_path(network, path, distance) for path, distance in zip(paths, distances.tolist())]
+
+def rides_another_route(path):
+    routes = path[1::3]
+    return len(path) == 6 and path[0] == path[2] == path[3] or all(a != b for a, b in zip(routes[:-1], routes[1:]))
+
+def check_against_baseline(g, network, queries):
+    found = 0
+    for origin_stops, destination_stops in queries:
+        baseline = baseline_find_routes(g, origin_stops, destination_stops)
+        journeys = find_journeys(network, origin_stops, destination_stops, 1)
+        # every path is one of the baseline, and the best ones are as short
+        assert set(journeys) <= set(baseline)
+        expected = select_best_routes(network, baseline)
+        assert summarize(select_best_routes(network, journeys)) == summarize(expected)
+        # the selected stops and routes are those of a baseline path, which might be another one of the same distance
+        described = describe_paths(network, baseline)
+        for path in select_best_routes(network, journeys):
+            assert path in described
+        found += len(expected)
+    assert found > 0
+
+def test_find_journeys_one_transfer(sample_graph, sample_network, sample_queries):
+    check_against_baseline(sample_graph, sample_network, sample_queries[:8])
+
+def test_find_journeys_one_transfer_along_routes(synthetic_graph, synthetic_network, synthetic_queries):
+    # the rides are measured along the directions of the routes, some of them impossible
+    assert synthetic_network.route_patterns_ptr is not None
+    check_against_baseline(synthetic_graph, synthetic_network, synthetic_queries)
+
+@pytest.mark.parametrize('max_transfers', [1, 2, 3])
+def test_transfers_change_route(synthetic_network, synthetic_queries, max_transfers):
+    for origin_stops, destination_stops in synthetic_queries:
+        for path in find_journeys(synthetic_network, origin_stops, destination_stops, max_transfers):
+            assert rides_another_route(path), path
+        for path in find_station_journeys(synthetic_network, origin_stops, destination_stops, max_transfers):
+            assert rides_another_route(path), path
+
+def check_station_paths(g, network, queries):
+    """
+    The paths between stations ride routes that serve their platforms and walk transfers or inside a station,
+    and the best ones are never longer than those of the baseline.
+    """
+    station_transfers = set(zip(np.repeat(np.arange(len(network.stations.stops)), np.diff(network.stations.transfers_ptr)).tolist(),
+                                network.stations.transfers.tolist()))
+    for origin_stops, destination_stops in queries:
+        baseline = set(baseline_find_routes(g, origin_stops, destination_stops))
+        paths = find_station_journeys(network, origin_stops, destination_stops, 1)
+        assert set(find_journeys(network, origin_stops, destination_stops, 1)) <= set(paths)
+        for path in paths:
+            if path in baseline:
+                continue
+            assert rides_another_route(path), path
+            stops = get_path_stops(path)
+            for i, route in enumerate(path[1::3]):
+                assert (stops[2 * i], EX.has_route, route) in g and (stops[2 * i + 1], EX.has_route, route) in g, path
+            for mid_stop_1, mid_stop_2 in zip(stops[1:-1:2], stops[2:-1:2]):
+                stations = network.stop_stations[[network.stop_index[mid_stop_1], network.stop_index[mid_stop_2]]].tolist()
+                assert tuple(stations) in station_transfers or stations[0] == stations[1] >= 0, path
+        selected = select_best_routes(network, paths)
+        expected = select_best_routes(network, list(baseline))
+        if expected:
+            assert selected[0]['distance'] <= expected[0]['distance'] + 1e-9
+        best = {(mode_from, mode_to): distance for mode_from, mode_to, distance in summarize(selected)}
+        for mode_from, mode_to, distance in summarize(expected):
+            assert best.get((mode_from, mode_to), -np.inf) <= distance + 1e-9
+
+def test_station_journeys(sample_graph, sample_station_network, sample_queries):
+    check_station_paths(sample_graph, sample_station_network, sample_queries[:8])
+
+def test_station_journeys_along_routes(synthetic_graph, synthetic_network, synthetic_queries):
+    check_station_paths(synthetic_graph, synthetic_network, synthetic_queries)
+
+def make_network():
+    """
+    Network where the shortest way to the stop b rides route R0, whose other direction goes from b to the destination d.
+
+    R0 goes from o to a and, in the other direction, from b to d; R2 goes from o to x. Both a and x are
+    a walk from b, the one from a the shortest.
+    """
+    names = ['o', 'a', 'b', 'd', 'x']
+    stops = [URIRef(EX[name]) for name in names]
+    routes = [URIRef(EX['R0']), URIRef(EX['R2'])]
+    mode = URIRef(EX['3'])
+    labels = {instance: Literal(str(instance).split('#')[-1]) for instance in stops + routes + [mode]}
+    lat = np.array([40.0, 40.0, 40.0, 40.0, 40.0])
+    lon = np.array([-3.0, -3.001, -3.0015, -3.02, -3.004])
+    stop_routes = ([0, 1, 2, 3, 0, 4], [0, 0, 0, 0, 1, 1])
+    transfers = ([1, 4], [2, 2])
+    route_patterns = ([0, 0, 0, 0, 1, 1], [0, 0, 1, 1, 0, 0], [0, 1, 2, 3, 0, 4], [0.0, 0.1, 0.0, 1.5, 0.0, 0.35])
+    route_transfers = ([1], [0], [4], [2])
+    return NetworkIndex(stops, routes, labels, {route: mode for route in routes}, lat, lon, stop_routes, transfers,
+                        route_transfers, route_patterns)
+
+def test_transfer_boards_another_route():
+    network = make_network()
+    expected = [(EX['o'], EX['R2'], EX['x'], EX['b'], EX['R0'], EX['d'])]
+    # alighting from R0 and boarding it again isn't a transfer, even if it's the shortest way
+    for max_transfers in [1, 2]:
+        assert find_journeys(network, ['o'], ['d'], max_transfers) == expected
+    # the direct ride on R0 goes against its direction, so the baseline selects the same path
+    assert select_best_routes(network, find_routes(network, ['o'], ['d'])) == select_best_routes(network, expected)
@@ -0,0 +1,63 @@
+import json
+import threading
+import urllib.error
+import urllib.request
+import pytest
+import server
+from find_coordinates import GazetteerGeocoder, configure_geocoding
+from find_stops import load_stop_index
+from server import PoolHTTPServer, try_answer_query
+
+@pytest.fixture(scope='module')
+def sample_stop_index(sample_path):
+    return load_stop_index(sample_path + 'stops.csv')
+
+@pytest.fixture(autouse=True)
+def gazetteer(tmp_path):
+    filename = str(tmp_path / 'gazetteer.csv')
+    with open(filename, 'w') as f:
+        f.write('street,city,lat,lon\nPuerta del Sol,Madrid,40.4168,-3.7038\n')
+    configure_geocoding(GazetteerGeocoder(filename), None)
+    server.configure_query_cache(0)
+    server.configure_query_limits(2)
+
+@pytest.mark.parametrize('query, status', [
+    ({'origin': [40.4168, -3.7038], 'destination': {'street': 'Puerta del Sol', 'city': 'Madrid'}}, None),
+    ({'origin': [40.4168, -3.7038], 'destination': [40.42, -3.70], 'max_transfers': 2}, None),
+    ([40.4168, -3.7038], 400),
+    ({'origin': [40.4168, -3.7038]}, 400),
+    ({'origin': ['north', -3.7038], 'destination': [40.42, -3.70]}, 400),
+    ({'origin': [40.4168], 'destination': [40.42, -3.70]}, 400),
+    ({'origin': 7, 'destination': [40.42, -3.70]}, 400),
+    ({'origin': {'street': 'Unknown street', 'city': 'Madrid'}, 'destination': [40.42, -3.70]}, 400),
+    ({'origin': [40.4168, -3.7038], 'destination': [40.42, -3.70], 'radius': 'far'}, 400),
+    ({'origin': [40.4168, -3.7038], 'destination': [40.42, -3.70], 'max_transfers': 3}, 400),
+    ({'origin': [40.4168, -3.7038], 'destination': [40.42, -3.70], 'max_transfers': -1}, 400),
+])
+def test_try_answer_query(sample_network, sample_stop_index, query, status):
+    response = try_answer_query(sample_network, sample_stop_index, query)
+    assert response.get('status') == status, response
+    assert ('error' in response) == (status is not None)
+
+def test_http_status(sample_network, sample_stop_index):
+    http_server = PoolHTTPServer(('127.0.0.1', 0), sample_network, sample_stop_index, 2)
+    thread = threading.Thread(target=http_server.serve_forever)
+    thread.start()
+    url = 'http://127.0.0.1:{}/route'.format(http_server.server_address[1])
+
+    def get_status(query, body=None):
+        try:
+            with urllib.request.urlopen(url + query, data=body) as response:
+                return response.status
+        except urllib.error.HTTPError as error:
+            return error.code
+
+    try:
+        assert get_status('?origin=40.4168,-3.7038&destination=40.42,-3.70') == 200
+        assert get_status('?origin=40.4168,north&destination=40.42,-3.70') == 400
+        assert get_status('?origin=40.4168,-3.7038&destination=40.42,-3.70&max_transfers=5') == 400
+        assert get_status('', json.dumps({'origin': [40.4168, -3.7038]}).encode()) == 400
+    finally:
+        http_server.shutdown()
+        http_server.server_close()
+        thread.join()
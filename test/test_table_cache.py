@@ -0,0 +1,38 @@
+import numpy as np
+import pandas as pd
+from table_cache import save_table, load_table, cached_table
+
+def make_table():
+    return pd.DataFrame({
+        'stop_id': ['par_4_1', 'par_4_2', np.nan, 'par_8_1'],
+        'stop_name': [np.nan, 'SOL', 'ÓPERA', ''],
+        'stop_lat': [40.46682, np.nan, 40.41803, 40.4168],
+        'stop_sequence': np.array([1, 2, 3, 4], dtype=np.int64),
+    })
+
+def test_round_trip(tmp_path):
+    cache_path = str(tmp_path) + '/'
+    table = make_table()
+    assert save_table(table, ['stops.txt', 10, 20], cache_path)
+    loaded = load_table(('stops.txt', 10, 20), cache_path)
+    pd.testing.assert_frame_equal(loaded, table)
+    # missing and empty text are kept apart
+    assert pd.isna(loaded['stop_id'][2]) and loaded['stop_name'][3] == ''
+    assert load_table(['stops.txt', 10, 21], cache_path) is None
+
+def test_unsupported_column(tmp_path):
+    table = pd.DataFrame({'values': [1, 'a']})
+    assert not save_table(table, 'key', str(tmp_path) + '/')
+    assert load_table('key', str(tmp_path) + '/') is None
+
+def test_cached_table(tmp_path):
+    cache_path = str(tmp_path) + '/'
+    calls = []
+    def build():
+        calls.append(None)
+        return make_table()
+    first = cached_table('key', cache_path, build)
+    second = cached_table('key', cache_path, build)
+    assert len(calls) == 1
+    pd.testing.assert_frame_equal(first, second)
+    assert cached_table('key', None, build) is not None and len(calls) == 2
@@ -0,0 +1,50 @@
+import os
+from data_reading import build_graph
+from validation import validate_processed_data, validate_graph, result_keys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SHAPES = os.path.join(ROOT, 'test', 'gtfs_shapes.txt')
+ONTOLOGY = os.path.join(ROOT, 'data', 'ontology', 'gtfs.ttl')
+
+def write_processed(path):
+    (path / 'routes.csv').write_text(
+        'route_id,route_short_name,route_long_name,route_type\n'
+        '4__1___,1,Pinar de Chamartín-Valdecarros,mode_1\n'
+        '4__2___,2,Las Rosas-Cuatro Caminos,mode_1\n'
+        '6__147___,147,Callao-Barrio del Pilar,mode_3\n', encoding='utf-8')
+    (path / 'stops.csv').write_text(
+        'stop_id,stop_name,stop_lat,stop_lon,route_id\n'
+        'par_4_1,PLAZA DE CASTILLA,40.46682,-3.68918,4__1___\n'
+        'par_4_1,PLAZA DE CASTILLA,40.46682,-3.68918,4__2___\n'
+        # a second coordinate of the same stop
+        'par_4_2,CUATRO CAMINOS,40.44700,-3.70380,4__2___\n'
+        'par_4_2,CUATRO CAMINOS,40.44720,-3.70390,4__1___\n'
+        # out of the bounds of the shapes
+        'par_6_1,SOL,43.41690,-3.70350,6__147___\n'
+        'par_6_2,CALLAO,40.41990,-2.70580,6__147___\n'
+        # two names
+        'par_6_3,GRAN VIA,40.41980,-3.70180,6__147___\n'
+        'par_6_3,GRAN VÍA,40.41980,-3.70180,6__147___\n', encoding='utf-8')
+    (path / 'transfers.csv').write_text(
+        'transfer_id,transfer_from,transfer_to\n'
+        'par_4_1_to_par_4_2,par_4_1,par_4_2\n'
+        'par_6_2_to_par_6_3,par_6_2,par_6_3\n', encoding='utf-8')
+
+def test_compiled_checks_match_pyshacl(tmp_path):
+    write_processed(tmp_path)
+    processed_path = str(tmp_path) + '/'
+    results = validate_processed_data(SHAPES, processed_path, processed_path + 'feeds/')
+    reference = validate_graph(build_graph(ONTOLOGY, processed_path), SHAPES)
+    assert result_keys(results) == result_keys(reference)
+    components = {result['constraint_component'].strip('<>').split('#')[-1] for result in results}
+    assert {'MaxCountConstraintComponent', 'MaxInclusiveConstraintComponent'} <= components
+    assert len(results) == 5
+
+def test_valid_data_conforms(tmp_path):
+    write_processed(tmp_path)
+    stops = (tmp_path / 'stops.csv').read_text(encoding='utf-8').splitlines()
+    (tmp_path / 'stops.csv').write_text('\n'.join(stops[:3]) + '\n', encoding='utf-8')
+    (tmp_path / 'transfers.csv').write_text('transfer_id,transfer_from,transfer_to\n', encoding='utf-8')
+    processed_path = str(tmp_path) + '/'
+    assert validate_processed_data(SHAPES, processed_path, processed_path + 'feeds/') == []
+    assert validate_graph(build_graph(ONTOLOGY, processed_path), SHAPES) == []